@@ -45,6 +45,7 @@ class AimlHandler(ContentHandler):
         self._currentThat    = ""
         self._currentTopic   = ""
         self._insideTopic = False
+        self._currentSet = None # the name of the <set> being read in a pattern
         self._currentUnknown = "" # the name of the current unknown element
 
         # This is set to true when a parse error occurs in a category.
@@ -54,6 +55,11 @@ class AimlHandler(ContentHandler):
         # query with getNumErrors().  If 0, the document is AIML-compliant.
         self._numParseErrors = 0
 
+        # The errors themselves (see getErrors()), and the stream where they
+        # are written as they are found (if any)
+        self._errors = []
+        self._errorStream = sys.stderr
+
         # TODO: select the proper validInfo table based on the version number.
         self._validInfo = self._validationInfo101
 
@@ -80,6 +86,18 @@ class AimlHandler(ContentHandler):
         "Return the number of errors found while parsing the current document."
         return self._numParseErrors
 
+    def getErrors(self):
+        """Return the errors found while parsing, as a list of dictionaries
+        with their line, column and message."""
+        return list(self._errors)
+
+    def setErrorStream(self, stream):
+        """
+        Set the stream where parse errors are written as they are found
+        (sys.stderr by default). With None they are only recorded.
+        """
+        self._errorStream = stream
+
     def setEncoding(self, encoding):
         """
         Set the text encoding to use when encoding strings read from XML.
@@ -93,6 +111,18 @@ class AimlHandler(ContentHandler):
         column = self._locator.getColumnNumber()
         return "(line %d, column %d)" % (line, column)
 
+    def _reportError(self, err):
+        """Record a parse error, and skip the category it happened in."""
+        self._errors.append({"line": self._locator.getLineNumber(),
+                             "column": self._locator.getColumnNumber(),
+                             "message": unicode(err)})
+        if self._errorStream is not None:
+            self._errorStream.write("PARSE ERROR: %s\n" % err)
+        self._numParseErrors += 1 # increment error count
+        # In case of a parse error, if we're inside a category, skip it.
+        if self._state >= self._STATE_InsideCategory:
+            self._skipCurrentCategory = True
+
     def _pushWhitespaceBehavior(self, attr):
         """Push a new string onto the whitespaceBehaviorStack.
 
@@ -134,13 +164,7 @@ class AimlHandler(ContentHandler):
         # process this start-element.
         try: self._startElement(name, attr)
         except AimlParserError as err:
-            # Print the error message
-            sys.stderr.write("PARSE ERROR: %s\n" % err)
-            
-            self._numParseErrors += 1 # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_InsideCategory:
-                self._skipCurrentCategory = True
+            self._reportError(err)
             
     def _startElement(self, name, attr):
         if name == "aiml":
@@ -187,6 +211,7 @@ class AimlHandler(ContentHandler):
             self._state = self._STATE_InsideCategory
             self._currentPattern = u""
             self._currentThat = u""
+            self._currentSet = None
             # If we're not inside a topic, the topic is implicitly set to *
             if not self._insideTopic: self._currentTopic = u"*"
             self._elemStack = []
@@ -212,6 +237,10 @@ class AimlHandler(ContentHandler):
             self._state = self._STATE_InsideTemplate
             self._elemStack.append(['template',{}])
             self._pushWhitespaceBehavior(attr)
+        elif self._state in (self._STATE_InsidePattern, self._STATE_InsideThat) and \
+             name == "set" and self._currentSet is None:
+            # An AIML 2.0 set: its name is read until </set>
+            self._currentSet = u""
         elif self._state == self._STATE_InsidePattern:
             # Certain tags are allowed inside <pattern> elements.
             if name == "bot" and "name" in attr and attr["name"] == u"name":
@@ -266,16 +295,13 @@ class AimlHandler(ContentHandler):
             return
         try: self._characters(ch)
         except AimlParserError as msg:
-            # Print the message
-            sys.stderr.write("PARSE ERROR: %s\n" % msg)
-            self._numParseErrors += 1 # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_InsideCategory:
-                self._skipCurrentCategory = True
+            self._reportError(msg)
             
     def _characters(self, ch):
         text = unicode(ch)
-        if self._state == self._STATE_InsidePattern:
+        if self._currentSet is not None:
+            self._currentSet += text
+        elif self._state == self._STATE_InsidePattern:
             # TODO: text inside patterns must be upper-case!
             self._currentPattern += text
         elif self._state == self._STATE_InsideThat:
@@ -346,12 +372,7 @@ class AimlHandler(ContentHandler):
             return
         try: self._endElement(name)
         except AimlParserError as msg:
-            # Print the message
-            sys.stderr.write("PARSE ERROR: %s\n" % msg)
-            self._numParseErrors += 1 # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_InsideCategory:
-                self._skipCurrentCategory = True
+            self._reportError(msg)
 
     def _endElement(self, name):
         """
@@ -396,6 +417,18 @@ class AimlHandler(ContentHandler):
                 raise AimlParserError( "Unexpected </template> tag "+self._location() )
             self._state = self._STATE_AfterTemplate
             self._whitespaceBehaviorStack.pop()
+        elif name == "set" and self._currentSet is not None:
+            # Insert the set as a single word, which the PatternMgr matches
+            # against the entries of the set
+            setName = self._currentSet.strip()
+            self._currentSet = None
+            if not setName or len(setName.split()) > 1:
+                raise AimlParserError( "Invalid set name in <set> element "+self._location() )
+            word = u" <set>%s</set> " % setName
+            if self._state == self._STATE_InsidePattern:
+                self._currentPattern += word
+            else:
+                self._currentThat += word
         elif self._state == self._STATE_InsidePattern:
             # Certain tags are allowed inside <pattern> elements.
             if name not in ["bot"]:
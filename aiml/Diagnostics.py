@@ -0,0 +1,222 @@
+"""This module implements the Diagnostics class, which sends the warnings
+issued by a Kernel while responding (no match found, unknown elements,
+<system> errors...) to the "aiml" logger.
+
+By default the "aiml" logger is left to the application, like any
+library's: it has a NullHandler and propagates its records. Writing them
+can block, though, and the Kernel issues its diagnostics while holding
+the lock that serializes responses, so:
+ - once startQueue() has been called (Kernel.setDiagnostics() does), the
+   records are put in a queue, and passed by a background thread to the
+   handlers configured by the application (those of the "aiml" logger
+   when the queue is started, and those of the root logger), or else
+   written to sys.stderr. The "aiml" logger does not propagate them to
+   the root logger itself meanwhile. If the queue is full, they are
+   dropped rather than waited for.
+ - each kind of message is let through at most `burst` times every
+   `period` seconds; the number of messages suppressed meanwhile is
+   added to the next one that gets through
+
+Usage:
+    > diagnostics = Diagnostics(burst=5, period=60)
+    > diagnostics.log(logging.INFO, "No match found for input: %s", input_)
+The metrics() method returns the counters.
+"""
+
+from __future__ import print_function
+
+import atexit
+import logging
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2
+    QueueHandler = QueueListener = None
+
+from .constants import *
+
+logger = logging.getLogger("aiml")
+_nullHandler = logging.NullHandler()
+logger.addHandler(_nullHandler)
+
+_FORMAT = "%(levelname)s: %(message)s"
+
+_queueLock = threading.Lock()
+_queueHandler = None
+_listener = None
+# the handlers of the "aiml" logger moved behind the queue, and its
+# settings before startQueue()
+_moved = []
+_settings = None
+
+
+class _RootHandler(logging.Handler):
+    """A handler that passes the records on to the handlers of the root
+    logger (as they are when each record arrives), or writes them to
+    sys.stderr if it has none."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self._default = logging.StreamHandler(sys.stderr)
+        self._default.setFormatter(logging.Formatter(_FORMAT))
+
+    def emit(self, record):
+        root = logging.getLogger()
+        if root.handlers:
+            root.handle(record)
+        else:
+            self._default.handle(record)
+
+
+if QueueHandler is not None:
+    class _DroppingQueueHandler(QueueHandler):
+        """A QueueHandler that drops the records it cannot queue at once,
+        instead of reporting an error."""
+
+        dropped = 0
+
+        def enqueue(self, record):
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    class _QueueListener(QueueListener):
+        """A QueueListener that waits for room in the queue when stopped,
+        so that the records already queued are written."""
+
+        def enqueue_sentinel(self):
+            self.queue.put(self._sentinel)
+
+
+def startQueue(handler=None, maxSize=10000):
+    """Send the records of the "aiml" logger through a queue (of up to
+    maxSize records) to handlers called by a background thread: the given
+    one, or else the handlers the "aiml" logger has now (which are moved
+    behind the queue) followed by those of the root logger, or sys.stderr
+    if there are none.  A previous queue is stopped first.  In Python 2,
+    which has no QueueHandler, the handlers are called directly.
+
+    The settings of the logger are restored by stopQueue().
+    """
+    with _queueLock:
+        _stopQueue()
+        _startQueue(handler, maxSize)
+
+
+def ensureQueue():
+    """Start the default queue (see startQueue()), unless one is running."""
+    with _queueLock:
+        if _queueHandler is None:
+            _startQueue(None, 10000)
+
+
+def _startQueue(handler, maxSize):
+    """startQueue(), with the queue lock held and no queue running"""
+    global _queueHandler, _listener, _moved, _settings
+    _settings = (logger.propagate, logger.level)
+    if handler is not None:
+        handlers = [handler]
+    else:
+        _moved = [h for h in logger.handlers if h is not _nullHandler]
+        for moved in _moved:
+            logger.removeHandler(moved)
+        handlers = _moved + [_RootHandler()]
+    if QueueHandler is None:
+        for target in handlers:
+            logger.addHandler(target)
+        _queueHandler = handlers[-1]
+    else:
+        _queueHandler = _DroppingQueueHandler(queue.Queue(maxSize))
+        _listener = _QueueListener(_queueHandler.queue, *handlers,
+                                   respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(_queueHandler)
+    logger.propagate = False
+    if logger.level == logging.NOTSET:
+        # the Kernels decide which levels to log
+        logger.setLevel(logging.DEBUG)
+
+
+def stopQueue():
+    """Write the queued records, stop the queue started by startQueue(),
+    and restore the handlers and settings of the "aiml" logger."""
+    with _queueLock:
+        _stopQueue()
+
+
+def _stopQueue():
+    """stopQueue(), with the queue lock held"""
+    global _queueHandler, _listener, _moved, _settings
+    if _listener is not None:
+        _listener.stop()
+    if _queueHandler is not None:
+        for target in list(logger.handlers):
+            if target is not _nullHandler:
+                logger.removeHandler(target)
+        for moved in _moved:
+            logger.addHandler(moved)
+        logger.propagate, level = _settings
+        logger.setLevel(level)
+    _queueHandler = _listener = None
+    _moved = []
+    _settings = None
+
+
+def droppedRecords():
+    """Return the number of records dropped because the queue was full."""
+    return getattr(_queueHandler, "dropped", 0)
+
+
+atexit.register(stopQueue)
+
+
+class Diagnostics(object):
+    """Rate-limited sender of Kernel diagnostics to the "aiml" logger."""
+
+    def __init__(self, burst=10, period=60.0):
+        """Create a sender that lets through each kind of message (i.e.
+        each format string) at most `burst` times every `period` seconds.
+        """
+        self._burst = burst
+        self._period = period
+        # format string -> [start of the period, messages, suppressed]
+        self._periods = {}
+        self._metrics = dict.fromkeys(("emitted", "suppressed"), 0)
+
+    def metrics(self):
+        """Return a dictionary with the number of messages emitted and
+        suppressed, and of those dropped because the queue was full."""
+        metrics = dict(self._metrics)
+        metrics["dropped"] = droppedRecords()
+        return metrics
+
+    def log(self, level, msg, *args):
+        """Log a message, formatted with args as by the logging module,
+        unless too many of its kind have been logged recently."""
+        now = time.time()
+        current = self._periods.get(msg)
+        suppressed = 0
+        if current is None or now - current[0] >= self._period:
+            if current is not None:
+                suppressed = current[2]
+            current = self._periods[msg] = [now, 0, 0]
+        if current[1] >= self._burst:
+            current[2] += 1
+            self._metrics["suppressed"] += 1
+            return
+        current[1] += 1
+        self._metrics["emitted"] += 1
+        if suppressed:
+            msg += " (%d similar messages suppressed)"
+            args += (suppressed,)
+        logger.log(level, msg, *args)
@@ -5,29 +5,25 @@ from __future__ import print_function
 
 from collections import namedtuple
 
-import copy
-import glob
+import gc
+import io
+import marshal
 import os
-import random
 import re
 import string
 import sys
 import time
 import threading
-import xml.sax
-from collections import namedtuple
-try:
-    from ConfigParser import ConfigParser
-except ImportError:
-    from configparser import ConfigParser
 
 from .constants import *
-from . import DefaultSubs
 from . import Utils
-from .AimlParser import create_parser
 from .PatternMgr import PatternMgr
 from .WordSub import WordSub
 
+# The modules needed only to parse AIML files, load substitutions, run
+# <system> commands and so on are imported on first use, so that importing
+# the package (and working from a saved brain) stays fast
+
 
 
 def msg_encoder(encoding=None):
@@ -46,6 +42,71 @@ def msg_encoder(encoding=None):
 
 Result = namedtuple('Result', 'patterns response')
 
+
+def _collapseText(elem):
+    """Reduce all stretches of whitespace in a text element whose whitespace
+    behavior is "default" to a single space.  This is done once, the result
+    replaces the original text and the element is marked as "preserve".
+    """
+    if elem[1]["xml:space"] == "default":
+        elem[2] = re.sub(r"\s+", " ", elem[2])
+        elem[1]["xml:space"] = "preserve"
+
+# Identification of the files written by Kernel.saveSnapshot()
+SNAPSHOT_MAGIC = b"python-aiml snapshot\n"
+SNAPSHOT_VERSION = 1
+
+def readSnapshotHeader(filename):
+    """Return the header of a snapshot file written by Kernel.saveSnapshot(),
+    without reading the rest of it. It is a dictionary with:
+        version: version of the file format
+        aimlVersion: version of python-aiml that wrote it
+        created: time.time() when it was written
+        categories: number of categories in the brain
+        overlay: True if the brain is an overlay over a shared brain
+        sessions: True if it includes the session data
+        meta: the dictionary given to saveSnapshot()
+    Raises ValueError if the file is not a snapshot, or if its format
+    version is not supported.
+    """
+    with open(filename, "rb") as inFile:
+        return _readSnapshotHeader(inFile)
+
+def _readSnapshotHeader(inFile):
+    if inFile.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError("not a python-aiml snapshot: %s" % inFile.name)
+    header = marshal.load(inFile)
+    if header.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot version %s in %s" %
+                         (header.get("version"), inFile.name))
+    return header
+
+
+_defaultSubbers = None
+_defaultSubbersLock = threading.Lock()
+
+def _sharedSubbers(cacheSize):
+    """Return the dictionary with the default subbers (from DefaultSubs).
+    They are built only once per process, and frozen, so that all Kernels
+    can share them; a Kernel that loads its own substitutions replaces
+    them in its own copy of the dictionary. The cacheSize of the gender,
+    person and person2 subbers is the one given when they are built.
+    """
+    global _defaultSubbers
+    with _defaultSubbersLock:
+        if _defaultSubbers is None:
+            from . import DefaultSubs
+            subbers = {}
+            for name, defaults, size in (
+                    ('gender', DefaultSubs.defaultGender, cacheSize),
+                    ('person', DefaultSubs.defaultPerson, cacheSize),
+                    ('person2', DefaultSubs.defaultPerson2, cacheSize),
+                    ('normal', DefaultSubs.defaultNormal, 0)):
+                subbers[name] = WordSub(defaults, size)
+                subbers[name].freeze()
+            _defaultSubbers = subbers
+    return _defaultSubbers
+
 class Kernel:
     # module constants
     _globalSessionID = "_global" # key of the global session (duh)
@@ -55,12 +116,57 @@ class Kernel:
     _inputHistory = "_inputHistory"     # keys to a queue (list) of recent user input
     _outputHistory = "_outputHistory"   # keys to a queue (list) of recent responses.
     _inputStack = "_inputStack"         # Should always be empty in between calls to respond()
-
-    def __init__(self):
+    # size of the result cache of the subbers applied to template output
+    # (mostly short and repetitive)
+    _subCacheSize = 1024
+    # elements whose output depends only on their contents (and on the bot
+    # predicates and subbers), so that templates made only of them always
+    # produce the same response
+    _staticElements = frozenset(("template", "text", "bot", "think", "version",
+                                 "formal", "lowercase", "uppercase", "sentence",
+                                 "gender", "person", "person2"))
+
+    def __init__(self, sharedBrain=None):
+        """Create a Kernel.
+
+        If a `sharedBrain` (as returned by shareBrain()) is given, the Kernel
+        uses it as the base for its own brain instead of starting from an
+        empty one: everything it learns goes into a private overlay, and
+        its bot predicates (including the name) are its own.
+        """
         self._verboseMode = True
+        # the level set by setDiagnostics(), which overrides verbose()
+        self._diagnosticLevel = None
+        self._diagnosticLevelSet = False
+        self._diagnostics = None
+        self._diagnosticLimits = (10, 60.0)
         self._version = "python-aiml {}".format(VERSION)
-        self._brain = PatternMgr()
+        self._brain = PatternMgr(sharedBrain)
+        self._learnedFiles = []
+        self._provenance = None
+        self._replacedCategories = []
+        self._fileMemory = None
+        self._startedTracing = False
+        self._staticResponses = {}
+        self._system = None
+        self._recorder = None
+        self._recorderFile = None
+        self._randomSeed = None
+        self._sessionRandom = {}
         self._respondLock = threading.RLock()
+        # True while a response holds the lock (see _processSystem()), and
+        # the sessions whose response runs a <system> command without it
+        self._responding = False
+        self._busySessions = set()
+        self._sessionFree = threading.Condition(self._respondLock)
+        self._respondMetrics = dict.fromkeys(("lockWait", "maxLockWait",
+                                              "respondTime", "maxRespondTime"), 0.0)
+        self._respondMetrics["calls"] = 0
+        self._respondMetrics["timeouts"] = 0
+        self._defaultDeadline = None
+        self._deadlineFallback = u""
+        self._deadline = None
+        self._timedOut = False
         self.setTextEncoding(None if PY3 else "utf-8")
 
         # set up the sessions
@@ -71,12 +177,8 @@ class Kernel:
         self._botPredicates = {}
         self.setBotPredicate("name", "Nameless")
 
-        # set up the word substitutors (subbers):
-        self._subbers = {}
-        self._subbers['gender'] = WordSub(DefaultSubs.defaultGender)
-        self._subbers['person'] = WordSub(DefaultSubs.defaultPerson)
-        self._subbers['person2'] = WordSub(DefaultSubs.defaultPerson2)
-        self._subbers['normal'] = WordSub(DefaultSubs.defaultNormal)
+        # set up the word substitutors (subbers), sharing the default ones
+        self._subbers = dict(_sharedSubbers(self._subCacheSize))
 
         # Stack required for us to understand the sequence of patterns
         self.patMatchesStack = []
@@ -128,7 +230,7 @@ class Kernel:
         specified AIML files.
 
         Finally, each of the input strings in the `commands` list is
-        passed to respond().
+        passed to respond() (and the response printed, in verbose mode).
 
         The `chdir` argument makes the it change to that directory before
         performing any learn or command execution (but after loadBrain
@@ -155,19 +257,67 @@ class Kernel:
             if isinstance(commands, (str, unicode)):
                 commands = (commands,)
             for cmd in commands:
-                print(self._respond(cmd, self._globalSessionID))
+                response = self._respond(cmd, self._globalSessionID)
+                if self._verboseMode:
+                    print(response)
 
         finally:
             if chdir:
                 os.chdir(prev)
 
+        # Build the matcher metadata and the static responses now, rather
+        # than on the first response
+        self._brain.compile()
+        self._renderStatic()
+
         if self._verboseMode:
             print("Kernel bootstrap completed in %.2f seconds" % (time.time() - start))
 
     def verbose(self, isVerbose=True):
-        """Enable/disable verbose output mode."""
+        """Enable/disable verbose output mode: progress messages, and,
+        unless setDiagnostics() has been called, all the diagnostics issued
+        while responding."""
         self._verboseMode = isVerbose
 
+    def setDiagnostics(self, level=LOG_WARNING, burst=10, period=60.0):
+        """Set the lowest level (as in the logging module) of the
+        diagnostics issued while responding, from now on regardless of
+        verbose():
+            logging.INFO: also inputs with no match and missing
+                <input>/<that> history entries
+            logging.WARNING: recursion limit, unknown elements and
+                failed <condition> elements
+            logging.ERROR: only failed <system> commands
+            None: no diagnostics
+        They go to the "aiml" logger, and at most `burst` messages of each
+        kind are issued every `period` seconds.  Unless the level is None,
+        this also starts the queue of the Diagnostics module (if it is not
+        running), so that responses never wait for them to be written.
+        Otherwise they are handled as configured by the application.
+        """
+        if level is not None:
+            from .Diagnostics import ensureQueue
+            ensureQueue()
+        with self._respondLock:
+            self._diagnosticLevel = level
+            self._diagnosticLevelSet = True
+            if (burst, period) != self._diagnosticLimits:
+                self._diagnosticLimits = (burst, period)
+                self._diagnostics = None
+
+    def _diagnose(self, level, msg, *args):
+        """Issue a diagnostic message, if its level is enabled"""
+        if self._diagnosticLevelSet:
+            threshold = self._diagnosticLevel
+        else:
+            threshold = LOG_INFO if self._verboseMode else None
+        if threshold is None or level < threshold:
+            return
+        if self._diagnostics is None:
+            from .Diagnostics import Diagnostics
+            self._diagnostics = Diagnostics(*self._diagnosticLimits)
+        self._diagnostics.log(level, msg, *args)
+
     def version(self):
         """Return the Kernel's version string."""
         return self._version
@@ -177,6 +327,205 @@ class Kernel:
         # there's a one-to-one mapping between templates and categories
         return self._brain.numTemplates()
 
+    def learnedFiles(self):
+        """Return the (absolute) names of the AIML files learned so far,
+        directly or through <learn> elements."""
+        return list(self._learnedFiles)
+
+    def setProvenance(self, enabled=True):
+        """Enable/disable keeping track of the file each category is learned
+        from, which lets analyze() report where the categories it finds come
+        from. It is disabled by default, since it takes memory; only the
+        categories learned while it is enabled are tracked."""
+        self._provenance = {} if enabled else None
+        self._replacedCategories = []
+
+    def setTopicPartitioning(self, enabled=True):
+        """Enable/disable splitting the brain by topic, so that matching
+        only walks the categories that can apply to the current topic (see
+        PatternMgr.setTopicPartitioning()). For a Kernel over a shared
+        brain, this applies to its own categories; the shared brain must be
+        split before it is shared."""
+        with self._respondLock:
+            self._brain.setTopicPartitioning(enabled)
+
+    def setFuzzyMatching(self, enabled=True, maxDistance=2, threshold=0.8,
+                         budget=0.005):
+        """Enable/disable correcting typos in the inputs that would only match
+        the catch-all category (see PatternMgr.setFuzzyMatching()). The
+        counters are reported by stats()."""
+        with self._respondLock:
+            self._brain.setFuzzyMatching(enabled, maxDistance, threshold, budget)
+
+    def setMemoryTracing(self, enabled=True):
+        """Enable/disable measuring the memory allocated while learning each
+        AIML file (with tracemalloc, which is started if it is not already
+        running, and slows down all allocations; it is stopped again when
+        tracing is disabled). The results are reported by memoryReport().
+        Python 3 only."""
+        import tracemalloc
+        if enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._startedTracing = True
+            self._fileMemory = {}
+        else:
+            if self._startedTracing:
+                tracemalloc.stop()
+                self._startedTracing = False
+            self._fileMemory = None
+
+    def analyze(self):
+        """Look for the categories in the brain that are of no use, and
+        return a dictionary with lists of them:
+            replaced: (category, file, replacingFile) tuples for the
+                categories that were learned again, replacing the first one
+                (only while provenance is enabled, see setProvenance())
+            unreachable: (category, file) tuples for the categories that
+                can never be matched (see PatternMgr.unreachable())
+            duplicateTemplates: lists of categories whose templates are
+                identical, and could be shared
+        Categories are (pattern, that, topic) tuples. The file is None if
+        it is not known.
+        """
+        provenance = self._provenance or {}
+        unreachable = [(data, provenance.get(data))
+                       for data, template in self._brain.unreachable()]
+        templates = {}
+        for data, template in self._brain.categories():
+            templates.setdefault(marshal.dumps(template), []).append(data)
+        return {"replaced": list(self._replacedCategories),
+                "unreachable": unreachable,
+                "duplicateTemplates": [sorted(group) for group in templates.values()
+                                       if len(group) > 1]}
+
+    def prune(self):
+        """Remove the unreachable categories from the brain, and make all
+        the identical templates a single object (which is also saved only
+        once). Returns a tuple with the number of categories removed and
+        the number of templates shared.
+        """
+        with self._respondLock:
+            unreachable = [data for data, template in self._brain.unreachable()]
+            for data in unreachable:
+                self._brain.remove(data)
+                if self._provenance is not None:
+                    self._provenance.pop(data, None)
+            shared = self._brain.shareTemplates()
+            self._staticResponses = {}
+            self._brain.compile()
+            self._renderStatic()
+        return len(unreachable), shared
+
+    def stats(self):
+        """Return a dictionary with statistics about the Kernel:
+            categories: number of categories in the brain
+            nodes: number of nodes in the pattern tree
+            replaced: number of categories learned over an identical one
+            staticTemplates: number of templates whose response is constant
+            staticRatio: fraction of the templates that are static
+            system: metrics of the <system> executor (once it has been used)
+            fuzzy: counters of the fuzzy matching fallback (when enabled)
+            diagnostics: counters of the diagnostics (once one is issued)
+        """
+        total = static = 0
+        for template in self._brain.templates():
+            total += 1
+            if self._isStatic(template):
+                static += 1
+        stats = {"categories": self.numCategories(),
+                 "nodes": self._brain.numNodes(),
+                 "replaced": self._brain.numReplaced(),
+                 "staticTemplates": static,
+                 "staticRatio": float(static)/total if total else 0.0}
+        if self._system is not None:
+            stats["system"] = self._system.metrics()
+        fuzzy = self._brain.fuzzyMetrics()
+        if fuzzy is not None:
+            stats["fuzzy"] = fuzzy
+        if self._diagnostics is not None:
+            stats["diagnostics"] = self._diagnostics.metrics()
+        return stats
+
+    def memoryReport(self, top=10):
+        """Return an estimate of the memory (in bytes) taken by the Kernel,
+        as a dictionary:
+            components: the memory taken by each part of the Kernel: nodes,
+                keys, templates and index of the brain (see
+                PatternMgr.memoryUsage()), sharedBrain (the brain this
+                Kernel is an overlay of, if any), subbers, sessions,
+                botPredicates, staticResponses and provenance
+            total: the sum of all components
+            branches: the `top` first pattern words with the largest
+                subtrees, as (word, bytes) tuples
+            files: the memory taken by the templates of the categories
+                learned from each file (only those learned while
+                provenance is enabled, see setProvenance())
+            allocated: the memory allocated (and not freed) while learning
+                each file (only while memory tracing is enabled, see
+                setMemoryTracing())
+        Files are given by their absolute names.
+        Every object is counted once, in the first component it is found.
+        """
+        from .Utils import deepSize
+        with self._respondLock:
+            seen = set()
+            brain = self._brain.memoryUsage(top, seen)
+            components = dict((name, brain[name]) for name
+                              in ("nodes", "keys", "templates", "index"))
+            files = {}
+            if self._provenance:
+                counted = set()
+                for data, template in self._brain.categories():
+                    filename = self._provenance.get(data)
+                    if filename is not None:
+                        files[filename] = (files.get(filename, 0) +
+                                           deepSize(template, counted))
+            base = self._brain.base()
+            components["sharedBrain"] = 0
+            if base is not None:
+                usage = base.memoryUsage(0, seen)
+                components["sharedBrain"] = sum(usage[name] for name in components
+                                                if name in usage)
+            components["subbers"] = sum(deepSize(subber, seen) + deepSize(vars(subber), seen)
+                                        for subber in self._subbers.values())
+            for name, obj in (("sessions", self._sessions),
+                              ("botPredicates", self._botPredicates),
+                              ("staticResponses", self._staticResponses),
+                              ("provenance", self._provenance)):
+                components[name] = deepSize(obj, seen) if obj is not None else 0
+            report = {"components": components,
+                      "total": sum(components.values()),
+                      "branches": brain["branches"],
+                      "files": files}
+            if self._fileMemory is not None:
+                report["allocated"] = dict(self._fileMemory)
+            return report
+
+    def respondMetrics(self):
+        """Return a dictionary with the number of calls to respond() and
+        their timings in seconds: total and maximum time spent waiting for
+        the Kernel lock (lockWait, i.e. contention with other threads) and
+        holding it (respondTime), and the number of responses cut short by
+        their deadline (timeouts)."""
+        with self._respondLock:
+            return dict(self._respondMetrics)
+
+    def brainStats(self, top=10):
+        """Return a dictionary with detailed statistics about the brain:
+        the shape of its node tree, its wildcards, its longest categories
+        and largest branches and its estimated memory use (see
+        PatternMgr.stats()). For a Kernel over a shared brain, only its
+        own categories are included."""
+        with self._respondLock:
+            return self._brain.stats(top)
+
+    def dumpBrain(self, stream=None):
+        """Write the categories in the brain to a stream (sys.stdout by
+        default) as JSON lines (see PatternMgr.dump())."""
+        with self._respondLock:
+            self._brain.dump(stream)
+
     def resetBrain(self):
         """Reset the brain to its initial state.
 
@@ -184,9 +533,12 @@ class Kernel:
             del(kern)
             kern = aiml.Kernel()
 
+        For a Kernel working over a shared brain, only its own categories are
+        discarded; the shared brain is kept.
         """
+        sharedBrain = self._brain.base()
         del(self._brain)
-        self.__init__()
+        self.__init__(sharedBrain)
 
     def loadBrain(self, filename):
         """Attempt to load a previously-saved 'brain' from the
@@ -202,6 +554,97 @@ class Kernel:
             end = time.time() - start
             print( "done (%d categories in %.2f seconds)" % (self._brain.numTemplates(), end) )
 
+    def shareBrain(self):
+        """Freeze the current brain and return it, so that any number of
+        other Kernels can be created on top of it with
+        Kernel(sharedBrain=...) without loading it again.
+
+        A frozen brain can no longer be modified; this Kernel moves to a
+        private overlay over it, so it can still learn new categories.
+        """
+        brain = self._brain
+        self._finalizeBrain()
+        brain.freeze()
+        self._brain = PatternMgr(brain)
+        self._brain.setBotName(self.getBotPredicate("name"))
+        return brain
+
+    def prepareFork(self):
+        """Get the Kernel ready to be shared by worker processes created
+        with fork() after this call (e.g. by a preforking server).
+
+        The brain is finalized and frozen, so that nothing in it is written
+        to while responding: all template text is normalized in advance
+        and the matcher metadata is built. All objects existing at this
+        point are also moved out of reach of the garbage collector (in
+        Python >= 3.7), so that collections in the workers do not touch
+        them either. Together, this keeps the memory pages holding the
+        brain shared between the workers instead of each of them ending up
+        with a private copy.
+
+        No more categories can be learned after this call.
+        """
+        self._finalizeBrain()
+        self._brain.freeze()
+        for subber in self._subbers.values():
+            subber.freeze()     # compile the regex now
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+    def _finalizeBrain(self):
+        """Apply in advance the changes that processing makes to the
+        templates in the brain the first time they are used, so that
+        template evaluation leaves them untouched.
+        """
+        stack = list(self._brain.templates())
+        while stack:
+            elem = stack.pop()
+            if elem[0] == "text":
+                _collapseText(elem)
+            else:
+                stack.extend(elem[2:])
+        self._renderStatic()
+
+    def _isStatic(self, template):
+        """Check whether a template always produces the same response, i.e.
+        it is made only of static elements (see _staticElements)."""
+        stack = [template]
+        while stack:
+            elem = stack.pop()
+            if elem[0] not in self._staticElements:
+                return False
+            if elem[0] == "text":
+                continue
+            # without contents, these work on <star/>
+            if len(elem) == 2 and elem[0] in ("gender", "person", "person2"):
+                return False
+            # (leave the error for a broken <bot> to the usual processing)
+            if elem[0] == "bot" and "name" not in elem[1]:
+                return False
+            stack.extend(elem[2:])
+        return True
+
+    def _staticResponse(self, template):
+        """Return the constant response for a static template, or None if
+        it is not static. Templates are checked (and static ones rendered)
+        the first time they are used, and the result is kept until a bot
+        predicate or a subber changes."""
+        entry = self._staticResponses.get(id(template))
+        if entry is None or entry[0] is not template:
+            response = None
+            if self._isStatic(template):
+                response = self._processElement(template, self._globalSessionID).strip()
+            entry = (template, response)
+            self._staticResponses[id(template)] = entry
+        return entry[1]
+
+    def _renderStatic(self):
+        """Check all the templates in the brain, and render the static ones,
+        so that no response has to do it."""
+        for template in self._brain.templates():
+            self._staticResponse(template)
+
     def saveBrain(self, filename):
         """Dump the contents of the bot's brain to a file on disk."""
         if self._verboseMode: print( "Saving brain to %s..." % filename, end="")
@@ -210,6 +653,84 @@ class Kernel:
         if self._verboseMode:
             print("done (%.2f seconds)" % (time.time() - start))
 
+    def saveSnapshot(self, filename, sessions=False, meta=None):
+        """Save the whole state of the Kernel to a file: the brain, the
+        substitutions, the bot predicates and, if `sessions` is True, the
+        session data (all of whose predicate values must then be plain
+        Python types). To restore it later, use loadSnapshot().
+
+        The file starts with a header (see readSnapshotHeader()), which
+        includes the `meta` dictionary, if given.
+        """
+        if self._verboseMode: print( "Saving snapshot to %s..." % filename, end="")
+        start = time.time()
+        with self._respondLock:
+            header = {"version": SNAPSHOT_VERSION,
+                      "aimlVersion": VERSION,
+                      "created": time.time(),
+                      "categories": self.numCategories(),
+                      "overlay": self._brain.base() is not None,
+                      "sessions": bool(sessions),
+                      "meta": dict(meta or {})}
+            state = {"brain": self._brain.getState(),
+                     "subbers": dict((name, (dict(subber), subber.cacheSize()))
+                                     for name, subber in self._subbers.items()),
+                     "botPredicates": self._botPredicates,
+                     "learnedFiles": self._learnedFiles,
+                     "sessions": self._sessions if sessions else None}
+            with open(filename, "wb") as outFile:
+                outFile.write(SNAPSHOT_MAGIC)
+                marshal.dump(header, outFile)
+                marshal.dump(state, outFile)
+        if self._verboseMode:
+            print("done (%.2f seconds)" % (time.time() - start))
+
+    def loadSnapshot(self, filename):
+        """Restore the state of the Kernel from a file written by
+        saveSnapshot(), and return the `meta` dictionary stored in it.
+
+        NOTE: the current brain, substitutions and bot predicates are
+        discarded, and so are the sessions if the snapshot has them!
+
+        The Kernel is left ready to respond: the matcher metadata is read
+        from the snapshot (or built, for an overlay or an older snapshot),
+        and the static responses are rendered right away.
+        """
+        if self._verboseMode: print( "Loading snapshot from %s..." % filename, end="" )
+        start = time.time()
+        # Everything built here is kept: collecting garbage meanwhile would
+        # only walk over the new objects again and again
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(filename, "rb") as inFile:
+                header = _readSnapshotHeader(inFile)
+                # (much faster than reading from the file bit by bit)
+                state = marshal.loads(inFile.read())
+            with self._respondLock:
+                self._brain.setState(state["brain"])
+                # Substitutions equal to the defaults use the shared ones
+                defaults = _sharedSubbers(self._subCacheSize)
+                self._subbers = {}
+                for name, (table, cacheSize) in state["subbers"].items():
+                    subber = defaults.get(name)
+                    if subber is None or subber.cacheSize() != cacheSize or dict(subber) != table:
+                        subber = WordSub.fromExpanded(table, cacheSize)
+                    self._subbers[name] = subber
+                self._botPredicates = state["botPredicates"]
+                self._brain.setBotName(self.getBotPredicate("name"))
+                self._learnedFiles = state["learnedFiles"]
+                if state["sessions"] is not None:
+                    self._sessions = state["sessions"]
+                self._staticResponses = {}
+                self._renderStatic()
+        finally:
+            if gcEnabled:
+                gc.enable()
+        if self._verboseMode:
+            print( "done (%d categories in %.2f seconds)" % (self._brain.numTemplates(), time.time() - start) )
+        return header["meta"]
+
     def getPredicate(self, name, sessionID=_globalSessionID):
         """Retrieve the current value of the predicate 'name' from the
         specified session.
@@ -249,6 +770,7 @@ class Kernel:
 
         """
         self._botPredicates[name] = value
+        self._staticResponses = {}
         # Clumsy hack: if updating the bot name, we must update the
         # name in the brain as well
         if name == "name":
@@ -267,6 +789,64 @@ class Kernel:
         self._cod = msg_encoder(encoding)
 
 
+    def configureSystem(self, executor=None, **options):
+        """Set up the executor for the commands in <system> elements. The
+        options are those of the SystemExecutor constructor: workers,
+        timeout, maxOutput, allowed, idempotent, cacheTTL and cacheSize.
+
+        The commands of different sessions can run at the same time (see
+        _processSystem()).  To bound the number of commands run by several
+        Kernels together, create a SystemExecutor and pass it as `executor`
+        to each of them instead of the options.
+
+        By default <system> commands can be anything, and get 10 seconds
+        to finish.
+        """
+        if executor is None:
+            from .SystemExecutor import SystemExecutor
+            executor = SystemExecutor(**options)
+        elif options:
+            raise TypeError("options cannot be given with an executor")
+        self._system = executor
+
+    def setRecorder(self, target):
+        """Record every call to respond() in a log, as JSON lines with the
+        time, session ID, input, response, matched patterns and latency (in
+        seconds) of the call. The target can be a filename (the log is
+        appended to it) or a file-like object; None stops recording.
+        """
+        with self._respondLock:
+            if self._recorderFile is not None:
+                self._recorderFile.close()
+            self._recorder = self._recorderFile = None
+            if target is None:
+                return
+            if hasattr(target, "write"):
+                self._recorder = target
+            else:
+                self._recorder = self._recorderFile = open(target, "a")
+
+    def setDeadline(self, seconds, fallback=u""):
+        """Set the default number of seconds a call to respond() may take
+        (None for no limit), including all the <srai> recursion and
+        <system> commands of its templates. When it runs out, the
+        sentence being answered gets the `fallback` response and the rest
+        of the input is dropped; respondMetrics() counts these timeouts.
+        """
+        with self._respondLock:
+            self._defaultDeadline = seconds
+            self._deadlineFallback = fallback
+
+    def setRandomSeed(self, seed):
+        """Make the choices of <random> elements reproducible: each session
+        gets its own random generator, seeded from `seed` and the session
+        ID, so that the responses in a session do not depend on the other
+        sessions. With None, the (shared) default generator is used again.
+        """
+        with self._respondLock:
+            self._randomSeed = seed
+            self._sessionRandom = {}
+
     def loadSubs(self, filename):
         """Load a substitutions file.
 
@@ -276,18 +856,49 @@ class Kernel:
         substituter.
 
         """
+        try:
+            from ConfigParser import ConfigParser
+        except ImportError:
+            from configparser import ConfigParser
         parser = ConfigParser()
         with open(filename) as inFile:
             parser.readfp(inFile, filename)
         for s in parser.sections():
             # Add a new WordSub instance for this section.  If one already
-            # exists, delete it.
+            # exists, delete it (but keep its cache setting).
+            cacheSize = 0
             if s in self._subbers:
+                cacheSize = self._subbers[s].cacheSize()
                 del(self._subbers[s])
-            self._subbers[s] = WordSub()
+            self._subbers[s] = WordSub(cacheSize=cacheSize)
             # iterate over the key,value pairs and add them to the subber
             for k, v in parser.items(s):
                 self._subbers[s][k] = v
+        self._staticResponses = {}
+
+    def addSet(self, name, entries):
+        """Define the words or phrases matched by <set>NAME</set> in the
+        patterns (see PatternMgr.addSet())."""
+        with self._respondLock:
+            self._brain.addSet(name, entries)
+
+    def loadSet(self, filename, name=None):
+        """Load a set file, with one entry per line or (AIML 2.0 style) a
+        JSON list of entries, each one a string or a list of words.  The
+        set is named after the file (without its extension) unless a name
+        is given.
+        """
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        with io.open(filename, encoding="utf-8") as inFile:
+            text = inFile.read()
+        if text.lstrip().startswith(u"["):
+            import json
+            entries = [entry if isinstance(entry, unicode) else u" ".join(entry)
+                       for entry in json.loads(text)]
+        else:
+            entries = text.splitlines()
+        self.addSet(name, entries)
 
     def _addSession(self, sessionID):
         """Create a new session with the specified ID string."""
@@ -305,6 +916,7 @@ class Kernel:
         """Delete the specified session."""
         if sessionID in self._sessions:
             self._sessions.pop(sessionID)
+        self._sessionRandom.pop(sessionID, None)
 
     def getSessionData(self, sessionID=None):
         """Return a copy of the session data dictionary for the
@@ -320,6 +932,7 @@ class Kernel:
             except KeyError: s = {}
         else:
             s = self._sessions
+        import copy
         return copy.deepcopy(s)
 
     def learn(self, filename):
@@ -329,42 +942,145 @@ class Kernel:
         will be loaded and learned.
 
         """
+        import glob
         for f in glob.glob(filename):
             if self._verboseMode: print( "Loading %s..." % f, end="")
             start = time.time()
+            if self._fileMemory is not None:
+                import tracemalloc
+                allocated = tracemalloc.get_traced_memory()[0]
             # Load and parse the AIML file.
-            parser = create_parser()
-            handler = parser.getContentHandler()
-            handler.setEncoding(self._textEncoding)
-            try: parser.parse(f)
-            except xml.sax.SAXParseException as msg:
-                err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f,msg)
-                sys.stderr.write(err)
+            categories = self._parseFile(f)
+            if categories is None:
                 continue
             # store the pattern/template pairs in the PatternMgr.
-            for key, tem in handler.categories.items():
+            for key, tem in categories.items():
+                if self._provenance is not None:
+                    self._trackCategory(key, f)
                 self._brain.add(key, tem)
+            self._addLearnedFile(f)
+            if self._fileMemory is not None:
+                f = os.path.abspath(f)
+                self._fileMemory[f] = (self._fileMemory.get(f, 0) +
+                                       tracemalloc.get_traced_memory()[0] - allocated)
             # Parsing was successful.
             if self._verboseMode:
                 print("done (%.2f seconds)" % (time.time() - start))
 
-    def respond(self, input_, sessionID=_globalSessionID):
-        """Return the Kernel's response to the input string."""
+    def reload(self, files=None, background=True):
+        """Rebuild the brain from AIML files, and replace the current one
+        with it once it is complete.
+
+        The `files` argument is a file (or list of files, which may include
+        wildcards) to learn into the new brain. By default, all the files
+        learned so far (directly or through <learn> elements) are used, so
+        that changes in them are picked up.
+
+        The new brain is built in a background thread (unless `background`
+        is False), without holding the lock that serializes responses, so
+        that they are not delayed meanwhile. Responses being computed when
+        it is ready finish with the old brain; the new one is only swapped
+        in between responses. The thread is returned, so that the caller
+        can join() it.
+        """
+        if files is None:
+            files = list(self._learnedFiles)
+        else:
+            if isinstance(files, (str, unicode)):
+                files = (files,)
+            import glob
+            files = [os.path.abspath(f) for pattern in files
+                     for f in glob.glob(pattern)]
+
+        def build():
+            start = time.time()
+            brain = PatternMgr(self._brain.base())
+            for name, entries in self._brain.sets().items():
+                brain.addSet(name, entries)
+            brain.setTopicPartitioning(self._brain.topicPartitioning())
+            fuzzy = self._brain.fuzzySettings()
+            if fuzzy is not None:
+                brain.setFuzzyMatching(True, *fuzzy)
+            learned = []
+            for f in files:
+                categories = self._parseFile(f)
+                if categories is None:
+                    continue
+                for key, tem in categories.items():
+                    brain.add(key, tem)
+                learned.append(f)
+            brain.compile()
+            # swap it in, between responses
+            with self._respondLock:
+                brain.setBotName(self.getBotPredicate("name"))
+                self._brain = brain
+                self._learnedFiles = learned
+                self._staticResponses = {}
+            if self._verboseMode:
+                print("Brain reloaded (%d categories in %.2f seconds)" %
+                      (brain.numTemplates(), time.time() - start))
+
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="aiml-reload")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _parseFile(self, filename):
+        """Parse an AIML file, and return the dictionary of categories in
+        it (or None if it could not be parsed)."""
+        import xml.sax
+        from .AimlParser import create_parser
+        parser = create_parser()
+        handler = parser.getContentHandler()
+        handler.setEncoding(self._textEncoding)
+        try: parser.parse(filename)
+        except xml.sax.SAXParseException as msg:
+            err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (filename,msg)
+            sys.stderr.write(err)
+            return None
+        return handler.categories
+
+    def _trackCategory(self, data, filename):
+        """Record the file a category is being learned from, and whether
+        it replaces one learned before."""
+        data = self._brain.canonical(data)
+        filename = os.path.abspath(filename)
+        previous = self._provenance.get(data)
+        if previous is not None:
+            self._replacedCategories.append((data, previous, filename))
+        self._provenance[data] = filename
+
+    def _addLearnedFile(self, filename):
+        """Keep track of a learned file, to be used by reload()."""
+        filename = os.path.abspath(filename)
+        if filename not in self._learnedFiles:
+            self._learnedFiles.append(filename)
+
+    def respond(self, input_, sessionID=_globalSessionID, deadline=None):
+        """Return the Kernel's response to the input string.
+
+        The response must be found within `deadline` seconds, if given
+        (otherwise, within the default set by setDeadline()).
+        """
         if len(input_) == 0:
             return Result([], "")
-
-        # Decode the input (assumed to be an encoded string) into a unicode
-        # string. Note that if encoding is False, this will be a no-op
-        try: input_ = self._cod.dec(input_)
-        except UnicodeError: pass
-        except AttributeError: pass
+        input_ = self._decodeInput(input_)
+        expires = self._expiry(deadline)
 
         # prevent other threads from stomping all over us.
+        waitStart = time.time()
         self._respondLock.acquire()
+        start = time.time()
 
         try:
+            self._waitForSession(sessionID)
             # Clear the patMatches stack
             self.patMatchesStack = []
+            self._deadline = expires
+            self._timedOut = False
 
             # Add the session, if it doesn't already exist
             self._addSession(sessionID)
@@ -373,38 +1089,153 @@ class Kernel:
             sentences = Utils.sentences(input_)
             finalResponse = u""
             for s in sentences:
-                # Add the input to the history list before fetching the
-                # response, so that <input/> tags work properly.
-                inputHistory = self.getPredicate(self._inputHistory, sessionID)
-                inputHistory.append(s)
-                while len(inputHistory) > self._maxHistorySize:
-                    inputHistory.pop(0)
-                self.setPredicate(self._inputHistory, inputHistory, sessionID)
-
-                # Fetch the response
-                response = self._respond(s, sessionID)
-
-                # add the data from this exchange to the history lists
-                outputHistory = self.getPredicate(self._outputHistory, sessionID)
-                outputHistory.append(response)
-                while len(outputHistory) > self._maxHistorySize:
-                    outputHistory.pop(0)
-                self.setPredicate(self._outputHistory, outputHistory, sessionID)
-
                 # append this response to the final response.
-                finalResponse += (response + u"  ")
+                finalResponse += (self._respondSentence(s, sessionID) + u"  ")
+                if self._timedOut:
+                    break
 
             finalResponse = finalResponse.strip()
             #print( "@ASSERT", self.getPredicate(self._inputStack, sessionID))
             assert(len(self.getPredicate(self._inputStack, sessionID)) == 0)
 
+            if self._recorder is not None:
+                self._record(sessionID, input_, finalResponse, start)
+
             # and return, encoding the string into the I/O encoding
             return Result(self.patMatchesStack, self._cod.enc(finalResponse))
 
         finally:
-            # release the lock
-            self._respondLock.release()
+            self._releaseRespondLock(waitStart, start)
+
+    def respondIter(self, input_, sessionID=_globalSessionID, deadline=None):
+        """Generate the Kernel's response to the input string one sentence
+        at a time: a Result (matched patterns and response) is produced for
+        each sentence of the input as soon as it has been answered.  The
+        input and output histories are updated as respond() does.
+
+        The Kernel is locked only while each sentence is answered, so other
+        threads may get their responses in between; respondMetrics() and
+        the recorder count each sentence as a call. The deadline covers
+        the whole input.
+        """
+        if len(input_) == 0:
+            return
+        input_ = self._decodeInput(input_)
+        expires = self._expiry(deadline)
+        for s in Utils.sentences(input_):
+            waitStart = time.time()
+            self._respondLock.acquire()
+            start = time.time()
+            try:
+                self._waitForSession(sessionID)
+                self.patMatchesStack = []
+                self._deadline = expires
+                self._timedOut = False
+                self._addSession(sessionID)
+                response = self._respondSentence(s, sessionID)
+                assert(len(self.getPredicate(self._inputStack, sessionID)) == 0)
+                if self._recorder is not None:
+                    self._record(sessionID, s, response, start)
+                result = Result(self.patMatchesStack, self._cod.enc(response))
+            finally:
+                self._releaseRespondLock(waitStart, start)
+            yield result
+            if self._timedOut:
+                return
+
+    def respondAsync(self, input_, sessionID=_globalSessionID, executor=None,
+                     deadline=None):
+        """Asynchronous version of respondIter(), for asyncio: return an
+        asynchronous iterator over the Result for each sentence of the
+        input, to be used with "async for".  Each sentence is answered in
+        the executor (the default one of the event loop if None), so that
+        the loop is not blocked meanwhile.
+        """
+        return _AsyncResponses(self.respondIter(input_, sessionID, deadline),
+                               executor)
+
+    def _waitForSession(self, sessionID):
+        """Wait (with the Kernel lock) until no other response is running
+        a <system> command for the session, and mark the lock as held by a
+        response."""
+        while sessionID in self._busySessions:
+            self._sessionFree.wait()
+        self._responding = True
+
+    def _expiry(self, deadline):
+        """Return the time at which a response with the given deadline (or
+        the default one) expires, or None"""
+        if deadline is None:
+            deadline = self._defaultDeadline
+        return None if deadline is None else time.time() + deadline
+
+    def _checkDeadline(self):
+        """Abort the response being computed if its deadline has passed"""
+        if self._deadline is not None and time.time() > self._deadline:
+            raise _DeadlineExceeded()
+
+    def _decodeInput(self, input_):
+        """Decode the input (assumed to be an encoded string) into a unicode
+        string. Note that if encoding is False, this will be a no-op"""
+        try: return self._cod.dec(input_)
+        except UnicodeError: pass
+        except AttributeError: pass
+        return input_
+
+    def _respondSentence(self, sentence, sessionID):
+        """Return the response to one sentence of the input, updating the
+        input and output histories. Must be called with the Kernel lock."""
+        # Add the input to the history list before fetching the
+        # response, so that <input/> tags work properly.
+        inputHistory = self.getPredicate(self._inputHistory, sessionID)
+        inputHistory.append(sentence)
+        while len(inputHistory) > self._maxHistorySize:
+            inputHistory.pop(0)
+        self.setPredicate(self._inputHistory, inputHistory, sessionID)
+
+        # Fetch the response
+        try:
+            response = self._respond(sentence, sessionID)
+        except _DeadlineExceeded:
+            # unwind the <srai> recursion
+            self.setPredicate(self._inputStack, [], sessionID)
+            self._respondMetrics["timeouts"] += 1
+            self._timedOut = True
+            response = self._deadlineFallback
+
+        # add the data from this exchange to the history lists
+        outputHistory = self.getPredicate(self._outputHistory, sessionID)
+        outputHistory.append(response)
+        while len(outputHistory) > self._maxHistorySize:
+            outputHistory.pop(0)
+        self.setPredicate(self._outputHistory, outputHistory, sessionID)
+        return response
 
+    def _releaseRespondLock(self, waitStart, start):
+        """Update the respond() metrics for a call that waited for the
+        Kernel lock since waitStart and got it at start, and release it."""
+        metrics = self._respondMetrics
+        metrics["calls"] += 1
+        wait, elapsed = start - waitStart, time.time() - start
+        metrics["lockWait"] += wait
+        metrics["maxLockWait"] = max(metrics["maxLockWait"], wait)
+        metrics["respondTime"] += elapsed
+        metrics["maxRespondTime"] = max(metrics["maxRespondTime"], elapsed)
+        self._deadline = None
+        self._responding = False
+        # release the lock
+        self._respondLock.release()
+
+    def _record(self, sessionID, input_, response, start):
+        """Write an entry for a call to respond() in the recorder log."""
+        import json
+        entry = {"time": round(start, 3),
+                 "session": sessionID,
+                 "input": input_,
+                 "response": response,
+                 "patterns": self.patMatchesStack,
+                 "latency": round(time.time() - start, 6)}
+        self._recorder.write(json.dumps(entry, sort_keys=True) + "\n")
 
     # This version of _respond() just fetches the response for some input.
     # It does not mess with the input and output histories.  Recursive calls
@@ -418,10 +1249,9 @@ class Kernel:
         # guard against infinite recursion
         inputStack = self.getPredicate(self._inputStack, sessionID)
         if len(inputStack) > self._maxRecursionDepth:
-            if self._verboseMode:
-                err = u"WARNING: maximum recursion depth exceeded (input='%s')" % self._cod.enc(input_)
-                sys.stderr.write(err)
+            self._diagnose(LOG_WARNING, u"maximum recursion depth exceeded (input='%s')", input_)
             return u""
+        self._checkDeadline()
 
         # push the input onto the input stack
         inputStack = self.getPredicate(self._inputStack, sessionID)
@@ -445,15 +1275,18 @@ class Kernel:
         # Determine the final response.
         response = u""
         matchResult = self._brain.match(subbedInput, subbedThat, subbedTopic)
+        self._checkDeadline()
         if matchResult is None:
-            if self._verboseMode:
-                err = "WARNING: No match found for input: %s\n" % self._cod.enc(input_)
-                sys.stderr.write(err)
+            self._diagnose(LOG_INFO, u"No match found for input: %s", input_)
         else:
             # Process the element into a response string.
             self.patMatchesStack.append(matchResult.pattern)
             template = matchResult.template
-            response += self._processElement(template, sessionID).strip()
+            static = self._staticResponse(template)
+            if static is None:
+                response += self._processElement(template, sessionID).strip()
+            else:
+                response += static
             response += u" "
         response = response.strip()
 
@@ -479,9 +1312,7 @@ class Kernel:
             handlerFunc = self._elementProcessors[elem[0]]
         except Exception:
             # Oops -- there's no handler function for this element type!
-            if self._verboseMode:
-                err = "WARNING: No handler found for <%s> element\n" % self._cod.enc(elem[0])
-                sys.stderr.write(err)
+            self._diagnose(LOG_WARNING, u"No handler found for <%s> element", elem[0])
             return u""
         return handlerFunc(elem, sessionID)
 
@@ -584,7 +1415,7 @@ class Kernel:
                     except Exception:
                         # No attributes, no name/value attributes, no
                         # such predicate/session, or processing error.
-                        if self._verboseMode: print("Something amiss -- skipping listitem", li)
+                        self._diagnose(LOG_WARNING, u"Something amiss -- skipping listitem %s", li)
                         raise
                 if not foundMatch:
                     # Check the last element of listitems.  If it has
@@ -597,11 +1428,11 @@ class Kernel:
                     except Exception:
                         # listitems was empty, no attributes, missing
                         # name/value attributes, or processing error.
-                        if self._verboseMode: print("error in default listitem")
+                        self._diagnose(LOG_WARNING, u"error in default listitem")
                         raise
             except Exception:
                 # Some other catastrophic cataclysm
-                if self._verboseMode: print("catastrophic condition failure")
+                self._diagnose(LOG_WARNING, u"catastrophic condition failure")
                 raise
         return response
 
@@ -700,9 +1531,7 @@ class Kernel:
         except: index = 1
         try: return inputHistory[-index]
         except IndexError:
-            if self._verboseMode:
-                err = "No such index %d while processing <input> element.\n" % index
-                sys.stderr.write(err)
+            self._diagnose(LOG_INFO, u"No such index %d while processing <input> element", index)
             return ""
 
     # <javascript>
@@ -825,8 +1654,15 @@ class Kernel:
             return ""
 
         # select and process a random listitem.
-        random.shuffle(listitems)
-        return self._processElement(listitems[0], sessionID)
+        import random
+        if self._randomSeed is None:
+            rng = random
+        else:
+            rng = self._sessionRandom.get(sessionID)
+            if rng is None:
+                rng = random.Random(u"%s/%s" % (self._randomSeed, sessionID))
+                self._sessionRandom[sessionID] = rng
+        return self._processElement(rng.choice(listitems), sessionID)
 
     # <sentence>
     def _processSentence(self, elem, sessionID):
@@ -938,7 +1774,11 @@ class Kernel:
         <system> elements process their contents recursively, and then
         attempt to execute the results as a shell command on the
         server.  The AIML interpreter blocks until the command is
-        complete, and then returns the command's output.
+        complete, and then returns the command's output.  Commands are
+        run by a SystemExecutor, which limits their number, duration
+        and output (see configureSystem()).  The Kernel lock is released
+        while the command runs, so that the other sessions are not held
+        up; the other inputs of the same session wait for it.
 
         For cross-platform compatibility, any file paths inside
         <system> tags should use Unix-style forward slashes ("/") as a
@@ -960,17 +1800,33 @@ class Kernel:
         command = os.path.normpath(command)
 
         # execute the command.
-        response = ""
+        if self._system is None:
+            self.configureSystem()
+        system, deadline = self._system, self._deadline
+        unlocked = self._responding
+        if unlocked:
+            state = (self.patMatchesStack, self._timedOut)
+            self._busySessions.add(sessionID)
+            self._responding = False
+            self._respondLock.release()
+        error = None
         try:
-            out = os.popen(command)
+            # do not let the command outlive the response deadline
+            response = system.run(command, deadline=deadline)
         except RuntimeError as msg:
-            if self._verboseMode:
-                err = "WARNING: RuntimeError while processing \"system\" element:\n%s\n" % self._cod.enc(msg)
-                sys.stderr.write(err)
+            error = msg
+        finally:
+            if unlocked:
+                self._respondLock.acquire()
+                self.patMatchesStack, self._timedOut = state
+                self._deadline = deadline
+                self._responding = True
+                self._busySessions.discard(sessionID)
+                self._sessionFree.notify_all()
+        if error is not None:
+            self._checkDeadline()
+            self._diagnose(LOG_ERROR, u"RuntimeError while processing \"system\" element: %s", error)
             return "There was an error while computing my response.  Please inform my botmaster."
-        time.sleep(0.01) # I'm told this works around a potential IOError exception.
-        for line in out:
-            response += line + "\n"
         response = ' '.join(response.splitlines()).strip()
         return response
 
@@ -1008,9 +1864,9 @@ class Kernel:
         # we reduce all stretches of >1 whitespace characters to a single
         # space.  To improve performance, we do this only once for each
         # text element encountered, and save the results for the future.
-        if elem[1]["xml:space"] == "default":
-            elem[2] = re.sub(r"\s+", " ", elem[2])
-            elem[1]["xml:space"] = "preserve"
+        # (for a frozen brain this has already been done, so that shared
+        # templates are never modified)
+        _collapseText(elem)
         return elem[2]
 
     # <that>
@@ -1039,9 +1895,7 @@ class Kernel:
             pass
         try: return outputHistory[-index]
         except IndexError:
-            if self._verboseMode:
-                err = "No such index %d while processing <that> element.\n" % index
-                sys.stderr.write(err)
+            self._diagnose(LOG_INFO, u"No such index %d while processing <that> element", index)
             return ""
 
     # <thatstar>
@@ -1163,3 +2017,31 @@ class Kernel:
         topic = self.getPredicate("topic", sessionID)
         response = self._brain.wildcard("caret", input_, that, topic, index)
         return response
+
+
+class _DeadlineExceeded(BaseException):
+    """Raised when the deadline of a response has passed (not an Exception,
+    so that the error handling of the element processors lets it through)"""
+
+
+class _AsyncResponses(object):
+    """Asynchronous iterator returned by Kernel.respondAsync(), which runs
+    each step of a respondIter() generator in an executor."""
+
+    def __init__(self, responses, executor):
+        self._responses = responses
+        self._executor = executor
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, self._next)
+
+    def _next(self):
+        try:
+            return next(self._responses)
+        except StopIteration:
+            raise StopAsyncIteration()
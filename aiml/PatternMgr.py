@@ -6,18 +6,28 @@ http://www.alicebot.org/documentation/matching.html
 
 from __future__ import print_function
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 import marshal
-import pprint
 import re
 import string
 import sys
+import threading
+import time
 
 from .constants import *
 
 MatchResult = namedtuple('MatchResult', 'pattern template')
 
+# Per-node metadata computed by PatternMgr.compile().  'wild' is true if the
+# node has a _, * or ^ child (i.e. it can consume any word), 'bot' if it has a
+# BOT_NAME child, and minLen/maxLen bound the number of input words that can
+# be consumed below the node on the way to a template.
+NodeInfo = namedtuple('NodeInfo', 'wild bot minLen maxLen')
+
+# Stands for "unbounded" in NodeInfo lengths
+_INFINITY = sys.maxsize
+
 class PatternMgr:
     # special dictionary keys
     _UNDERSCORE = '0'
@@ -27,10 +37,53 @@ class PatternMgr:
     _TOPIC      = '4'
     _BOT_NAME   = '5'
     _CARET      = '6'
+
+    # keys that mark the end of the words in a pattern (or that) sub-trie
+    _TERMINALS  = (_TEMPLATE, _THAT, _TOPIC)
+    # path to the category for any that and topic
+    _CATCH_ALL  = (_THAT, _STAR, _TOPIC, _STAR)
+    # all of the above
+    _SPECIAL    = frozenset((_UNDERSCORE, _STAR, _TEMPLATE, _THAT, _TOPIC,
+                             _BOT_NAME, _CARET))
+    # <set>NAME</set> words are kept as they are in the node keys, since
+    # they can never collide with (punctuation-free) input words
+    _SET_START  = u"<set>"
+    _SET_END    = u"</set>"
+    # number of fuzzy matching results remembered
+    _FUZZY_CACHE_SIZE = 1000
     
-    def __init__(self):
+    def __init__(self, base=None):
+        """Create an empty PatternMgr.
+
+        If a `base` PatternMgr is given, this one becomes an overlay on top of
+        it: matching sees the categories of both (with the ones added here
+        overriding identical ones in the base), but only this object is ever
+        modified. The base must have been frozen, so that it can be shared
+        by any number of overlays.
+        """
+        if base is not None and not base._frozen:
+            raise ValueError("the base PatternMgr must be frozen")
+        self._base = base
         self._root = {}
         self._templateCount = 0
+        self._numReplaced = 0
+        self._nodeInfo = {}
+        self._exact = {}
+        self._sets = {}
+        self._setEdges = {}
+        self._hasSetEdges = False
+        self._partitionTopics = False
+        self._topics = None
+        self._wildTopics = None
+        self._fuzzy = None
+        self._fuzzyIndex = {}
+        # (the fuzzy cache and counters are shared by the threads matching)
+        self._fuzzyLock = threading.Lock()
+        self._fuzzyCache = OrderedDict()
+        self._fuzzyMetrics = dict.fromkeys(("attempts", "hits", "misses",
+                                            "timeouts"), 0)
+        self._compiled = False
+        self._frozen = False
         self._botName = u"Nameless"
         punctuation = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
         self._puncStripRE = re.compile("[" + re.escape(punctuation) + "]")
@@ -38,7 +91,135 @@ class PatternMgr:
 
     def numTemplates(self):
         """Return the number of templates currently stored."""
-        return self._templateCount
+        if self._base is None:
+            return self._templateCount
+        return self._templateCount + self._base.numTemplates()
+
+    def numReplaced(self):
+        """Return the number of categories that replaced an existing one
+        with the same pattern, that and topic when they were added."""
+        return self._numReplaced
+
+    def numNodes(self):
+        """Return the number of nodes in the tree (for an overlay, only
+        those of its own tree)."""
+        count = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(child for child in node.values()
+                         if isinstance(child, dict))
+        return count
+
+    def base(self):
+        """Return the base PatternMgr this one is an overlay of, or None."""
+        return self._base
+
+    def freeze(self):
+        """Make the node tree immutable, so that it can be safely shared by
+        several overlay PatternMgrs (and Kernels).  Further calls to add()
+        will fail.
+        """
+        if not self._compiled:
+            self.compile()
+        self._frozen = True
+
+    def setTopicPartitioning(self, enabled=True):
+        """Enable/disable splitting the node tree by topic when compiling it:
+        the categories with a literal topic (e.g. <topic name="FRUIT">) go
+        to a separate node tree for each topic, and the rest to a node tree
+        of their own, so that matching only walks the categories that can
+        apply to the current topic. This pays off for bots with many
+        categories in topics.
+
+        The node tree with the categories for any topic shares with the
+        full one all the branches that hold no categories with a literal
+        topic, so only those take additional memory.  Matching gives the
+        same results: a ^ at the end of a pattern keeps the that/topic of
+        the identical pattern without it from being tried, so if splitting
+        would separate them, the node tree is not split.
+        """
+        if self._frozen:
+            raise RuntimeError("cannot change a frozen PatternMgr")
+        self._partitionTopics = enabled
+        self._invalidate()
+
+    def topicPartitioning(self):
+        """Return True if the node tree is split by topic when compiled
+        (see setTopicPartitioning())."""
+        return self._partitionTopics
+
+    def setFuzzyMatching(self, enabled=True, maxDistance=2, threshold=0.8,
+                         budget=0.005):
+        """Enable/disable a fallback for inputs that only match the catch-all
+        category (a pattern of just *) or nothing at all: the closest
+        literal pattern is looked for, correcting typos in the input words
+        (e.g. WHAT IS YOUR NAEM), and is matched instead if it leads to
+        another category.
+
+        maxDistance is the largest number of character edits (insertions,
+        deletions, substitutions or transpositions) allowed, and threshold
+        the minimum similarity (1 - edits / length of the input) for a
+        correction to be accepted.  Only corrections that turn each word
+        into a word of some pattern by deleting at most one character from
+        each are considered.  The search gives up
+        after `budget` seconds.  The words of the patterns are indexed by
+        compile(); for an overlay, the base must have fuzzy matching
+        enabled before it is frozen for its words to be found.  See
+        fuzzyMetrics() for counters.
+        """
+        self._fuzzy = (maxDistance, threshold, budget) if enabled else None
+        with self._fuzzyLock:
+            self._fuzzyCache.clear()
+        if not self._frozen:
+            self._invalidate()
+
+    def fuzzySettings(self):
+        """Return the (maxDistance, threshold, budget) tuple given to
+        setFuzzyMatching(), or None if fuzzy matching is disabled."""
+        return self._fuzzy
+
+    def fuzzyMetrics(self):
+        """Return a dictionary with the fuzzy matching counters: attempts
+        (inputs looked for), hits (inputs corrected), misses (nothing close
+        enough found) and timeouts (searches cut short by the budget).
+        Returns None if fuzzy matching is disabled."""
+        if self._fuzzy is None:
+            return None
+        with self._fuzzyLock:
+            return dict(self._fuzzyMetrics)
+
+    def addSet(self, name, entries):
+        """Define the set of words or phrases matched by <set>NAME</set> in
+        patterns (AIML 2.0), replacing any previous set with that name.
+
+        The entries are normalized as the input is (upper case, without
+        punctuation) and kept as tuples of words in a hash table, so that
+        a set is matched in a single step, trying its longest entries
+        first, instead of needing one category per entry.  A set in a
+        pattern does not take part in <star/> indexes.  An overlay can
+        define new sets, but not replace those of its base.
+        """
+        if self._frozen:
+            raise RuntimeError("cannot change a frozen PatternMgr")
+        name = name.upper()
+        if self._base is not None and self._base._setMembers(name) is not None:
+            raise ValueError("set %s is already defined in the base" % name)
+        members = set()
+        for entry in entries:
+            words = tuple(self._puncStripRE.sub(u" ", entry.upper()).split())
+            if words:
+                members.add(words)
+        lengths = tuple(sorted(set(len(words) for words in members), reverse=True))
+        self._sets[name] = (frozenset(members), lengths)
+        self._invalidate()
+
+    def sets(self):
+        """Return a dictionary with the sets defined (for an overlay, only
+        its own ones), as lists of entries indexed by set name."""
+        return dict((name, sorted(u" ".join(words) for words in members))
+                    for name, (members, lengths) in self._sets.items())
 
     def setBotName(self, name):
         """Set the name of the bot, used to match <bot name="name"> tags in
@@ -47,47 +228,354 @@ class PatternMgr:
         # Collapse a multi-word name into a single word
         self._botName = unicode( ' '.join(name.split()) )
 
-    def dump(self):
-        """Print all learned patterns, for debugging purposes."""
-        pprint.pprint(self._root)
+    def templates(self):
+        """Iterate over all the templates stored, including those in the
+        base brain of an overlay (even if overridden).
+        """
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for child in node.values():
+                # (checking the key would be wrong for the pattern word "2")
+                if isinstance(child, dict):
+                    stack.append(child)
+                else:
+                    yield child
+        if self._base is not None:
+            for template in self._base.templates():
+                yield template
+
+    def shareTemplates(self):
+        """Make the identical templates in the node tree a single object,
+        so that they are kept (and saved) only once.  Returns the number of
+        templates that were replaced by an identical one.
+
+        For an overlay, only its own node tree is changed.
+        """
+        if self._frozen:
+            raise RuntimeError("cannot change a frozen PatternMgr")
+        self._invalidate()
+        seen = {}
+        replaced = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if isinstance(child, dict):
+                    stack.append(child)
+                    continue
+                template = seen.setdefault(marshal.dumps(child), child)
+                if template is not child:
+                    node[key] = template
+                    replaced += 1
+        return replaced
+
+    def dump(self, stream=None):
+        """Write all learned categories to a stream (sys.stdout by default),
+        one per line, as JSON objects with their pattern, that, topic and
+        template.  The categories are written as they are found, so the
+        memory used does not depend on the size of the brain.
+
+        For an overlay, only its own categories are included.
+        """
+        import json
+        if stream is None:
+            stream = sys.stdout
+        for (pattern, that, topic), template in self.categories():
+            stream.write(json.dumps({"pattern": pattern, "that": that,
+                                     "topic": topic, "template": template},
+                                    sort_keys=True))
+            stream.write("\n")
+
+    def stats(self, top=10):
+        """Return a dictionary with statistics about the node tree (for an
+        overlay, only its own one):
+            nodes: number of nodes
+            templates: number of templates
+            depth: depth of the deepest node (the root is at depth 0)
+            fanOut: for each depth, a histogram of the number of children
+                of the nodes at that depth, as a {minimum: nodes} dictionary
+                with power-of-two buckets (0, 1, 2-3, 4-7...)
+            wildcards: number of _, *, ^ and <bot name> nodes in each part
+                of the categories (pattern, that and topic)
+            thatTries, topicTries: number of that and topic sub-tries
+            longest: the `top` categories with the longest paths, as
+                (number of nodes, [pattern, that, topic]) tuples
+            branches: the `top` first pattern words with the largest
+                subtrees, as (word, nodes, templates) tuples
+            memory: estimated number of bytes taken by the nodes, their
+                keys, the templates and the compiled metadata (index), as
+                returned by memoryUsage()
+        """
+        import heapq
+        names = {self._UNDERSCORE: "_", self._STAR: "*",
+                 self._CARET: "^", self._BOT_NAME: "BOT_NAME"}
+        parts = ("pattern", "that", "topic")
+        stats = {"nodes": 0, "templates": 0, "depth": 0, "fanOut": [],
+                 "wildcards": dict((part, dict.fromkeys(names.values(), 0))
+                                   for part in parts),
+                 "thatTries": 0, "topicTries": 0}
+        longest = []
+        branches = {}
+        # (node, keys leading to it, part of the category it belongs to)
+        stack = [(self._root, (), 0)]
+        while stack:
+            node, keys, part = stack.pop()
+            depth = len(keys)
+            stats["nodes"] += 1
+            stats["depth"] = max(stats["depth"], depth)
+            if keys:
+                branch = branches.setdefault(keys[0], [0, 0])
+                branch[0] += 1
+            while len(stats["fanOut"]) <= depth:
+                stats["fanOut"].append({})
+            bucket = 1 << (len(node).bit_length() - 1) if node else 0
+            histogram = stats["fanOut"][depth]
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            for key, child in node.items():
+                if not isinstance(child, dict):
+                    # (checking the key would be wrong for the pattern word "2")
+                    stats["templates"] += 1
+                    if keys:
+                        branches[keys[0]][1] += 1
+                    entry = (depth, self._category(keys))
+                    if len(longest) < top:
+                        heapq.heappush(longest, entry)
+                    elif entry > longest[0]:
+                        heapq.heapreplace(longest, entry)
+                    continue
+                childPart = part
+                if key == self._THAT and part == 0:
+                    stats["thatTries"] += 1
+                    childPart = 1
+                elif key == self._TOPIC and part < 2:
+                    stats["topicTries"] += 1
+                    childPart = 2
+                elif key in names and (part == 0 or key in (self._UNDERSCORE, self._STAR)):
+                    stats["wildcards"][parts[part]][names[key]] += 1
+                stack.append((child, keys + (key,), childPart))
+        stats["longest"] = sorted(longest, reverse=True)
+        stats["branches"] = [(names.get(key, key), nodes, templates)
+                             for key, (nodes, templates)
+                             in sorted(branches.items(), key=lambda b: -b[1][0])[:top]]
+        stats["memory"] = self.memoryUsage()
+        del stats["memory"]["branches"]
+        return stats
+
+    def memoryUsage(self, top=10, seen=None):
+        """Return an estimate of the memory (in bytes) taken by the node
+        tree (for an overlay, only its own one), as a dictionary:
+            nodes: the node dictionaries
+            keys: their keys (the pattern words)
+            templates: the templates
+            index: the compiled metadata, including the node trees split
+                by topic (see compile()), and the sets
+            branches: the `top` first pattern words with the largest
+                subtrees, as (word, bytes) tuples
+        Objects whose id is in the `seen` set are not counted (see
+        Utils.deepSize()).
+        """
+        from .Utils import deepSize
+        if seen is None:
+            seen = set()
+        usage = dict.fromkeys(("nodes", "keys", "templates"), 0)
+        branches = {}
+        # (node, first pattern word of the branch it belongs to)
+        stack = [(self._root, None)]
+        while stack:
+            node, branch = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            size = sys.getsizeof(node)
+            usage["nodes"] += size
+            for key, child in node.items():
+                keySize = deepSize(key, seen)
+                usage["keys"] += keySize
+                size += keySize
+                if not isinstance(child, dict):
+                    # (checking the key would be wrong for the pattern word "2")
+                    templateSize = deepSize(child, seen)
+                    usage["templates"] += templateSize
+                    size += templateSize
+                else:
+                    stack.append((child, key if branch is None else branch))
+            if branch is not None:
+                branches[branch] = branches.get(branch, 0) + size
+        usage["index"] = (deepSize(self._exact, seen) + deepSize(self._nodeInfo, seen) +
+                          deepSize(self._topics, seen) + deepSize(self._wildTopics, seen) +
+                          deepSize(self._sets, seen) + deepSize(self._setEdges, seen))
+        names = {self._UNDERSCORE: "_", self._STAR: "*",
+                 self._CARET: "^", self._BOT_NAME: "BOT_NAME"}
+        usage["branches"] = [(names.get(key, key), size) for key, size
+                             in sorted(branches.items(), key=lambda b: -b[1])[:top]]
+        return usage
 
     def save(self, filename):
         """Dump the current patterns to the file specified by filename.  To
         restore later, use restore().
+
+        For an overlay, only its own patterns are saved (not those of the base).
         """
         try:
             outFile = open(filename, "wb")
             marshal.dump(self._templateCount, outFile)
             marshal.dump(self._botName, outFile)
             marshal.dump(self._root, outFile)
+            marshal.dump(self.sets(), outFile)
             outFile.close()
         except Exception as e:
             print( "Error saving PatternMgr to file %s:" % filename )
             raise
 
+    def getState(self):
+        """Return the patterns as a dictionary of plain (marshal-able)
+        objects, to be passed to setState() later.
+
+        For an overlay, only its own patterns are included.  Otherwise, the
+        tree is compiled if needed, and the metadata built by compile() is
+        included too, so that setState() does not have to build it again.
+        """
+        state = {"templateCount": self._templateCount,
+                 "botName": self._botName,
+                 "overlay": self._base is not None,
+                 "root": self._root,
+                 "sets": self.sets()}
+        if self._base is None:
+            if not self._compiled:
+                self.compile()
+            state["index"] = self._getIndex()
+        return state
+
+    def setState(self, state):
+        """Replace the patterns with those in a getState() dictionary, and
+        compile them (unless the state has the metadata already)."""
+        if self._frozen:
+            raise RuntimeError("cannot restore into a frozen PatternMgr")
+        if state["overlay"] != (self._base is not None):
+            raise ValueError("the state of an overlay can only be set "
+                             "into an overlay, and vice versa")
+        self._templateCount = state["templateCount"]
+        self._botName = state["botName"]
+        self._root = state["root"]
+        self._restoreSets(state.get("sets", {}))
+        index = state.get("index")
+        if index is None or self._partitionTopics:
+            self.compile()
+        else:
+            self._setIndex(index)
+
+    def _nodes(self):
+        """Return the nodes of the tree in depth-first order.  The order
+        only depends on the keys of the nodes (in insertion order), so it is
+        the same for a tree passed through marshal."""
+        nodes = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(child for child in node.values()
+                         if isinstance(child, dict))
+        return nodes
+
+    def _getIndex(self):
+        """Return the metadata built by compile() (except the topic
+        partitions and the fuzzy matching index) as plain objects, with the
+        nodes replaced by their position in _nodes()."""
+        numbers = {}
+        for n, node in enumerate(self._nodes()):
+            numbers.setdefault(id(node), n)
+        nodeInfo = dict((numbers[key], tuple(info))
+                        for key, info in self._nodeInfo.items() if key in numbers)
+        setEdges = dict((numbers[key], edges)
+                        for key, edges in self._setEdges.items() if key in numbers)
+        exact = dict((words, (numbers[id(node)],
+                              tuple(numbers[id(guard)] for guard in guards), names))
+                     for words, (node, template, guards, names) in self._exact.items())
+        return {"nodeInfo": nodeInfo, "setEdges": setEdges, "exact": exact}
+
+    def _setIndex(self, index):
+        """Install the metadata returned by _getIndex() for the same tree,
+        instead of compiling it."""
+        nodes = self._nodes()
+        infoCache = {}
+        self._nodeInfo = {}
+        for n, info in index["nodeInfo"].items():
+            info = NodeInfo(*info)
+            self._nodeInfo[id(nodes[n])] = infoCache.setdefault(info, info)
+        self._setEdges = dict((id(nodes[n]), edges)
+                              for n, edges in index["setEdges"].items())
+        self._hasSetEdges = bool(self._setEdges)
+        self._topics = self._wildTopics = None
+        self._exact = {}
+        for words, (n, guards, names) in index["exact"].items():
+            node = nodes[n]
+            self._exact[words] = (node, self._catchAllOnly(node),
+                                  tuple(nodes[g] for g in guards), names)
+        self._fuzzyIndex = {}
+        self._fuzzyCache = OrderedDict()
+        if self._fuzzy is not None:
+            self._indexWords(self._root, set())
+        self._compiled = True
+
     def restore(self, filename):
         """Restore a previously save()d collection of patterns."""
+        if self._frozen:
+            raise RuntimeError("cannot restore into a frozen PatternMgr")
         try:
             inFile = open(filename, "rb")
             self._templateCount = marshal.load(inFile)
             self._botName = marshal.load(inFile)
             self._root = marshal.load(inFile)
+            try:
+                sets = marshal.load(inFile)
+            except EOFError:
+                # saved by an older version
+                sets = {}
             inFile.close()
+            self._restoreSets(sets)
         except Exception as e:
             print( "Error restoring PatternMgr from file %s:" % filename )
             raise
 
-    def add(self, data, template):
-        """Add a [pattern/that/topic] tuple and its corresponding template
-        to the node tree.
+    def _restoreSets(self, sets):
+        """Replace the sets with those in a sets() dictionary."""
+        self._sets = {}
+        for name, entries in sets.items():
+            self.addSet(name, entries)
+        self._invalidate()
+
+    def _isSetKey(self, key):
+        """Check whether a node key is a <set>NAME</set> word"""
+        return key.startswith(self._SET_START)
+
+    def _setKey(self, word):
+        """Return the node key for a pattern word, which is only changed if
+        it is a <set>NAME</set> word (to make the name upper case)"""
+        if word.startswith(self._SET_START) and word.endswith(self._SET_END):
+            name = word[len(self._SET_START):-len(self._SET_END)]
+            return self._SET_START + name.upper() + self._SET_END
+        return word
+
+    def _setMembers(self, name):
+        """Return the (entries, lengths) tuple of a set, looking it up in
+        the base brains for an overlay, or None if it is not defined"""
+        mgr = self
+        while mgr is not None:
+            members = mgr._sets.get(name)
+            if members is not None:
+                return members
+            mgr = mgr._base
+        return None
+
+    def _keys(self, data):
+        """Return the list of node keys leading from the root of the node
+        tree to the template of a [pattern/that/topic] tuple.
         """
         pattern,that,topic = data
         # TODO: make sure words contains only legal characters
         # (alphanumerics,*,_)
-
-        # Navigate through the node tree to the template's location, adding
-        # nodes if necessary.
-        node = self._root
+        keys = []
         for word in pattern.split():
             key = word
             if key == u"_":
@@ -98,46 +586,634 @@ class PatternMgr:
                 key = self._CARET
             elif key == u"BOT_NAME":
                 key = self._BOT_NAME
-            if key not in node:
-                node[key] = {}
-            node = node[key]
+            else:
+                key = self._setKey(word)
+            keys.append(key)
 
-        # navigate further down, if a non-empty "that" pattern was included
+        # go further down, if a non-empty "that" pattern was included
         if len(that) > 0:
-            if self._THAT not in node:
-                node[self._THAT] = {}
-            node = node[self._THAT]
+            keys.append(self._THAT)
             for word in that.split():
                 key = word
                 if key == u"_":
                     key = self._UNDERSCORE
                 elif key == u"*":
                     key = self._STAR
-                if key not in node:
-                    node[key] = {}
-                node = node[key]
+                else:
+                    key = self._setKey(word)
+                keys.append(key)
 
-        # navigate yet further down, if a non-empty "topic" string was included
+        # go yet further down, if a non-empty "topic" string was included
         if len(topic) > 0:
-            if self._TOPIC not in node:
-                node[self._TOPIC] = {}
-            node = node[self._TOPIC]
+            keys.append(self._TOPIC)
             for word in topic.split():
                 key = word
                 if key == u"_":
                     key = self._UNDERSCORE
                 elif key == u"*":
                     key = self._STAR
-                if key not in node:
-                    node[key] = {}
+                else:
+                    key = self._setKey(word)
+                keys.append(key)
+        return keys
+
+    def _lookup(self, keys):
+        """Return the template stored at the end of a list of node keys, or
+        None if there is none (in this node tree or in the base brain).
+        """
+        node = self._root
+        try:
+            for key in keys:
                 node = node[key]
+            return node[self._TEMPLATE]
+        except KeyError:
+            if self._base is None:
+                return None
+            return self._base._lookup(keys)
+
+    def add(self, data, template):
+        """Add a [pattern/that/topic] tuple and its corresponding template
+        to the node tree.
+        """
+        if self._frozen:
+            raise RuntimeError("cannot add categories to a frozen PatternMgr")
 
+        # Any change to the tree makes the compiled node metadata stale
+        self._invalidate()
 
-        # add the template.
-        if self._TEMPLATE not in node:
-            self._templateCount += 1    
+        # Navigate through the node tree to the template's location, adding
+        # nodes if necessary.
+        keys = self._keys(data)
+        node = self._root
+        for key in keys:
+            if key not in node:
+                node[key] = {}
+            node = node[key]
+
+        # add the template. A category that replaces an existing one (or
+        # overrides one in the base brain) does not count as a new one.
+        if self._TEMPLATE in node or (self._base is not None and
+                                      self._base._lookup(keys) is not None):
+            self._numReplaced += 1
+        else:
+            self._templateCount += 1
         node[self._TEMPLATE] = template
 
+    def remove(self, data):
+        """Remove the category for a [pattern/that/topic] tuple from the node
+        tree, along with the nodes that are left empty.
+
+        Returns the template removed, or None if there was no such category.
+        For an overlay, only its own categories can be removed (removing an
+        overriding category makes the one in the base visible again).
+        """
+        if self._frozen:
+            raise RuntimeError("cannot remove categories from a frozen PatternMgr")
+        keys = self._keys(data)
+        path = [self._root]
+        for key in keys:
+            try: path.append(path[-1][key])
+            except KeyError: return None
+        try: template = path[-1].pop(self._TEMPLATE)
+        except KeyError: return None
+        self._invalidate()
+        if self._base is None or self._base._lookup(keys) is None:
+            self._templateCount -= 1
+        # prune the branch, bottom-up, until reaching a node still in use
+        for i in range(len(keys)-1, -1, -1):
+            if path[i+1]:
+                break
+            del path[i][keys[i]]
+        return template
+
+    def categories(self):
+        """Iterate over the categories stored, as ([pattern/that/topic],
+        template) tuples (the same arguments taken by add()).
+
+        For an overlay, only its own categories are included.
+        """
+        for keys, template in self._walk(self._root, []):
+            yield self._category(keys), template
+
+    def canonical(self, data):
+        """Return a [pattern/that/topic] tuple in the form used for the
+        categories reported by this object (e.g. by categories()). Tuples
+        that lead to the same category give the same result."""
+        return self._category(self._keys(data))
+
+    def unreachable(self):
+        """Iterate over the categories that can never be matched, because
+        a branch of the node tree with a higher priority always matches
+        first, as ([pattern/that/topic], template) tuples.  These are
+        the categories below:
+         - a * or a literal word, when its node has a _ sibling that leads
+           to a category for any that and topic (so it matches any input
+           with at least one word left)
+         - a *, when its node has such a ^ sibling
+         - the end of a pattern that can be followed by a ^, since the ^
+           is tried instead of the that/topic once the input is consumed
+         - the end of a pattern whose last words are literal, when an
+           earlier _ is certain to match those words for any that and topic
+        The check is conservative: some unreachable categories can be left
+        out, but all those reported are.
+
+        For an overlay, only its own node tree is checked.
+        """
+        for keys, node in self._shadowed(self._root, [], 0):
+            for path, template in self._walk(node, keys):
+                yield self._category(path), template
+
+    def diff(self, other):
+        """Compare the categories in this PatternMgr against those in another
+        one, and iterate over the differences as (change, [pattern/that/topic],
+        template) tuples, where change is one of:
+         - 'added': the category is only in the other PatternMgr
+         - 'removed': the category is only in this PatternMgr
+         - 'changed': the category is in both, with different templates
+        The template is the one in the other PatternMgr, except for removed
+        categories. Applying the changes with patch() turns this PatternMgr
+        into a copy of the other one. Subtrees shared by both are skipped.
+        """
+        return self._diff(self._root, other._root, [])
+
+    def patch(self, changes):
+        """Apply a sequence of changes as produced by diff()."""
+        for change, data, template in list(changes):
+            if change == 'removed':
+                self.remove(data)
+            else:
+                self.add(data, template)
+
+    def _walk(self, node, keys):
+        """Iterate over the (list of keys, template) pairs below a node,
+        reached through the given list of keys."""
+        for key, child in node.items():
+            # (checking the key would be wrong for the pattern word "2")
+            if not isinstance(child, dict):
+                yield keys, child
+            else:
+                for result in self._walk(child, keys + [key]):
+                    yield result
+
+    def _diff(self, mine, theirs, keys):
+        """Recursive helper for diff()."""
+        if mine is theirs:
+            return
+        for key, child in mine.items():
+            if key in theirs:
+                if key != self._TEMPLATE:
+                    for result in self._diff(child, theirs[key], keys + [key]):
+                        yield result
+                elif child != theirs[key]:
+                    yield 'changed', self._category(keys), theirs[key]
+            elif key == self._TEMPLATE:
+                yield 'removed', self._category(keys), child
+            else:
+                for path, template in self._walk(child, keys + [key]):
+                    yield 'removed', self._category(path), template
+        for key, child in theirs.items():
+            if key in mine:
+                continue
+            if key == self._TEMPLATE:
+                yield 'added', self._category(keys), child
+            else:
+                for path, template in self._walk(child, keys + [key]):
+                    yield 'added', self._category(path), template
+
+    def _shadowed(self, node, keys, part, guards=()):
+        """Iterate over the (list of keys, node) pairs of the subtrees
+        below a node that the matcher can never enter (see unreachable()).
+        part is the part of the input the node belongs to (0 for the
+        pattern, 1 for the that and 2 for the topic); the ^, <bot name>
+        and that keys are only special in the pattern.  guards holds the
+        (node, words) pairs for the _ children of the nodes above it, from
+        where node is reached through literal words only.
+        """
+        shadowed = set()
+        if part == 0 and self._CARET in node:
+            shadowed.add(self._THAT)
+            if self._matchesAll(node[self._CARET], part):
+                shadowed.add(self._STAR)
+        underscore = node.get(self._UNDERSCORE)
+        if underscore is not None and self._matchesAll(underscore, part):
+            shadowed.update(key for key in node if key not in self._SPECIAL)
+            shadowed.add(self._STAR)
+            if part == 0:
+                shadowed.add(self._BOT_NAME)
+            underscore = None
+        for guard, words in guards:
+            # the _ takes at least one of the words
+            if self._THAT in node and any(self._certain(words[j:], guard)
+                                          for j in range(1, len(words)+1)):
+                shadowed.add(self._THAT)
+                break
+        for key, child in node.items():
+            if key == self._TEMPLATE:
+                continue
+            if key in shadowed:
+                yield keys + [key], child
+                continue
+            nextPart = part
+            if key == self._THAT and part == 0:
+                nextPart = 1
+            elif key == self._TOPIC and part < 2:
+                nextPart = 2
+            childGuards = ()
+            if part == 0 and key not in self._SPECIAL and not self._isSetKey(key):
+                childGuards = [(guard, words + (key,)) for guard, words in guards]
+                if underscore is not None:
+                    childGuards.append((underscore, (key,)))
+            for result in self._shadowed(child, keys + [key], nextPart, childGuards):
+                yield result
+
+    def _certain(self, words, node):
+        """Check whether matching a sequence of literal pattern words from
+        node is certain to succeed, for any that and topic."""
+        if not words:
+            return self._matchesAll(node, 0)
+        first = words[0]
+        if first in node and first not in self._SPECIAL and \
+           self._certain(words[1:], node[first]):
+            return True
+        for key in (self._UNDERSCORE, self._STAR, self._CARET):
+            if key in node:
+                start = 0 if key == self._CARET else 1
+                for j in range(start, len(words)+1):
+                    if self._certain(words[j:], node[key]):
+                        return True
+        return False
+
+    def _matchesAll(self, node, part):
+        """Check whether matching is certain to succeed once the input
+        words of the given part (see _shadowed()) run out at node: there
+        is a category for any that and topic below it, and no ^ on the
+        way to send the matcher elsewhere."""
+        for key in self._CATCH_ALL[2*part:]:
+            if self._CARET in node or key not in node:
+                return False
+            node = node[key]
+        return self._TEMPLATE in node
+
+    def _category(self, keys):
+        """Turn a list of node keys back into a [pattern/that/topic] tuple
+        (the reverse of _keys())."""
+        words = ([], [], [])
+        part = 0
+        for key in keys:
+            if key == self._THAT and part == 0:
+                part = 1
+            elif key == self._TOPIC and part < 2:
+                part = 2
+            elif key == self._UNDERSCORE:
+                words[part].append(u"_")
+            elif key == self._STAR:
+                words[part].append(u"*")
+            elif key == self._CARET and part == 0:
+                words[part].append(u"^")
+            elif key == self._BOT_NAME and part == 0:
+                words[part].append(u"BOT_NAME")
+            else:
+                words[part].append(key)
+        return tuple(u" ".join(w) for w in words)
+
+    def _invalidate(self):
+        """Discard the node metadata built by compile()."""
+        if self._compiled:
+            self._nodeInfo = {}
+            self._exact = {}
+            self._setEdges = {}
+            self._hasSetEdges = False
+            self._topics = self._wildTopics = None
+            self._fuzzyIndex = {}
+            self._fuzzyCache = OrderedDict()
+            self._compiled = False
+
+    def compile(self):
+        """Annotate the node tree with the metadata used by the matcher to
+        prune hopeless branches (see NodeInfo).
+
+        This is done automatically by the first match after the tree has
+        been modified, but it can be called explicitly once all categories
+        have been loaded, so that no response pays for it.  Metadata is
+        only kept for the children of wildcard edges, since those are the
+        only places where the matcher has to try several suffix splits,
+        and only when it actually restricts the splits to try.
+
+        It also builds the index used to resolve literal inputs without
+        walking the tree (see _indexNode()), the list of <set> children of
+        each node and, if enabled, the node trees for each topic (see
+        setTopicPartitioning()).
+        """
+        self._nodeInfo = {}
+        self._setEdges = {}
+        self._infoCache = {}
+        self._lengths = {}
+        self._topics = self._wildTopics = None
+        if self._partitionTopics:
+            topics = {}
+            try:
+                wild = self._partitionNode(self._root, [], 0, topics)
+            except _CaretShadowing:
+                topics = {}
+                self._lengths = {}
+            if topics:
+                self._topics, self._wildTopics = topics, wild or {}
+        self._compileNode(self._root)
+        if self._topics is not None:
+            # (the nodes shared with the full tree are not visited again)
+            self._compileNode(self._wildTopics)
+            for node in self._topics.values():
+                self._compileNode(node)
+        del self._infoCache, self._lengths
+        self._hasSetEdges = bool(self._setEdges) or (self._base is not None and
+                                                     self._base._hasSetEdges)
+        self._exact = {}
+        self._indexNode(self._root, ())
+        self._fuzzyIndex = {}
+        self._fuzzyCache = OrderedDict()
+        if self._fuzzy is not None:
+            self._indexWords(self._root, set())
+        self._compiled = True
+
+    def _indexWords(self, node, visited):
+        """Add the literal words in the patterns below node to the fuzzy
+        matching index, which maps each word, and each string obtained by
+        deleting one of its characters, to the words it comes from.  Two
+        words within one edit of each other always share one of them.
+        """
+        for key, child in node.items():
+            if key in self._SPECIAL or self._isSetKey(key):
+                continue
+            if key not in visited:
+                visited.add(key)
+                for variant in set([key] + [key[:i] + key[i+1:] for i in range(len(key))]):
+                    self._fuzzyIndex.setdefault(variant, []).append(key)
+            self._indexWords(child, visited)
+
+    def _partitionNode(self, node, keys, part, topics):
+        """Move the categories with a literal topic below node (reached
+        through keys, in the given part of the categories) to node trees of
+        their own, one per topic, in the topics dictionary.  Returns a copy
+        of node without them, or node itself if it holds none of them (None
+        if it would be left empty).  The children shared by a copy and the
+        full tree are recorded in _lengths, for compile() to visit them once.
+        Raises _CaretShadowing if the categories cannot be moved without
+        changing the results of matching.
+        """
+        copy = None
+        for key, child in node.items():
+            # (checking the key would be wrong for the pattern word "2")
+            if not isinstance(child, dict):
+                if part == 2:
+                    # a category with a literal topic
+                    topic = tuple(keys[self._topicStart(keys):])
+                    target = topics.setdefault(topic, {})
+                    for k in keys:
+                        target = target.setdefault(k, {})
+                    target[key] = child
+                    if copy is None:
+                        copy = dict(node)
+                    del copy[key]
+                continue
+            if part == 2 and key in (self._UNDERSCORE, self._STAR):
+                # only categories with a wildcard topic below
+                self._lengths[id(child)] = None
+                continue
+            childPart = part
+            if key == self._THAT and part == 0:
+                childPart = 1
+            elif key == self._TOPIC and part < 2:
+                childPart = 2
+            newChild = self._partitionNode(child, keys + [key], childPart, topics)
+            if newChild is child:
+                self._lengths[id(child)] = None
+                continue
+            if copy is None:
+                copy = dict(node)
+            if newChild:
+                copy[key] = newChild
+            else:
+                del copy[key]
+        if copy is None:
+            return node
+        if part < 2 and self._CARET in node and (self._TOPIC in node or
+                                                 (part == 0 and self._THAT in node)):
+            # When out of input words, _match() tries the ^ child instead
+            # of the that/topic, which the split could separate
+            raise _CaretShadowing()
+        return copy or None
+
+    def _topicStart(self, keys):
+        """Return the index of the first topic word in a list of node keys
+        (the same way _category() finds it)"""
+        part = 0
+        for i, key in enumerate(keys):
+            if key == self._THAT and part == 0:
+                part = 1
+            elif key == self._TOPIC and part < 2:
+                return i + 1
+        return len(keys)
+
+    def _indexNode(self, node, words, path=()):
+        """Add to the exact-match index the input that ends at node, which
+        is reached from the root through a sequence of literal words, and
+        recurse into its literal children.  path holds the nodes visited
+        on the way, from the root down to node's parent.
+
+        The index maps a tuple of input words to the node where the literal
+        path for them ends, so that only the that/topic are left to match.
+        The _ children of the nodes along the path take precedence over the
+        literal words, so the entry also records the nodes where they could
+        end up after consuming the input, and the words that would let them
+        match if they were the bot name (see _ends()); the entry is used
+        only if none of those apply.  If that cannot be decided in advance,
+        no entry is added.
+        """
+        path = path + (node,)
+        if words:
+            for key in (self._CARET,) + self._TERMINALS:
+                if key in node:
+                    break
+            else:
+                key = None
+            if key is not None:
+                guards, names = [], set()
+                for i, parent in enumerate(path[:-1]):
+                    if self._UNDERSCORE in parent:
+                        child = parent[self._UNDERSCORE]
+                        suffix = words[i+1:]
+                        for j in self._splits(suffix, child, anyBot=True):
+                            if not self._ends(suffix[j:], child, guards, names):
+                                break
+                        else:
+                            continue
+                        break
+                else:
+                    self._exact[words] = (node, self._catchAllOnly(node),
+                                          tuple(guards), frozenset(names))
+        for key, child in node.items():
+            if key not in self._SPECIAL and not self._isSetKey(key):
+                self._indexNode(child, words + (key,), path)
+
+    def _ends(self, words, node, ends, names):
+        """Collect in ends the nodes where the pattern sub-trie below node
+        can run out of input words when matching them (i.e. the candidates
+        to go on matching the that/topic).  Returns False if a match cannot
+        be ruled out just by looking at those nodes, or is certain.
+
+        A <bot name> edge is only taken if the word is the bot name, which
+        is not known in advance; if following it would make this return
+        False, the word is added to the names set instead.
+        """
+        if not words:
+            if self._CARET in node:
+                return False
+            for key in self._TERMINALS:
+                if key in node:
+                    if self._catchAll(node):
+                        return False
+                    if not any(n is node for n in ends):
+                        ends.append(node)
+                    break
+            return True
+        for key in (self._UNDERSCORE, self._STAR, self._CARET):
+            if key in node:
+                child = node[key]
+                suffix = words if key == self._CARET else words[1:]
+                for j in self._splits(suffix, child, anyBot=True):
+                    if not self._ends(suffix[j:], child, ends, names):
+                        return False
+        if self._setChildren(node):
+            # (how many words a set takes depends on them)
+            return False
+        first = words[0]
+        if first in node and not self._ends(words[1:], node[first], ends, names):
+            return False
+        if self._BOT_NAME in node:
+            if not self._ends(words[1:], node[self._BOT_NAME], ends, names):
+                names.add(first)
+        return True
+
+    def _catchAll(self, node):
+        """Check whether node holds a category for any that and topic"""
+        try:
+            for key in self._CATCH_ALL:
+                node = node[key]
+            return self._TEMPLATE in node
+        except KeyError:
+            return False
+
+    def _catchAllOnly(self, node):
+        """If node holds nothing but the category for any that and topic
+        (the usual case), return its template"""
+        if self._CARET in node or self._THAT not in node:
+            return None
+        node = node[self._THAT]
+        for key in self._CATCH_ALL[1:]:
+            if len(node) != 1 or key not in node:
+                return None
+            node = node[key]
+        if len(node) != 1:
+            return None
+        return node.get(self._TEMPLATE)
+
+    def _exactMatch(self, words, thatWords, topicWords):
+        """Look up a list of input words in the exact-match index. Returns
+        a (pattern, template) tuple, or None if the input needs to go
+        through _match()."""
+        entry = self._exactEntry(tuple(words))
+        if entry is None:
+            return None
+        node, template, guards, names = entry
+        if self._botName in names:
+            return None
+        for guard in guards:
+            if self._match([], thatWords, topicWords, guard)[1] is not None:
+                return None
+        if template is not None and thatWords and topicWords:
+            return list(words) + list(self._CATCH_ALL), template
+        pattern, template = self._match([], thatWords, topicWords, node)
+        if template is None:
+            return None
+        return list(words) + pattern, template
+
+    def _exactEntry(self, key):
+        """Get the exact-match index entry for a tuple of input words,
+        including the base brain for an overlay"""
+        if self._base is None:
+            return self._exact.get(key)
+        if not self._root:
+            return self._base._exactEntry(key)
+        # For an overlay, an entry in one of the indexes is only good if
+        # the other node tree cannot reach the end of the input
+        entry = self._exact.get(key)
+        if entry is not None:
+            other = self._base._matchRoot()
+        else:
+            entry = self._base._exactEntry(key)
+            other = self._root
+        if entry is None:
+            return None
+        ends, names = [], set(entry[3])
+        if not self._ends(key, other, ends, names) or ends:
+            return None
+        return entry[:3] + (frozenset(names),)
+
+    def _compileNode(self, node):
+        """Compute NodeInfo for all the wildcard children below node.
+
+        Returns a (minLen, maxLen) tuple with the number of words that can
+        be consumed from node on the way to the end of its (pattern, that or
+        topic) sub-trie.  minLen is _INFINITY if no end can be reached.
+        """
+        lengths = self._lengths.get(id(node))
+        if lengths is not None:
+            return lengths
+        if self._TEMPLATE in node or self._THAT in node or self._TOPIC in node:
+            minLen, maxLen = 0, 0
+        else:
+            minLen, maxLen = _INFINITY, -1
+        setEdges = []
+        for key, child in node.items():
+            if key == self._TEMPLATE:
+                continue
+            childMin, childMax = self._compileNode(child)
+            if key == self._THAT or key == self._TOPIC:
+                # a separate sub-trie, matched against other words
+                continue
+            if self._isSetKey(key):
+                name = key[len(self._SET_START):-len(self._SET_END)]
+                setEdges.append((key, name))
+                members = self._setMembers(name)
+                if childMin == _INFINITY or not members or not members[1]:
+                    continue
+                lengths = members[1]
+                minLen = min(minLen, childMin + lengths[-1])
+                maxLen = max(maxLen, min(childMax + lengths[0], _INFINITY))
+                continue
+            if key == self._STAR or key == self._UNDERSCORE or key == self._CARET:
+                # (a set also takes words that are not keys of the node)
+                wild = (self._STAR in child or self._UNDERSCORE in child
+                        or self._CARET in child or id(child) in self._setEdges)
+                if not wild or childMin > 0 or childMax < _INFINITY:
+                    info = NodeInfo(wild, self._BOT_NAME in child, childMin, childMax)
+                    # share identical tuples, there are only a few distinct ones
+                    self._nodeInfo[id(child)] = self._infoCache.setdefault(info, info)
+                if childMin == _INFINITY:
+                    continue
+                if key != self._CARET:
+                    childMin += 1
+                minLen = min(minLen, childMin)
+                maxLen = _INFINITY
+            elif childMin != _INFINITY:
+                minLen = min(minLen, childMin + 1)
+                maxLen = max(maxLen, min(childMax + 1, _INFINITY))
+        if setEdges:
+            self._setEdges[id(node)] = tuple(sorted(setEdges))
+        if id(node) in self._lengths:
+            self._lengths[id(node)] = (minLen, maxLen)
+        return minLen, maxLen
+
     def match(self, pattern, that, topic):
         """Return the template which is the closest match to pattern. The
         'that' parameter contains the bot's previous response. The 'topic'
@@ -160,7 +1236,7 @@ class PatternMgr:
         topicInput = re.sub(self._puncStripRE, " ", topicInput)
         
         # Pass the input off to the recursive call
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
+        patMatch, template = self._matchWords(input_.split(), thatInput.split(), topicInput.split())
         if template is None or patMatch is None:
             return None
         return MatchResult(patMatch, template)
@@ -190,7 +1266,7 @@ class PatternMgr:
         topicInput = re.sub(self._whitespaceRE, " ", topicInput)
 
         # Pass the input off to the recursive pattern-matcher
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
+        patMatch, template = self._matchWords(input_.split(), thatInput.split(), topicInput.split())
         if template == None:
             return ""
 
@@ -307,7 +1383,7 @@ class PatternMgr:
         topicInput = re.sub(self._whitespaceRE, " ", topicInput)
 
         # Pass the input off to the recursive pattern-matcher
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
+        patMatch, template = self._matchWords(input_.split(), thatInput.split(), topicInput.split())
         if template == None:
             return ""
 
@@ -371,6 +1447,200 @@ class PatternMgr:
             if caretType == 'caret': return ' '.join(pattern.split()[start:end+1])
         else: return u""
 
+    def _matchWords(self, words, thatWords, topicWords, fuzzy=True):
+        """Find the best match for the (normalized) input words, that and
+        topic, and return a (pattern, template) tuple like _match()."""
+        if not self._compiled:
+            self.compile()
+        # Try first the exact-match index. Words in the that/topic that
+        # collide with node keys can make _match() take odd paths, so
+        # leave those to it.
+        result = None
+        for word in thatWords + topicWords:
+            if word in self._TERMINALS:
+                break
+        else:
+            result = self._exactMatch(words, thatWords, topicWords)
+        if result is None:
+            result = self._match(words, thatWords, topicWords, self._matchRoot(topicWords))
+        if fuzzy and self._fuzzy is not None and self._isCatchAll(result[0]):
+            return self._fuzzyMatch(words, thatWords, topicWords) or result
+        return result
+
+    def _isCatchAll(self, pattern):
+        """Check whether a matched pattern (as returned by _match()) is
+        the catch-all one (just *), or there was no match"""
+        return (pattern is None or pattern[:1] == [self._STAR] and
+                (len(pattern) == 1 or pattern[1] in self._TERMINALS))
+
+    def _fuzzyMatch(self, words, thatWords, topicWords):
+        """Look for the closest literal pattern to the input words (see
+        setFuzzyMatching()) that does not lead to the catch-all category,
+        and return a (pattern, template) tuple for it, or None."""
+        key = (tuple(words), tuple(thatWords), tuple(topicWords))
+        cache = self._fuzzyCache
+        with self._fuzzyLock:
+            if key in cache:
+                # most recently used last
+                result = cache[key] = cache.pop(key)
+                return result
+        maxDistance, threshold, budget = self._fuzzy
+        length = len(u" ".join(words))
+        maxDistance = min(maxDistance, int(length * (1 - threshold)))
+        candidates = []
+        deadline = time.time() + budget
+        timedOut = False
+        if maxDistance > 0:
+            try:
+                self._fuzzyWalk(words, 0, self._matchRoot(), [], 0, maxDistance,
+                                candidates, deadline)
+            except _BudgetExceeded:
+                timedOut = True
+        result = None
+        for distance, corrected in sorted(candidates):
+            found = self._matchWords(corrected, thatWords, topicWords, fuzzy=False)
+            if not self._isCatchAll(found[0]):
+                result = found
+                break
+        with self._fuzzyLock:
+            metrics = self._fuzzyMetrics
+            metrics["attempts"] += 1
+            if timedOut:
+                metrics["timeouts"] += 1
+            metrics["hits" if result is not None else "misses"] += 1
+            cache[key] = result
+            while len(cache) > self._FUZZY_CACHE_SIZE:
+                cache.popitem(last=False)
+        return result
+
+    def _fuzzyWords(self, word):
+        """Return the indexed words that share with a word a string obtained
+        by deleting at most one character from each (other than the word
+        itself), including those of the base brains"""
+        found = set()
+        variants = set([word] + [word[:i] + word[i+1:] for i in range(len(word))])
+        mgr = self
+        while mgr is not None:
+            for variant in variants:
+                found.update(mgr._fuzzyIndex.get(variant, ()))
+            mgr = mgr._base
+        found.discard(word)
+        return found
+
+    def _fuzzyWalk(self, words, i, node, corrected, distance, maxDistance,
+                   candidates, deadline):
+        """Follow the literal edges of the node tree for words[i:], trying
+        also the words close to each one (see _fuzzyWords()) while the total
+        number of edits stays within maxDistance, and collect in candidates the
+        (edits, words) tuples for the patterns that end with the input.
+        """
+        if time.time() > deadline:
+            raise _BudgetExceeded()
+        if i == len(words):
+            if distance > 0:
+                for key in self._TERMINALS:
+                    if key in node:
+                        candidates.append((distance, list(corrected)))
+                        break
+            return
+        word = words[i]
+        options = [(word, 0)] if word in node and word not in self._SPECIAL else []
+        if distance < maxDistance:
+            from .Utils import editDistance
+            for other in self._fuzzyWords(word):
+                if other in node:
+                    cost = editDistance(word, other)
+                    if distance + cost <= maxDistance:
+                        options.append((other, cost))
+        for other, cost in options:
+            corrected.append(other)
+            self._fuzzyWalk(words, i + 1, node[other], corrected, distance + cost,
+                            maxDistance, candidates, deadline)
+            corrected.pop()
+
+    def _matchRoot(self, topicWords=None):
+        """Return the node to start matching from: the root of the node
+        tree, merged with the one of the base brain for an overlay.  If the
+        topic words are given and the node tree is split by topic, only the
+        categories that can apply to that topic are included.
+        """
+        root = self._root
+        if topicWords is not None and self._topics is not None:
+            root = self._wildTopics
+            topic = self._topics.get(tuple(topicWords))
+            if topic is not None:
+                root = _MergedNode(topic, root) if root else topic
+        if self._base is None:
+            return root
+        if not self._root:
+            return self._base._matchRoot(topicWords)
+        return _MergedNode(root, self._base._matchRoot(topicWords))
+
+    def _info(self, node):
+        """Return the NodeInfo for a node, or None if it has none.  It is
+        looked up in the base brains for an overlay, and combined from both
+        sides for a _MergedNode."""
+        if isinstance(node, _MergedNode):
+            first = self._info(node._overlay)
+            second = first and self._info(node._base)
+            if second is None:
+                return None
+            return NodeInfo(first.wild or second.wild, first.bot or second.bot,
+                            min(first.minLen, second.minLen),
+                            max(first.maxLen, second.maxLen))
+        mgr = self
+        while mgr is not None:
+            info = mgr._nodeInfo.get(id(node))
+            if info is not None:
+                return info
+            mgr = mgr._base
+        return None
+
+    def _setChildren(self, node):
+        """Return the (key, set name) tuples for the <set> children of a
+        node, as found by compile().  They are looked up in the base brains
+        for an overlay, and combined from both sides for a _MergedNode."""
+        if isinstance(node, _MergedNode):
+            first = self._setChildren(node._overlay)
+            second = self._setChildren(node._base)
+            if not first or not second:
+                return first or second
+            return tuple(sorted(set(first + second)))
+        mgr = self
+        while mgr is not None:
+            edges = mgr._setEdges.get(id(node))
+            if edges is not None:
+                return edges
+            mgr = mgr._base
+        return ()
+
+    def _splits(self, words, node, anyBot=False):
+        """Return the indices j (in ascending order) for which words[j:]
+        could possibly be matched below node, which was reached through a
+        wildcard edge.  This is what keeps the wildcard loops in _match()
+        from descending into subtrees that cannot succeed.  If anyBot is
+        true, any word is taken as a possible match for the bot name.
+        """
+        n = len(words)
+        info = self._info(node)
+        if info is None:
+            return range(n+1)
+        # The words consumed below node must fit within [minLen, maxLen].
+        # An input word can collide with the keys of the THAT/TOPIC
+        # sub-tries, which lets it wander off through them; don't apply the
+        # upper bound in that (rare) case.
+        lo = 0
+        if info.maxLen < n and self._THAT not in words and self._TOPIC not in words:
+            lo = n - info.maxLen
+        hi = n - min(info.minLen, n+1)
+        if info.wild or lo > hi or (anyBot and info.bot):
+            return range(lo, hi+1)
+        # Without wildcard children, the next word must be one of the
+        # node's literal keys (or the bot name)
+        botName = self._botName if info.bot else None
+        return [j for j in range(lo, hi+1)
+                if j == n or words[j] in node or words[j] == botName]
+
     def _match(self, words, thatWords, topicWords, root):
         """Return a tuple (pat, tem) where pat is a list of nodes, starting
         at the root and leading to the matching pattern, and tem is the
@@ -415,6 +1685,9 @@ class PatternMgr:
                 pattern = []
                 try: template = root[self._TEMPLATE]
                 except KeyError: template = None
+                # (a node for the pattern word "2" is not a template)
+                if isinstance(template, (dict, _MergedNode)):
+                    template = None
             return (pattern, template)
 
         first = words[0]
@@ -426,9 +1699,10 @@ class PatternMgr:
         if self._UNDERSCORE in root:
             # Must include the case where suf is [] in order to handle the case
             # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
+            node = root[self._UNDERSCORE]
+            for j in self._splits(suffix, node):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._UNDERSCORE])
+                pattern, template = self._match(suf, thatWords, topicWords, node)
                 if template is not None:
                     newPattern = [self._UNDERSCORE] + pattern
                     return (newPattern, template)
@@ -446,15 +1720,31 @@ class PatternMgr:
             if template is not None:
                 newPattern = [first] + pattern
                 return (newPattern, template)
+
+        # check sets, longest entries first. Like the bot name, the words
+        # they take go into the pattern.
+        if self._hasSetEdges:
+            for key, name in self._setChildren(root):
+                members = self._setMembers(name)
+                if members is None:
+                    continue
+                entries, lengths = members
+                for n in lengths:
+                    if n <= len(words) and tuple(words[:n]) in entries:
+                        pattern, template = self._match(words[n:], thatWords, topicWords, root[key])
+                        if template is not None:
+                            newPattern = words[:n] + pattern
+                            return (newPattern, template)
         
         # check caret
         if self._CARET in root:
             # Must include the case where suf is [] in order to handle the case
             # where a ^ is at the end of the pattern.
             _suffix = words
-            for j in range(len(_suffix)+1):
+            node = root[self._CARET]
+            for j in self._splits(_suffix, node):
                 suf = _suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._CARET])
+                pattern, template = self._match(suf, thatWords, topicWords, node)
                 if template is not None:
                     newPattern = [self._CARET] + pattern
                     return (newPattern, template)
@@ -463,12 +1753,46 @@ class PatternMgr:
         if self._STAR in root:
             # Must include the case where suf is [] in order to handle the case
             # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
+            node = root[self._STAR]
+            for j in self._splits(suffix, node):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._STAR])
+                pattern, template = self._match(suf, thatWords, topicWords, node)
                 if template is not None:
                     newPattern = [self._STAR] + pattern
                     return (newPattern, template)
 
         # No matches were found.
         return (None, None)         
+
+
+class _BudgetExceeded(Exception):
+    """Raised when a fuzzy match search runs out of time"""
+
+
+class _CaretShadowing(Exception):
+    """Raised when splitting the node tree by topic would change which
+    categories a ^ keeps from matching"""
+
+
+class _MergedNode(object):
+    """A read-only view of a node of an overlay PatternMgr and the node at
+    the same position in its base, which behaves (as far as _match() is
+    concerned) as if both node trees had been merged, the overlay taking
+    precedence for templates.
+    """
+    __slots__ = ('_overlay', '_base')
+
+    def __init__(self, overlay, base):
+        self._overlay = overlay
+        self._base = base
+
+    def __contains__(self, key):
+        return key in self._overlay or key in self._base
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            child = self._overlay[key]
+            if key != PatternMgr._TEMPLATE and key in self._base:
+                return _MergedNode(child, self._base[key])
+            return child
+        return self._base[key]
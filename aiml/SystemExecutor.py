@@ -0,0 +1,215 @@
+"""This module implements the SystemExecutor class, which runs the shell
+commands produced by AIML <system> elements on behalf of a Kernel.
+
+Commands are run as subprocesses, with a few safeguards so that a
+misbehaving command cannot stall the bot:
+ - at most `workers` commands run at the same time; the rest wait for
+   their turn (within their timeout). The limit covers all the sessions
+   of the Kernel, and all the Kernels sharing the executor (see
+   Kernel.configureSystem()).
+ - a command still running after its timeout is killed
+ - output beyond `maxOutput` bytes is discarded, and the command killed
+ - if an allowlist of executables is given, any other command is
+   rejected. Allowed commands are run directly, not through the shell,
+   so that the allowlist cannot be sidestepped with shell syntax.
+ - the output of the executables declared idempotent is cached for
+   `cacheTTL` seconds
+
+Usage:
+    > executor = SystemExecutor(timeout=2, allowed=["date", "uptime"])
+    > print( executor.run("date +%Y") )
+    2016
+Failures (rejected commands, timeouts, errors starting the command) raise
+RuntimeError. The metrics() method returns counters and timings.
+"""
+
+from __future__ import print_function
+
+import locale
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from .constants import *
+
+
+class SystemExecutor(object):
+    """Bounded, time-limited runner for <system> commands."""
+
+    def __init__(self, workers=4, timeout=10.0, maxOutput=65536,
+                 allowed=None, idempotent=(), cacheTTL=60.0, cacheSize=256):
+        """Create an executor.
+
+        workers: maximum number of commands running at the same time
+        timeout: default number of seconds a command may take, including
+            the time spent waiting for a free worker
+        maxOutput: maximum number of bytes of output kept from a command
+        allowed: if given, the names of the only executables that may run
+        idempotent: names of the executables whose output can be cached
+        cacheTTL: number of seconds a cached output is valid
+        cacheSize: maximum number of cached outputs
+        """
+        if workers < 1:
+            raise ValueError("at least one worker is needed")
+        self._workers = threading.BoundedSemaphore(workers)
+        self._timeout = timeout
+        self._maxOutput = maxOutput
+        self._allowed = None if allowed is None else frozenset(allowed)
+        self._idempotent = frozenset(idempotent)
+        self._cacheTTL = cacheTTL
+        self._cacheSize = cacheSize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._encoding = locale.getpreferredencoding(False)
+        self._metrics = dict.fromkeys(("commands", "cacheHits", "rejected",
+                                       "timeouts", "truncated", "errors"), 0)
+        self._metrics.update(dict.fromkeys(("queueWait", "maxQueueWait",
+                                            "execTime", "maxExecTime"), 0.0))
+
+    def metrics(self):
+        """Return a dictionary with the executor counters (commands,
+        cacheHits, rejected, timeouts, truncated, errors) and timings in
+        seconds (total and maximum queueWait and execTime)."""
+        with self._lock:
+            return dict(self._metrics)
+
+    def clearCache(self):
+        """Discard all cached outputs."""
+        with self._lock:
+            self._cache.clear()
+
+    def run(self, command, timeout=None, deadline=None):
+        """Run a command, and return its output as a unicode string.
+
+        The timeout (in seconds) overrides the executor default. If a
+        deadline (a time.time() value) is given, the timeout is shortened
+        so that the command ends by then. Raises RuntimeError if the
+        command is rejected, cannot be started or does not finish in time.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                self._count("timeouts")
+                raise RuntimeError("deadline passed before running: %s" % command)
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            args = []
+        executable = os.path.basename(args[0]) if args else ""
+        if self._allowed is not None and executable not in self._allowed:
+            self._count("rejected")
+            raise RuntimeError("command not allowed: %s" % executable)
+
+        cacheable = executable in self._idempotent
+        if cacheable:
+            with self._lock:
+                entry = self._cache.get(command)
+                if entry is not None and entry[0] > time.time():
+                    self._metrics["cacheHits"] += 1
+                    return entry[1]
+
+        # wait for a free worker
+        start = time.time()
+        if PY3:
+            acquired = self._workers.acquire(timeout=timeout)
+        else:
+            acquired = self._workers.acquire()
+        waited = time.time() - start
+        self._addTime("queueWait", waited)
+        if not acquired:
+            self._count("timeouts")
+            raise RuntimeError("no worker available for: %s" % command)
+        try:
+            output = self._execute(args if self._allowed is not None else command,
+                                   timeout - waited)
+        finally:
+            self._workers.release()
+            self._addTime("execTime", time.time() - start - waited)
+
+        if cacheable:
+            with self._lock:
+                self._cache.pop(command, None)
+                self._cache[command] = (time.time() + self._cacheTTL, output)
+                while len(self._cache) > self._cacheSize:
+                    self._cache.popitem(last=False)
+        return output
+
+    def _execute(self, command, timeout):
+        """Run a command (a string for the shell, or a list of arguments)
+        and collect its output."""
+        self._count("commands")
+        options = {}
+        if os.name == "posix":
+            # run in its own process group, so that killing it also gets
+            # whatever it started
+            if PY3:
+                options["start_new_session"] = True
+            else:
+                options["preexec_fn"] = os.setsid
+        try:
+            proc = subprocess.Popen(command, shell=not isinstance(command, list),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, **options)
+        except (OSError, ValueError) as msg:
+            self._count("errors")
+            raise RuntimeError("cannot run command: %s" % msg)
+        proc.stdin.close()
+
+        killed = []
+        def kill():
+            if proc.poll() is None:
+                killed.append(True)
+                self._kill(proc)
+        timer = threading.Timer(max(timeout, 0), kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            chunks = []
+            size = 0
+            while True:
+                chunk = proc.stdout.read(min(8192, self._maxOutput + 1 - size))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self._maxOutput:
+                    # no need for the rest
+                    self._count("truncated")
+                    self._kill(proc)
+                    break
+            proc.stdout.close()
+            proc.wait()
+        finally:
+            timer.cancel()
+        if killed:
+            self._count("timeouts")
+            raise RuntimeError("command timed out after %.1f seconds" % timeout)
+        output = b"".join(chunks)[:self._maxOutput]
+        return output.decode(self._encoding, "replace")
+
+    def _kill(self, proc):
+        """Kill a running command (and its process group)."""
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass    # already finished
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def _addTime(self, name, seconds):
+        with self._lock:
+            self._metrics[name] += seconds
+            maxName = "max" + name[0].upper() + name[1:]
+            if seconds > self._metrics[maxName]:
+                self._metrics[maxName] = seconds
@@ -3,6 +3,8 @@ modules in the PyAIML package.
 
 """
 
+import sys
+
 def sentences(s):
     """Split the string s into a list of sentences."""
     try: s+""
@@ -25,3 +27,45 @@ def sentences(s):
     if len(sentenceList) == 0: sentenceList.append(s)
     return sentenceList
 
+
+def deepSize(obj, seen=None):
+    """Return an estimate of the memory (in bytes) taken by an object and
+    everything it holds (through dicts, lists, tuples and sets).  Objects
+    whose id is in the `seen` set are not counted, and those counted are
+    added to it, so that a set can be shared by several calls in order to
+    count each object only once."""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+def editDistance(a, b):
+    """Return the edit distance between two strings: the number of
+    insertions, deletions, substitutions and transpositions of adjacent
+    characters needed to turn one into the other."""
+    if len(a) < len(b):
+        a, b = b, a
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j-1] + 1,
+                       previous[j-1] + (ca != cb))
+            if (j > 1 and i > 1 and ca == b[j-2] and a[i-2] == cb
+                    and before[j-2] + 1 < cost):
+                cost = before[j-2] + 1
+            current.append(cost)
+        before, previous = previous, current
+    return previous[-1]
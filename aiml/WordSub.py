@@ -33,10 +33,8 @@ except: from UserDict import UserDict as dict
 
 import re
 import string
-try:
-    from ConfigParser import ConfigParser
-except ImportError:
-    from configparser import ConfigParser
+import threading
+from collections import OrderedDict
 
 class WordSub(dict):
     """All-in-one multiple-string-substitution class."""
@@ -56,22 +54,79 @@ class WordSub(dict):
         self._regex = re.compile("|".join(map(self._wordToRegex, self.keys())))
         self._regexIsDirty = False
 
-    def __init__(self, defaults = {}):
+    def __init__(self, defaults = {}, cacheSize = 0):
         """Initialize the object, and populate it with the entries in
         the defaults dictionary.
 
+        If cacheSize is not zero, the results of up to that many
+        different texts passed to sub() are remembered (the least
+        recently used are discarded first).
+
         """
         self._regex = None
         self._regexIsDirty = True
+        self._cache = OrderedDict()
+        self._cacheSize = cacheSize
+        self._cacheLock = threading.Lock()
+        self._hits = self._misses = 0
+        self._frozen = False
         for k,v in defaults.items():
             self[k] = v
 
+    @classmethod
+    def fromExpanded(cls, table, cacheSize = 0):
+        """Create a WordSub from the contents of another one (i.e. with all
+        the case variants already in it), and compile its regex."""
+        subber = cls(cacheSize=cacheSize)
+        dict.update(subber, table)
+        subber._update_regex()
+        return subber
+
+    def freeze(self):
+        """Make the substitutions read-only (so that the object can be
+        shared), and compile the regex now."""
+        if self._regexIsDirty:
+            self._update_regex()
+        self._frozen = True
+
+    def isFrozen(self):
+        """Return True if the substitutions can no longer be changed."""
+        return self._frozen
+
+    def cacheSize(self):
+        """Return the maximum number of results remembered by sub()"""
+        return self._cacheSize
+
+    def setCacheSize(self, size):
+        """Change the maximum number of results remembered by sub(); 0
+        disables the cache."""
+        with self._cacheLock:
+            self._cacheSize = size
+            while len(self._cache) > size:
+                self._cache.popitem(last=False)
+
+    def cacheInfo(self):
+        """Return a dictionary with the cache hits, misses, current and
+        maximum size."""
+        with self._cacheLock:
+            return {"hits": self._hits, "misses": self._misses,
+                    "size": len(self._cache), "maxSize": self._cacheSize}
+
+    def clearCache(self):
+        """Forget all remembered results (and reset the counters)."""
+        with self._cacheLock:
+            self._cache.clear()
+            self._hits = self._misses = 0
+
     def __call__(self, match):
         """Handler invoked for each regex match."""
         return self[match.group(0)]
 
     def __setitem__(self, i, y):
+        if self._frozen:
+            raise RuntimeError("cannot modify a frozen WordSub")
         self._regexIsDirty = True
+        self.clearCache()
         # for each entry the user adds, we actually add three entrys:
         super(type(self),self).__setitem__(i.lower(),y.lower()) # key = value
         super(type(self),self).__setitem__(string.capwords(i), string.capwords(y)) # Key = Value
@@ -79,7 +134,25 @@ class WordSub(dict):
 
     def sub(self, text):
         """Translate text, returns the modified text."""
+        if self._cacheSize:
+            with self._cacheLock:
+                try:
+                    result = self._cache.pop(text)
+                except KeyError:
+                    pass
+                else:
+                    # put it back as the most recently used
+                    self._cache[text] = result
+                    self._hits += 1
+                    return result
         if self._regexIsDirty:
             self._update_regex()
-        return self._regex.sub(self, text)
+        result = self._regex.sub(self, text)
+        if self._cacheSize:
+            with self._cacheLock:
+                self._misses += 1
+                self._cache[text] = result
+                while len(self._cache) > self._cacheSize:
+                    self._cache.popitem(last=False)
+        return result
 
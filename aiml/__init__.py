@@ -2,3 +2,6 @@ __all__ = []
 
 # The Kernel class is the only class most implementations should need.
 from .Kernel import Kernel
+
+# To check snapshot files (see Kernel.saveSnapshot()) without loading them
+from .Kernel import readSnapshotHeader
@@ -10,3 +10,7 @@ VERSION = '0.9.3'
 PY3 = sys.version_info.major == 3
 if PY3:
     unicode = str
+
+# Levels of the diagnostics issued by the Kernel, with the values of the
+# logging module (which is only imported once a diagnostic is issued)
+LOG_INFO, LOG_WARNING, LOG_ERROR = 20, 30, 40
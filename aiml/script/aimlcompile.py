@@ -0,0 +1,214 @@
+"""
+Build a Kernel snapshot from AIML files ahead of time, so that a bot can
+start from it instead of parsing the AIML files on every start-up.
+
+Usage:
+    aiml-compile [--chdir DIR] [--commands CMD ...] -o FILE file1.aiml ...
+    aiml-compile --standard | --alice [-o FILE]
+
+File names may contain wildcards. The snapshot (see Kernel.saveSnapshot())
+records a fingerprint of the AIML sources, so that a stale snapshot can be
+detected. For the bundled sets the snapshot is written by default next to
+the AIML files, where aiml-bot --standard/--alice looks for it (and where
+setup.py picks it up, if it was built before packaging).
+
+With --analyze, the categories replaced by later ones, those that can never
+be matched and the identical templates are reported. --prune removes the
+unreachable categories and shares the identical templates before writing
+the snapshot.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import hashlib
+import io
+import os.path
+import sys
+import time
+
+import aiml
+from aiml.constants import VERSION
+
+
+# How to build each of the bundled AIML sets
+BUNDLED = {
+    "standard": {"learnFiles": "startup.xml", "commands": ["load aiml b"]},
+    "alice": {"learnFiles": "startup.xml", "commands": ["load alice"]},
+}
+
+
+def bundled_dir(name):
+    '''
+    Directory holding a bundled AIML set
+    '''
+    return os.path.join(aiml.__path__[0], 'botdata', name)
+
+
+def bundled_sources(name):
+    '''
+    All the files a bundled AIML set may learn
+    '''
+    folder = bundled_dir(name)
+    return sorted(glob.glob(os.path.join(folder, '*.aiml')) +
+                  glob.glob(os.path.join(folder, '*.xml')))
+
+
+def prebuilt_path(name):
+    '''
+    Default location of the prebuilt snapshot for a bundled AIML set
+    '''
+    return os.path.join(bundled_dir(name), name + '.snapshot')
+
+
+def source_fingerprint(files, commands=()):
+    '''
+    Compute a fingerprint of a brain build: the contents of the source files
+    (and their names, without the directory), the start-up commands and the
+    python-aiml version
+    '''
+    digest = hashlib.sha1(VERSION.encode('utf-8'))
+    for cmd in commands:
+        digest.update(b'\0cmd\0' + cmd.encode('utf-8'))
+    for f in sorted(files, key=os.path.basename):
+        digest.update(b'\0file\0' + os.path.basename(f).encode('utf-8') + b'\0')
+        with io.open(f, 'rb') as inp:
+            digest.update(inp.read())
+    return digest.hexdigest()
+
+
+def load_prebuilt(kern, name, filename=None):
+    '''
+    Load the prebuilt snapshot for a bundled AIML set into a Kernel, if there
+    is one and it was built from the current sources. Return True if it was
+    loaded
+    '''
+    if filename is None:
+        filename = prebuilt_path(name)
+    try:
+        header = aiml.readSnapshotHeader(filename)
+    except (IOError, OSError, ValueError):
+        return False
+    fingerprint = source_fingerprint(bundled_sources(name),
+                                     BUNDLED[name]["commands"])
+    if header["meta"].get("fingerprint") != fingerprint:
+        return False
+    kern.loadSnapshot(filename)
+    return True
+
+
+def category_name( data ):
+    '''
+    Format a (pattern, that, topic) tuple for display
+    '''
+    return u' | '.join( data )
+
+
+def print_analysis( report ):
+    '''
+    Print the results of Kernel.analyze()
+    '''
+    name = lambda f : os.path.basename(f) if f else '?'
+    print( "Replaced categories: %d" % len(report["replaced"]) )
+    for data, first, second in report["replaced"]:
+        print( "  %s (%s, replaced by %s)" % (category_name(data), name(first),
+                                              name(second)) )
+    print( "Unreachable categories: %d" % len(report["unreachable"]) )
+    for data, f in report["unreachable"]:
+        print( "  %s (%s)" % (category_name(data), name(f)) )
+    groups = report["duplicateTemplates"]
+    print( "Identical templates: %d categories in %d groups" %
+           (sum(len(g) for g in groups), len(groups)) )
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Build a Kernel snapshot from AIML files')
+
+    g1 = parser.add_argument_group( 'Sources' )
+    g11 = g1.add_mutually_exclusive_group( required=True )
+    g11.add_argument( '--standard', '-s', action='store_true',
+                      help='Build the Standard AIML Set' )
+    g11.add_argument( '--alice', '-a', action='store_true',
+                      help='Build the Alice AIML Set' )
+    g11.add_argument( 'aiml', nargs='*', default=[],
+                      help='AIML file(s) to learn (wildcards allowed)' )
+    g1.add_argument( '--chdir', metavar='DIRECTORY',
+                     help='Directory to change to before loading AIML files' )
+    g1.add_argument( '--commands', '-c', metavar='COMMAND', nargs='+',
+                     default=[],
+                     help='Optional command(s) to send to kernel after data loading' )
+
+    g2 = parser.add_argument_group( 'Output' )
+    g2.add_argument( '--analyze', action='store_true',
+                     help='Report replaced and unreachable categories, and identical templates' )
+    g2.add_argument( '--prune', action='store_true',
+                     help='Remove unreachable categories and share identical templates' )
+    g2.add_argument( '--output', '-o', metavar='FILENAME',
+                     help='Snapshot file to write (default for the bundled sets: next to the AIML files)' )
+    g2.add_argument( '--verbose', '-v', action='store_true',
+                     help='Report each file as it is loaded' )
+
+    args = parser.parse_args()
+    if not (args.standard or args.alice or args.aiml):
+        parser.error('no AIML files given')
+    if not (args.standard or args.alice) and not args.output:
+        parser.error('an output file is needed')
+    return args
+
+
+def main():
+    args = read_args()
+
+    kern = aiml.Kernel()
+    kern.verbose( args.verbose )
+    kern.setProvenance( args.analyze )
+
+    start = time.time()
+    if args.standard or args.alice:
+        name = 'standard' if args.standard else 'alice'
+        spec = BUNDLED[name]
+        kern.bootstrap( learnFiles=spec["learnFiles"], commands=spec["commands"],
+                        chdir=bundled_dir(name) )
+        sources = bundled_sources(name)
+        commands = spec["commands"]
+        output = args.output or prebuilt_path(name)
+    else:
+        kern.bootstrap( learnFiles=args.aiml, commands=args.commands,
+                        chdir=args.chdir )
+        sources = kern.learnedFiles()
+        commands = args.commands
+        output = args.output
+    elapsed = time.time() - start
+
+    if not kern.numCategories():
+        print( "No categories learned, nothing written", file=sys.stderr )
+        sys.exit(1)
+
+    if args.analyze:
+        print_analysis( kern.analyze() )
+    if args.prune:
+        removed, shared = kern.prune()
+        print( "Pruned: %d unreachable categories removed, %d templates shared" %
+               (removed, shared) )
+
+    meta = {"fingerprint": source_fingerprint(sources, commands),
+            "files": [os.path.basename(f) for f in kern.learnedFiles()]}
+    kern.saveSnapshot( output, meta=meta )
+
+    stats = kern.stats()
+    print( "Files learned:       %d" % len(kern.learnedFiles()) )
+    print( "Categories:          %d" % stats["categories"] )
+    print( "Nodes:               %d" % stats["nodes"] )
+    print( "Replaced categories: %d" % stats["replaced"] )
+    print( "Static templates:    %d (%.0f%%)" % (stats["staticTemplates"],
+                                                stats["staticRatio"]*100) )
+    print( "Build time:          %.2f seconds" % elapsed )
+    print( "Snapshot written to %s (%d bytes)" % (output, os.path.getsize(output)) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Load test for python-aiml: simulate a number of concurrent sessions talking
+to a bot, and report throughput, latency percentiles, time spent waiting for
+the Kernel lock and memory use over time.
+
+Usage:
+    aiml-loadtest [--engine SPEC] [--sessions N] [--kernels N] [--processes N]
+                  [--duration SECONDS | --requests N] [--corpus FILE]
+
+Each session runs in its own thread, sending one input after another as
+fast as it can. Sessions are spread over a pool of --kernels Kernels; with
+--processes, over that many processes, each one with its own pool. The
+engine SPEC is as in aiml-replay ("standard", "alice", "brain:FILE",
+"snapshot:FILE" or "aiml:FILE[,FILE...]").
+
+The inputs are read from a corpus file (one per line) or, by default, made
+up from the patterns in the brain, filling the wildcards with random words.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from aiml.script.aimlreplay import load_engine, percentile
+
+
+WORDS = ( "YES", "NO", "MAYBE", "I", "YOU", "THE", "A", "CAT", "DOG", "RED",
+          "BIG", "HOUSE", "LOVE", "COMPUTER", "TODAY", "WHAT", "WHY", "GOOD" )
+
+
+def rss():
+    '''
+    Return the resident set size of this process, in bytes (or its peak,
+    where the current one is not available)
+    '''
+    try:
+        with open( '/proc/self/statm' ) as inp:
+            return int(inp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _PatternCollector( object ):
+    '''
+    A stream for Kernel.dumpBrain() that keeps only the patterns
+    '''
+    def __init__( self ):
+        self.patterns = []
+        self._buf = u''
+
+    def write( self, data ):
+        lines = (self._buf + data).split( u'\n' )
+        self._buf = lines.pop()
+        for line in lines:
+            self.patterns.append( json.loads(line)["pattern"] )
+
+
+def synthesize( kern, count, seed=None ):
+    '''
+    Make up inputs matching the patterns in the brain of a Kernel
+    '''
+    collector = _PatternCollector()
+    kern.dumpBrain( collector )
+    rng = random.Random( seed )
+    name = kern.getBotPredicate( "name" ).upper()
+    inputs = []
+    for pattern in rng.sample( collector.patterns, min(count, len(collector.patterns)) ):
+        words = []
+        for word in pattern.split():
+            if word in ( u'*', u'_' ):
+                words.extend( rng.sample(WORDS, rng.randint(1, 3)) )
+            elif word == u'^':
+                words.extend( rng.sample(WORDS, rng.randint(0, 2)) )
+            elif word == u'BOT_NAME':
+                words.append( name )
+            else:
+                words.append( word )
+        if words:
+            inputs.append( u' '.join(words) )
+    return inputs
+
+
+def read_corpus( filename ):
+    '''
+    Read the inputs in a corpus file, one per line
+    '''
+    with io.open( filename, encoding='utf-8' ) as inp:
+        return [ line.strip() for line in inp if line.strip() ]
+
+
+def run_worker( job ):
+    '''
+    Load a pool of Kernels and run a set of sessions against them, in as
+    many threads. Return the latencies of the requests, the metrics of the
+    Kernels and the memory use over time
+    '''
+    (spec, seed, kernels, sessions, first, corpus, duration, requests,
+     interval) = job
+    pool = [ load_engine(spec, seed) for _ in range(kernels) ]
+    inputs = read_corpus( corpus ) if corpus else synthesize( pool[0], 1000, seed )
+    if not inputs:
+        raise ValueError( "no inputs to send" )
+
+    latencies = [ [] for _ in range(sessions) ]
+    errors = []
+    stop = threading.Event()
+
+    def session( n ):
+        kern = pool[n % len(pool)]
+        sessionID = "session%d" % (first + n)
+        rng = random.Random( u"%s/%s" % (seed, sessionID) )
+        pos = rng.randrange( len(inputs) )
+        quota = None
+        if requests:
+            quota = requests // sessions + (1 if n < requests % sessions else 0)
+        times = latencies[n]
+        while not stop.is_set() and (quota is None or len(times) < quota):
+            t = time.time()
+            try:
+                kern.respond( inputs[pos], sessionID )
+            except Exception as err:
+                errors.append( repr(err) )
+            times.append( time.time() - t )
+            pos = (pos + 1) % len(inputs)
+
+    memory = [ (0.0, rss()) ]
+    threads = [ threading.Thread(target=session, args=(n,)) for n in range(sessions) ]
+    start = time.time()
+    for t in threads:
+        t.daemon = True
+        t.start()
+    while any( t.is_alive() for t in threads ):
+        elapsed = time.time() - start
+        if duration and elapsed >= duration:
+            stop.set()
+        if elapsed >= memory[-1][0] + interval:
+            memory.append( (elapsed, rss()) )
+        time.sleep( min(0.05, interval) )
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    memory.append( (elapsed, rss()) )
+
+    return { "latencies": [ x for times in latencies for x in times ],
+             "elapsed": elapsed,
+             "metrics": [ kern.respondMetrics() for kern in pool ],
+             "memory": memory,
+             "errors": errors }
+
+
+def split( total, parts ):
+    '''
+    Split a number into as even parts as possible
+    '''
+    return [ total // parts + (1 if n < total % parts else 0) for n in range(parts) ]
+
+
+def summarize( results, args ):
+    '''
+    Merge the results of the workers into a report
+    '''
+    latencies = sorted( x for r in results for x in r["latencies"] )
+    metrics = [ m for r in results for m in r["metrics"] ]
+    elapsed = max( r["elapsed"] for r in results )
+    count = len(latencies)
+    calls = sum( m["calls"] for m in metrics )
+    lockWait = sum( m["lockWait"] for m in metrics )
+    # The memory of all processes, added at each sampling time (and at the end)
+    samples = min( len(r["memory"]) for r in results ) - 1
+    memory = [ (max(r["memory"][i][0] for r in results),
+                sum(r["memory"][i][1] for r in results)) for i in range(samples) ]
+    memory.append( (elapsed, sum(r["memory"][-1][1] for r in results)) )
+    ms = lambda seconds : round( seconds * 1000, 3 )
+    return {
+        "sessions": args.sessions, "kernels": len(metrics),
+        "processes": args.processes,
+        "requests": count, "errors": sum( len(r["errors"]) for r in results ),
+        "elapsed": round( elapsed, 3 ),
+        "throughput": round( count / elapsed, 1 ) if elapsed else 0.0,
+        "latency": { "p50": ms(percentile(latencies, 50)),
+                     "p95": ms(percentile(latencies, 95)),
+                     "p99": ms(percentile(latencies, 99)),
+                     "max": ms(latencies[-1] if latencies else 0),
+                     "mean": ms(sum(latencies) / count if count else 0) },
+        "lockWait": { "total": round( lockWait, 3 ),
+                      "mean": ms(lockWait / calls if calls else 0),
+                      "max": ms(max([m["maxLockWait"] for m in metrics] or [0])) },
+        "memory": [ (round(t, 1), size) for t, size in memory ],
+    }
+
+
+def print_report( report ):
+    '''
+    Print a report in human-readable form
+    '''
+    megabytes = lambda size : size / 1048576.0
+    print( "Sessions:     %d (%d kernels in %d processes)" %
+           (report["sessions"], report["kernels"], report["processes"]) )
+    print( "Requests:     %d in %.1f seconds, %d errors" %
+           (report["requests"], report["elapsed"], report["errors"]) )
+    print( "Throughput:   %.1f requests/second" % report["throughput"] )
+    print( "Latency (ms): p50 %.3f  p95 %.3f  p99 %.3f  max %.3f  mean %.3f" %
+           tuple(report["latency"][k] for k in ("p50", "p95", "p99", "max", "mean")) )
+    print( "Lock wait:    %.3f seconds in total, mean %.3f ms, max %.3f ms" %
+           tuple(report["lockWait"][k] for k in ("total", "mean", "max")) )
+    print( "Memory (RSS):" )
+    memory = report["memory"]
+    for t, size in memory:
+        print( "  %8.1f s  %8.1f MB" % (t, megabytes(size)) )
+    if memory:
+        print( "  growth      %+8.1f MB" % megabytes(memory[-1][1] - memory[0][1]) )
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser( description='Load test for python-aiml' )
+    parser.add_argument( '--engine', '-e', default='standard', metavar='SPEC',
+                         help='Brain to load (default: standard)' )
+    parser.add_argument( '--sessions', '-n', type=int, default=8,
+                         help='Number of concurrent sessions' )
+    parser.add_argument( '--kernels', '-k', type=int, default=1,
+                         help='Number of Kernels the sessions are spread over (per process)' )
+    parser.add_argument( '--processes', '-p', type=int, default=1,
+                         help='Number of processes the sessions are spread over' )
+    g1 = parser.add_mutually_exclusive_group()
+    g1.add_argument( '--duration', '-d', type=float,
+                     help='Seconds to run for (default: 10)' )
+    g1.add_argument( '--requests', '-r', type=int,
+                     help='Number of requests to send' )
+    parser.add_argument( '--corpus', metavar='FILENAME',
+                         help='Inputs to send, one per line (default: made up from the brain)' )
+    parser.add_argument( '--seed', type=int, default=0,
+                         help='Random seed for the inputs and <random> elements' )
+    parser.add_argument( '--interval', type=float, default=1.0,
+                         help='Seconds between memory samples' )
+    parser.add_argument( '--json', action='store_true',
+                         help='Write the report as JSON' )
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.duration = 10.0
+    args.processes = max( 1, min(args.processes, args.sessions) )
+    args.kernels = max( 1, args.kernels )
+    return args
+
+
+def main():
+    args = read_args()
+    jobs = []
+    first = 0
+    requests = split( args.requests, args.processes ) if args.requests else None
+    for n, sessions in enumerate( split(args.sessions, args.processes) ):
+        jobs.append( (args.engine, args.seed, min(args.kernels, sessions), sessions,
+                      first, args.corpus, args.duration,
+                      requests[n] if requests else None, args.interval) )
+        first += sessions
+
+    if len(jobs) > 1:
+        import multiprocessing
+        workers = multiprocessing.Pool( len(jobs) )
+        try:
+            results = workers.map( run_worker, jobs, chunksize=1 )
+        finally:
+            workers.close()
+            workers.join()
+    else:
+        results = [ run_worker(jobs[0]) ]
+
+    report = summarize( results, args )
+    if args.json:
+        print( json.dumps(report, sort_keys=True) )
+    else:
+        print_report( report )
+    sys.exit( 1 if report["errors"] else 0 )
+
+
+if __name__ == '__main__':
+    main()
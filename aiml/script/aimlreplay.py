@@ -0,0 +1,202 @@
+"""
+Replay a conversation log recorded with Kernel.setRecorder() against one or
+two brains, and report the responses that changed and the latency of each.
+
+Usage:
+    aiml-replay [--engine SPEC] [--engine SPEC] [--jobs N] [--seed N] LOGFILE
+
+An engine SPEC is one of "standard", "alice", "brain:FILE", "snapshot:FILE"
+or "aiml:FILE[,FILE...]" (wildcards allowed). With one engine the replayed
+responses and latencies are compared against those in the log; with two,
+against each other. Sessions are replayed in parallel (with --jobs), but
+the inputs of each session are always replayed in their original order,
+every session starting from scratch.
+
+Use --seed (and Kernel.setRandomSeed() when recording) to make the choices
+of <random> elements the same in both runs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+
+import aiml
+from aiml.script.aimlcompile import BUNDLED, bundled_dir, load_prebuilt
+
+
+def percentile( values, q ):
+    '''
+    Return the q-th percentile (0 < q < 100) of a sorted list of values
+    '''
+    if not values:
+        return 0.0
+    return values[ min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1)))) ]
+
+
+def load_engine( spec, seed=None ):
+    '''
+    Create a Kernel from an engine specification
+    '''
+    kern = aiml.Kernel()
+    kern.verbose( False )
+    # Work with unicode strings, as in the log
+    kern.setTextEncoding( False )
+    kind, _, arg = spec.partition(':')
+    if kind in BUNDLED and not arg:
+        if not load_prebuilt(kern, kind):
+            kern.bootstrap( learnFiles=BUNDLED[kind]["learnFiles"],
+                            commands=BUNDLED[kind]["commands"],
+                            chdir=bundled_dir(kind) )
+    elif kind == 'brain':
+        kern.bootstrap( brainFile=arg )
+    elif kind == 'snapshot':
+        kern.loadSnapshot( arg )
+    elif kind == 'aiml':
+        kern.bootstrap( learnFiles=arg.split(',') )
+    else:
+        raise ValueError( "invalid engine: %s" % spec )
+    if seed is not None:
+        kern.setRandomSeed( seed )
+    return kern
+
+
+def read_log( filename ):
+    '''
+    Read a recorded log, and group its entries by session (keeping their order)
+    '''
+    sessions = {}
+    order = []
+    with open( filename ) as inp:
+        for n, line in enumerate(inp):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads( line )
+            entry["n"] = n
+            key = json.dumps( entry["session"] )
+            if key not in sessions:
+                sessions[key] = []
+                order.append( key )
+            sessions[key].append( entry )
+    return [sessions[key] for key in order]
+
+
+def replay( job ):
+    '''
+    Replay a list of sessions against each engine, and return, for each
+    entry in them, a list with the (response, patterns, latency) obtained
+    from each engine
+    '''
+    specs, seed, sessions = job
+    results = {}
+    for spec in specs:
+        kern = load_engine( spec, seed )
+        for entries in sessions:
+            for entry in entries:
+                start = time.time()
+                result = kern.respond( entry["input"], entry["session"] )
+                latency = time.time() - start
+                results.setdefault( entry["n"], [] ).append(
+                    (result.response, result.patterns, latency) )
+            kern._deleteSession( entries[0]["session"] )
+    return results
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser( description='Replay a recorded conversation log' )
+    parser.add_argument( 'log', metavar='LOGFILE',
+                         help='Log written by Kernel.setRecorder()' )
+    parser.add_argument( '--engine', '-e', action='append', default=[],
+                         metavar='SPEC', help='Engine to replay the log against (up to two)' )
+    parser.add_argument( '--jobs', '-j', type=int, default=1,
+                         help='Number of processes replaying sessions in parallel' )
+    parser.add_argument( '--seed', type=int,
+                         help='Random seed for <random> elements' )
+    parser.add_argument( '--diffs', metavar='FILENAME',
+                         help='Write the inputs with different responses as JSON lines' )
+    args = parser.parse_args()
+    if not 1 <= len(args.engine) <= 2:
+        parser.error( 'one or two engines are needed' )
+    return args
+
+
+def main():
+    args = read_args()
+    sessions = read_log( args.log )
+    entries = [entry for session in sessions for entry in session]
+
+    # Deal the sessions to the jobs, largest first
+    jobs = [ [] for _ in range(max(1, args.jobs)) ]
+    for session in sorted( sessions, key=len, reverse=True ):
+        min( jobs, key=lambda j: sum(len(s) for s in j) ).append( session )
+    jobs = [ (args.engine, args.seed, job) for job in jobs if job ]
+
+    start = time.time()
+    if len(jobs) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool( len(jobs) )
+        try:
+            done = pool.map( replay, jobs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        done = [ replay(job) for job in jobs ]
+    elapsed = time.time() - start
+    results = {}
+    for d in done:
+        results.update( d )
+
+    # Compare either the log and the engine, or both engines
+    if len(args.engine) == 1:
+        names = ( "recorded", "A" )
+        pairs = [ ((e["response"], e["patterns"], e["latency"]), results[e["n"]][0])
+                  for e in entries ]
+    else:
+        names = ( "A", "B" )
+        pairs = [ tuple(results[e["n"]]) for e in entries ]
+
+    diffs = patternDiffs = 0
+    out = open( args.diffs, 'w' ) if args.diffs else None
+    try:
+        for entry, (a, b) in zip( entries, pairs ):
+            if a[1] != b[1]:
+                patternDiffs += 1
+            if a[0] != b[0]:
+                diffs += 1
+                if out is not None:
+                    out.write( json.dumps({"session": entry["session"],
+                                           "input": entry["input"],
+                                           names[0]: a[0], names[1]: b[0]},
+                                          sort_keys=True) + "\n" )
+    finally:
+        if out is not None:
+            out.close()
+
+    total = len(entries)
+    for name, spec in zip( "AB", args.engine ):
+        print( "Engine %s:          %s" % (name, spec) )
+    print( "Inputs replayed:   %d (%d sessions, %.1f seconds)" % (total, len(sessions), elapsed) )
+    print( "Response diffs:    %d (%.1f%%)" % (diffs, 100.0 * diffs / total if total else 0) )
+    print( "Pattern diffs:     %d" % patternDiffs )
+    print( "Latency (ms)  %10s %10s %10s %10s" % ("p50", "p95", "p99", "mean") )
+    summary = []
+    for i, name in enumerate( names ):
+        latencies = sorted( pair[i][2] for pair in pairs )
+        row = [ percentile(latencies, q) * 1000 for q in (50, 95, 99) ]
+        row.append( sum(latencies) * 1000 / total if total else 0.0 )
+        summary.append( row )
+        print( "  %-10s  %10.3f %10.3f %10.3f %10.3f" % tuple([name] + row) )
+    print( "  %-10s  %+10.3f %+10.3f %+10.3f %+10.3f" %
+           tuple(["delta"] + [b - a for a, b in zip(*summary)]) )
+    sys.exit( 1 if diffs else 0 )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Report statistics about a brain: size and shape of its node tree, wildcard
+nodes, longest categories, largest branches and estimated memory use.
+
+Usage:
+    aiml-stats --brain FILE | --snapshot FILE | --standard | --alice
+    aiml-stats [--chdir DIR] [--commands CMD ...] file1.aiml ...
+
+With --json the statistics are written as a JSON object. With --dump FILE
+all the categories are also written to FILE ("-" for the standard output),
+one JSON object per line. With --memory, the memory taken by each part of
+the Kernel is also reported and, when the brain is learned from AIML files,
+that taken by each file (the bundled sets are then learned from their AIML
+files instead of a prebuilt snapshot).
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os.path
+import sys
+
+import aiml
+from aiml.script.aimlcompile import BUNDLED, bundled_dir, load_prebuilt
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Brain statistics')
+
+    g1 = parser.add_argument_group( 'Brain' )
+    g11 = g1.add_mutually_exclusive_group( required=True )
+    g11.add_argument( '--standard', '-s', action='store_true',
+                      help='Load the Standard AIML Set' )
+    g11.add_argument( '--alice', '-a', action='store_true',
+                      help='Load the Alice AIML Set' )
+    g11.add_argument( '--brain', metavar='BRAINFILE',
+                      help='Load a dumped brain file' )
+    g11.add_argument( '--snapshot', metavar='FILENAME',
+                      help='Load a Kernel snapshot' )
+    g11.add_argument( 'aiml', nargs='*', default=[],
+                      help='AIML file(s) to learn (wildcards allowed)' )
+    g1.add_argument( '--chdir', metavar='DIRECTORY',
+                     help='Directory to change to before loading AIML files' )
+    g1.add_argument( '--commands', '-c', metavar='COMMAND', nargs='+',
+                     default=[],
+                     help='Optional command(s) to send to kernel after data loading' )
+
+    g2 = parser.add_argument_group( 'Output' )
+    g2.add_argument( '--top', '-n', type=int, default=10,
+                     help='Number of longest categories and largest branches to show' )
+    g2.add_argument( '--json', action='store_true',
+                     help='Write the statistics as JSON' )
+    g2.add_argument( '--dump', metavar='FILENAME',
+                     help='Write all categories as JSON lines ("-": standard output)' )
+    g2.add_argument( '--memory', '-m', action='store_true',
+                     help='Report the memory taken by each part of the Kernel and each AIML file' )
+
+    args = parser.parse_args()
+    if not (args.standard or args.alice or args.brain or args.snapshot or args.aiml):
+        parser.error('no brain given')
+    return args
+
+
+def load( args ):
+    '''
+    Create a Kernel with the brain given in the arguments
+    '''
+    kern = aiml.Kernel()
+    kern.verbose( False )
+    if args.memory:
+        kern.setProvenance()
+        try:
+            kern.setMemoryTracing()
+        except ImportError:
+            pass
+    if args.standard or args.alice:
+        name = 'standard' if args.standard else 'alice'
+        if args.memory or not load_prebuilt(kern, name):
+            kern.bootstrap( learnFiles=BUNDLED[name]["learnFiles"],
+                            commands=BUNDLED[name]["commands"],
+                            chdir=bundled_dir(name) )
+    elif args.brain:
+        kern.bootstrap( brainFile=args.brain )
+    elif args.snapshot:
+        kern.loadSnapshot( args.snapshot )
+    else:
+        kern.bootstrap( learnFiles=args.aiml, commands=args.commands,
+                        chdir=args.chdir )
+    return kern
+
+
+def megabytes( size ):
+    return "%.1f MB" % (size / 1048576.0)
+
+
+def print_stats( stats ):
+    '''
+    Print the statistics returned by Kernel.brainStats()
+    '''
+    print( "Nodes:           %d" % stats["nodes"] )
+    print( "Templates:       %d" % stats["templates"] )
+    print( "Depth:           %d" % stats["depth"] )
+    print( "That sub-tries:  %d" % stats["thatTries"] )
+    print( "Topic sub-tries: %d" % stats["topicTries"] )
+    print( "Wildcard nodes:" )
+    for part in ("pattern", "that", "topic"):
+        counts = stats["wildcards"][part]
+        print( "  %-8s %s" % (part, ", ".join("%s %d" % (name, counts[name])
+                                              for name in sorted(counts))) )
+    print( "Fan-out (number of nodes by number of children, at each depth):" )
+    for depth, histogram in enumerate(stats["fanOut"]):
+        buckets = []
+        for low in sorted(histogram):
+            label = str(low) if low < 2 else "%d-%d" % (low, 2*low - 1)
+            buckets.append( "%s:%d" % (label, histogram[low]) )
+        print( "  %3d  %s" % (depth, " ".join(buckets)) )
+    print( "Longest categories:" )
+    for length, data in stats["longest"]:
+        print( "  %3d  %s" % (length, u" | ".join(data)) )
+    print( "Largest branches:" )
+    for word, nodes, templates in stats["branches"]:
+        print( "  %-20s %8d nodes %8d templates" % (word, nodes, templates) )
+    print( "Estimated memory:" )
+    for component in ("nodes", "keys", "templates", "index"):
+        print( "  %-10s %10s" % (component, megabytes(stats["memory"][component])) )
+
+
+def print_memory( report ):
+    '''
+    Print the report returned by Kernel.memoryReport()
+    '''
+    print( "Memory by component:" )
+    components = report["components"]
+    for name in sorted( components, key=lambda c: -components[c] ):
+        print( "  %-16s %10s" % (name, megabytes(components[name])) )
+    print( "  %-16s %10s" % ("total", megabytes(report["total"])) )
+    print( "Memory by branch:" )
+    for word, size in report["branches"]:
+        print( "  %-20s %10s" % (word, megabytes(size)) )
+    files = report["files"]
+    allocated = report.get( "allocated", {} )
+    if files or allocated:
+        print( "Memory by file (templates, allocated while learning):" )
+        for f in sorted( set(files) | set(allocated),
+                         key=lambda f: -allocated.get(f, files.get(f, 0)) ):
+            print( "  %-30s %10s %10s" % (os.path.basename(f),
+                                          megabytes(files.get(f, 0)),
+                                          megabytes(allocated[f]) if f in allocated else '-') )
+
+
+def main():
+    args = read_args()
+    kern = load( args )
+
+    if args.dump == '-':
+        kern.dumpBrain( sys.stdout )
+    elif args.dump:
+        with open( args.dump, 'w' ) as out:
+            kern.dumpBrain( out )
+
+    stats = kern.brainStats( args.top )
+    if args.memory:
+        stats["kernelMemory"] = kern.memoryReport( args.top )
+    if args.json:
+        print( json.dumps(stats, sort_keys=True) )
+    elif args.dump != '-':
+        print_stats( stats )
+        if args.memory:
+            print_memory( stats["kernelMemory"] )
+
+
+if __name__ == '__main__':
+    main()
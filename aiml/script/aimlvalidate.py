@@ -1,37 +1,49 @@
 """
-Python AIML Validator, v1.1
+Python AIML Validator, v1.2
 Author: Cort Stratton (cort@cortstratton.org)
 
 Usage:
-    aimlvalidate.py file1.aiml [file2.aiml ...]
+    aimlvalidate.py [--jobs N] [--cache FILE] [--json] file1.aiml [file2.aiml ...]
+
+File names can contain wildcards. With --jobs, files are validated in
+parallel by a pool of processes. With --cache, the content hash of every
+valid file is kept in FILE, and files unchanged since then are skipped.
+With --json, the result for each file is written as a JSON line.
 """
 
 # Revision history:
 #
+# 1.2: Parallel validation, cache of valid files, JSON output
 # 1.0.1: Redirected stderr to stdout
 # 1.0: Initial release
 
 from __future__ import print_function
 
-import sys
-import io
+import argparse
 import glob
+import hashlib
+import io
+import json
+import os.path
+import sys
+import time
 import xml.sax
+import xml.sax.xmlreader
 
-import aiml
-
-PY3 = sys.version[0] == 3
+from aiml.AimlParser import create_parser
+from aiml.constants import VERSION
 
 
-def get_file_position( filename, row, col, encoding='utf-8' ):
+def get_file_position( data, row, col, encoding='utf-8' ):
     '''
-    Find a place within a file
+    Find a place within the contents of a file
     '''
     # Get the line
-    with io.open( filename, 'rb' ) as file:
-        lines = file.readlines()
-        start = col-25 if col>25 else 0
-        buf = lines[row-1][start:start+50]
+    lines = data.splitlines()
+    if not 0 < row <= len(lines):
+        return u'', u''
+    start = col-25 if col>25 else 0
+    buf = lines[row-1][start:start+50]
     # Decode it
     try:
         buf = buf.decode(encoding,'replace')
@@ -45,66 +57,185 @@ def get_file_position( filename, row, col, encoding='utf-8' ):
         marker = '---' + marker
     if start+50 < len(lines[row-1]):
         buf += u'...'
-                #buf = buf + b'\n' + marker
-                #LOG.warn( u'%s :\n%s', e,  buf )
     return buf, marker
 
 
+def validate( filename, data ):
+    '''
+    Validate the contents of an AIML file, and return the result as a
+    dictionary
+    '''
+    start = time.time()
+    parser = create_parser()
+    handler = parser.getContentHandler()
+    handler.setErrorStream( None )
+    source = xml.sax.xmlreader.InputSource( filename )
+    source.setByteStream( io.BytesIO(data) )
+    result = { 'file': filename, 'valid': False, 'cached': False }
+    try:
+        parser.parse( source )
+        result['errors'] = handler.getErrors()
+        result['valid'] = not result['errors']
+    except xml.sax.SAXParseException as err:
+        # These errors occur if the document does not contain
+        # well-formed XML (e.g. open or unbalanced tags).  If
+        # they occur, parsing the whole document is aborted
+        # immediately.
+        row, col = err.getLineNumber(), err.getColumnNumber()
+        # Find where the parser broke
+        errbuf, below = get_file_position( data, row, col )
+        result['errors'] = handler.getErrors() + [
+            { 'line': row, 'column': col, 'message': err.getMessage(),
+              'fatal': True, 'context': errbuf, 'marker': below } ]
+    result['time'] = time.time() - start
+    return result
+
+
+def _validate_job( job ):
+    '''
+    Run validate() in a pool process
+    '''
+    return validate( *job )
+
+
+def load_cache( filename ):
+    '''
+    Read the content hashes of the files found valid in a previous run
+    '''
+    try:
+        with io.open( filename, 'rt', encoding='utf-8' ) as inp:
+            cache = json.load( inp )
+    except (IOError, OSError, ValueError):
+        return {}
+    # A different validator may give a different verdict
+    if cache.get( 'version' ) != VERSION:
+        return {}
+    return cache.get( 'files', {} )
+
+
+def save_cache( filename, files ):
+    '''
+    Store the content hashes of the valid files
+    '''
+    with open( filename, 'w' ) as out:
+        json.dump( { 'version': VERSION, 'files': files }, out,
+                   indent=0, sort_keys=True )
+
+
+def print_result( result ):
+    '''
+    Print the validation result for a file, in human-readable form
+    '''
+    print( "Validating %s:" % result['file'], end=' ' )
+    if result['cached']:
+        print( "PASSED (unchanged)\n" )
+        return
+    for error in result['errors']:
+        if error.get( 'fatal' ):
+            # Prepare an error message
+            msg = u'{}: row={} col={} id={}:\n{}\n{}'.format(
+                error['message'], error['line'], error['column'],
+                result['file'], error['context'], error['marker'] )
+            print( "\n  FATAL ERROR: %s\n" % msg )
+        else:
+            print( "PARSE ERROR: %s" % error['message'] )
+    if not result['errors'] or not result['errors'][-1].get( 'fatal' ):
+        print( "PASSED\n" if result['valid'] else "FAILED\n" )
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser( description='AIML 1.0.1 validator' )
+    parser.add_argument( 'files', nargs='+', metavar='FILE',
+                         help='AIML file(s) to validate (wildcards allowed)' )
+    parser.add_argument( '--jobs', '-j', type=int, default=1,
+                         help='Number of files validated in parallel' )
+    parser.add_argument( '--cache', metavar='FILENAME',
+                         help='Skip the files unchanged since they were last found valid' )
+    parser.add_argument( '--json', action='store_true',
+                         help='Write the results as JSON lines' )
+    return parser.parse_args()
+
+
 def main():
     '''Entry point'''
     # Need input file(s)!
     if len(sys.argv) < 2:
         print( __doc__ )
         sys.exit(2)
+    args = read_args()
 
-    # AimlParser prints its errors to stderr; we redirect stderr to stdout.
-    sys.stderr = sys.stdout
+    cache = load_cache( args.cache ) if args.cache else {}
+    # The files not given this time keep their entries, so that validating
+    # a few files does not empty the cache for the others
+    valid = dict( cache )
 
-    # Iterate over input files    
-    validCount = 0
-    docCount = 0
-    for arg in sys.argv[1:]:
+    # Read each file once: hash it, and validate it unless it is unchanged
+    # since it was last found valid
+    results = []
+    jobs = []
+    for arg in args.files:
         # Input files can contain wildcards; iterate over matches
         for f in glob.glob(arg):
-            parser = xml.sax.make_parser(["aiml.AimlParser"])
-            handler = parser.getContentHandler()
-            docCount += 1
-            print( "Validating %s:" % f, end=' ' )
-            try:
-                #with open(f,'rb') as inp:
-                #    src = xml.sax.xmlreader.InputSource()
-                #    src.setByteStream(f)
-                #    #input_source.setEncoding(encoding)
-                #    parser.parse(src)
-                ## Attempt to parse the file.
-                parser.parse(f)
-                # Check the number of parse errors.
-                if handler.getNumErrors() == 0:    
-                    validCount += 1
-                    print( "PASSED\n" )
+            with io.open( f, 'rb' ) as inp:
+                data = inp.read()
+            digest = hashlib.sha1( data ).hexdigest()
+            key = os.path.abspath( f )
+            if cache.get( key ) == digest:
+                results.append( { 'file': f, 'valid': True, 'cached': True,
+                                  'errors': [], 'time': 0.0 } )
+            else:
+                results.append( (key, digest) )
+                jobs.append( (f, data) )
+
+    # Validate lazily, in the order of the files, so that each report is
+    # printed as soon as it is ready
+    pool = None
+    if args.jobs > 1 and len(jobs) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool( min(args.jobs, len(jobs)) )
+        done = pool.imap( _validate_job, jobs, chunksize=1 )
+    else:
+        done = ( validate(*job) for job in jobs )
+
+    # Report the results in the order of the files
+    validCount = 0
+    try:
+        for n, result in enumerate( results ):
+            if isinstance( result, tuple ):
+                key, digest = result
+                result = results[n] = next( done )
+                if result['valid']:
+                    valid[key] = digest
                 else:
-                    print( "FAILED\n" )
-            except xml.sax.SAXParseException as err:
-                # These errors occur if the document does not contain
-                # well-formed XML (e.g. open or unbalanced tags).  If
-                # they occur, parsing the whole document is aborted
-                # immediately.
-                row, col = err.getLineNumber(), err.getColumnNumber()
-                # Find where the parser broke
-                errbuf, below = get_file_position( f, row, col )
-                # Prepare an error message
-                msg = u'{}: row={} col={} id={}:\n{}\n{}'.format(
-                    err.getMessage(), row, col, err.getSystemId(), 
-                    errbuf, below )
-                print( "\n  FATAL ERROR: %s\n" % msg )
-                
+                    valid.pop( key, None )
+            if result['valid']:
+                validCount += 1
+            if args.json:
+                print( json.dumps(result, sort_keys=True) )
+            else:
+                print_result( result )
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if args.cache:
+        save_cache( args.cache, valid )
+
     # Print final results
-    print( "%d out of %d documents are AIML 1.0.1 compliant." % (validCount, docCount))
-    if docCount == validCount:
-        print( "Congratulations!" )
-    else:
-        print( """For help resolving syntax errors, refer to the AIML 1.0.1 specification
+    docCount = len(results)
+    if not args.json:
+        print( "%d out of %d documents are AIML 1.0.1 compliant." % (validCount, docCount))
+        if docCount == validCount:
+            print( "Congratulations!" )
+        else:
+            print( """For help resolving syntax errors, refer to the AIML 1.0.1 specification
 available on the web at: http://alicebot.org/TR/2001/WD-aiml""")
+    sys.exit( 0 if docCount == validCount else 1 )
 
 
 if __name__ == "__main__":
@@ -4,12 +4,12 @@ chatbot using PyAIML.
 """
 from __future__ import print_function
 
-import os.path
 import sys
 import argparse
 import io
 
 import aiml
+from aiml.script.aimlcompile import BUNDLED, bundled_dir, load_prebuilt
 
 
 if sys.version_info[0] == 3:
@@ -40,6 +40,8 @@ def read_args():
     g2.add_argument( '--commands', '-c', metavar='COMMAND', nargs='+',  
                      default=[],
                      help='Optional command(s) to send to kernel after data loading' )
+    g2.add_argument( '--no-prebuilt', action='store_true',
+                     help='Load the Standard/Alice set from its AIML files, even if a prebuilt snapshot is available' )
 
     g3 = parser.add_argument_group( 'Actions' )
     g3.add_argument( '--save', metavar='FILENAME',
@@ -64,14 +66,14 @@ def main():
     # The optional commands argument is a command (or list of commands)
     # to run after the files are loaded.
     # The optional brainFile argument specifies a brain file to load.
-    if args.standard:
-        chdir = os.path.join( aiml.__path__[0],'botdata','standard' )
-        kern.bootstrap(learnFiles="startup.xml", commands="load aiml b",
-                       chdir=chdir)
-    elif args.alice:
-        chdir = os.path.join( aiml.__path__[0],'botdata','alice' )
-        kern.bootstrap(learnFiles="startup.xml", commands="load alice",
-                       chdir=chdir)
+    # The bundled sets start from a snapshot made with aiml-compile, if
+    # there is one built from their current files.
+    if args.standard or args.alice:
+        name = 'standard' if args.standard else 'alice'
+        if args.no_prebuilt or not load_prebuilt(kern, name):
+            kern.bootstrap(learnFiles=BUNDLED[name]["learnFiles"],
+                           commands=BUNDLED[name]["commands"],
+                           chdir=bundled_dir(name))
     elif args.aiml:
         kern.bootstrap(learnFiles=args.aiml, commands=args.commands,
                        chdir=args.chdir)
@@ -0,0 +1,118 @@
+"""
+This file contains a start-up benchmark for python-aiml. It measures, each
+time in a fresh interpreter:
+ * the time taken by "import aiml", as reported by python -X importtime
+   (Python >= 3.7 only)
+ * the time from the start of the script to the first response of a Kernel
+   loaded from a brain file, and the wall time of the whole process
+
+Usage:
+    python bench_startup.py [--runs N] [BRAINFILE]
+If no brain file is given, one is built from the standard AIML set.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_RESPONSE = """
+import sys, time
+start = time.time()
+import aiml
+kern = aiml.Kernel()
+kern.verbose(False)
+kern.loadBrain(sys.argv[1])
+kern.respond("hello")
+print(time.time() - start)
+print(" ".join(sorted(m for m in sys.modules if m.startswith("xml"))))
+"""
+
+
+def run_python(args):
+    """Run a Python interpreter using the package in this directory, and
+    return its (stdout, stderr)"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = HERE + os.pathsep + env.get("PYTHONPATH", "")
+    proc = subprocess.Popen([sys.executable] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(err)
+    return out, err
+
+
+def import_time():
+    """Return the cumulative time (in seconds) of "import aiml" """
+    out, err = run_python(["-X", "importtime", "-c", "import aiml"])
+    for line in err.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "aiml":
+            return int(fields[1]) / 1e6
+
+
+def first_response(brain):
+    """Return the time to the first response and the xml modules loaded"""
+    out, err = run_python(["-c", FIRST_RESPONSE, brain])
+    elapsed, modules = (out.splitlines() + [""])[:2]
+    return float(elapsed), modules
+
+
+def build_brain(filename):
+    """Save a brain with the standard AIML set"""
+    import aiml
+    kern = aiml.Kernel()
+    kern.verbose(False)
+    kern.bootstrap(learnFiles="startup.xml", commands="load aiml b",
+                   chdir=os.path.join(HERE, "aiml", "botdata", "standard"))
+    kern.saveBrain(filename)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='python-aiml start-up benchmark')
+    parser.add_argument('brain', nargs='?', help='brain file to load')
+    parser.add_argument('--runs', '-n', type=int, default=7,
+                        help='number of runs of each measure')
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    brain = args.brain
+    if brain is None:
+        fd, brain = tempfile.mkstemp(suffix=".brn")
+        os.close(fd)
+        print("Building brain from the standard AIML set...")
+        build_brain(brain)
+
+    try:
+        if sys.version_info >= (3, 7):
+            times = [import_time() for _ in range(args.runs)]
+            print("import aiml:     %7.1f ms (median of %d)" %
+                  (median(times)*1000, args.runs))
+        inner, outer = [], []
+        for _ in range(args.runs):
+            start = time.time()
+            elapsed, modules = first_response(brain)
+            outer.append(time.time() - start)
+            inner.append(elapsed)
+        print("first response:  %7.1f ms (median of %d)" %
+              (median(inner)*1000, args.runs))
+        print("  whole process: %7.1f ms" % (median(outer)*1000))
+        print("  xml modules loaded: %s" % (modules or "none"))
+    finally:
+        if args.brain is None:
+            os.remove(brain)
+
+
+if __name__ == '__main__':
+    main()
@@ -56,11 +56,16 @@ PyAIML (c) Cort Stratton
                             'botdata/standard/*.xml',
                             'botdata/alice/*.aiml',
                             'botdata/alice/*.xml',
+                            'botdata/*/*.snapshot',
                             ]},
 
     entry_points = { 'console_scripts': [
         'aiml-validate = aiml.script.aimlvalidate:main',
         'aiml-bot = aiml.script.bot:main',
+        'aiml-compile = aiml.script.aimlcompile:main',
+        'aiml-stats = aiml.script.aimlstats:main',
+        'aiml-replay = aiml.script.aimlreplay:main',
+        'aiml-loadtest = aiml.script.aimlloadtest:main',
     ]},
 
     test_suite = 'test.__main__.load_tests',
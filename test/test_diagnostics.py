@@ -0,0 +1,98 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import logging
+import threading
+import time
+import unittest
+
+from aiml import Diagnostics
+
+
+class TestDiagnostics( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        Diagnostics.startQueue( self.handler )
+
+    def tearDown(self):
+        Diagnostics.stopQueue()
+
+    def test01_rate_limit( self ):
+        diagnostics = Diagnostics.Diagnostics( burst=2, period=0.2 )
+        for n in range(5):
+            diagnostics.log( logging.INFO, "No match found for input: %s", n )
+        diagnostics.log( logging.WARNING, "other" )
+        time.sleep( 0.3 )
+        diagnostics.log( logging.INFO, "No match found for input: %s", 5 )
+        Diagnostics.stopQueue()
+        self.assertEqual( ["No match found for input: 0",
+                           "No match found for input: 1",
+                           "other",
+                           "No match found for input: 5 (3 similar messages suppressed)"],
+                          [r.getMessage() for r in self.records] )
+        self.assertEqual( {"emitted": 4, "suppressed": 3, "dropped": 0},
+                          diagnostics.metrics() )
+
+    @unittest.skipIf( Diagnostics.QueueHandler is None, "requires QueueHandler" )
+    def test02_full_queue( self ):
+        # a handler that blocks: logging must not wait for it
+        release = threading.Event()
+        handler = logging.Handler()
+        handler.emit = lambda record: release.wait()
+        Diagnostics.startQueue( handler, maxSize=2 )
+        diagnostics = Diagnostics.Diagnostics( burst=100 )
+        start = time.time()
+        for n in range(10):
+            diagnostics.log( logging.INFO, "message %s", n )
+        self.assertLess( time.time() - start, 1 )
+        self.assertGreaterEqual( diagnostics.metrics()["dropped"], 7 )
+        release.set()
+
+    @unittest.skipIf( Diagnostics.QueueHandler is None, "requires QueueHandler" )
+    def test03_root_handler( self ):
+        Diagnostics.stopQueue()
+        release = threading.Event()
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: release.wait() and records.append( record )
+        root = logging.getLogger()
+        root.addHandler( handler )
+        logger = Diagnostics.logger
+        logger.propagate = False
+        logger.setLevel( logging.WARNING )
+        try:
+            # without a queue, the records are left to the application
+            diagnostics = Diagnostics.Diagnostics( burst=100 )
+            diagnostics.log( logging.WARNING, "not propagated" )
+            logger.propagate = True
+            release.set()
+            diagnostics.log( logging.WARNING, "propagated" )
+            release.clear()
+            logger.propagate = False
+
+            # the default queue forwards to the handlers of the root
+            # logger, without waiting for them
+            Diagnostics.ensureQueue()
+            start = time.time()
+            for n in range(10):
+                diagnostics.log( logging.WARNING, "message %s", n )
+            self.assertLess( time.time() - start, 1 )
+            release.set()
+            Diagnostics.stopQueue()
+            # the settings of the logger are restored
+            self.assertFalse( logger.propagate )
+            self.assertEqual( logging.WARNING, logger.level )
+            self.assertEqual( [Diagnostics._nullHandler], logger.handlers )
+        finally:
+            release.set()
+            root.removeHandler( handler )
+            logger.propagate = True
+            logger.setLevel( logging.NOTSET )
+        self.assertEqual( ["propagated"] + ["message %d" % n for n in range(10)],
+                          [r.getMessage() for r in records] )
+
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import gc
+import os
+import os.path
+import unittest
+
+from aiml import Kernel
+
+
+def memory():
+    """Return a dict with the memory counters (in kB) for this process"""
+    info = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                info[fields[0][:-1]] = int(fields[1])
+    return info
+
+
+@unittest.skipUnless( hasattr(os, 'fork') and hasattr(gc, 'freeze') and
+                      os.path.exists('/proc/self/smaps_rollup'),
+                      "needs fork(), gc.freeze() and /proc/self/smaps_rollup" )
+class TestFork( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose( False )
+        start = memory()['Rss']
+        self.k.bootstrap( learnFiles=os.path.join(os.path.dirname(__file__),
+                                                  "self-test.aiml") )
+        # Make the brain big enough to be measured
+        words = "ALPHA BRAVO CHARLIE DELTA ECHO FOXTROT GOLF HOTEL".split()
+        for i in range(20000):
+            pattern = " ".join( words[(i >> s) % 8] for s in range(0, 15, 3) )
+            self.k._brain.add( (pattern + " N%d *" % i, "*", "*"),
+                               ['template', {}, ['text', {'xml:space': 'default'},
+                                                 'number   %d' % i]] )
+        self.brainSize = memory()['Rss'] - start
+
+    def tearDown(self):
+        gc.unfreeze()
+        del self.k
+
+    def _childMemory(self, inputs):
+        """Fork a worker that responds to some inputs, collects garbage
+        and reports its private (dirty) and shared memory, in kB"""
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for input_ in inputs:
+                    self.k.respond( input_ )
+                gc.collect()
+                m = memory()
+                result = "%d %d" % (m['Private_Dirty'], m['Shared_Clean'] + m['Shared_Dirty'])
+                os.write( w, result.encode('ascii') )
+            finally:
+                os._exit( 0 )
+        os.close( w )
+        os.waitpid( pid, 0 )
+        with os.fdopen( r ) as f:
+            private, shared = f.read().split()
+        return int(private), int(shared)
+
+    def test01_shared( self ):
+        self.k.prepareFork()
+        inputs = [ "test srai", "test bot", "alpha alpha alpha alpha alpha n0 go",
+                   "test whitespace", "test star having multiple stars in a pattern makes me happy" ] * 20
+        private, shared = self._childMemory( inputs )
+        print( "\nbrain: %d kB, worker private: %d kB, shared: %d kB" % (self.brainSize, private, shared) )
+        self.assertLess( private, self.brainSize // 5 )
+        self.assertGreater( shared, self.brainSize )
+        # the responses did not modify the templates
+        self.assertEqual( "number 0", self.k.respond("alpha alpha alpha alpha alpha n0 go").response )
+        self.assertRaises( RuntimeError, self.k.learn,
+                           os.path.join(os.path.dirname(__file__), "self-test.aiml") )
@@ -3,9 +3,15 @@
 from __future__ import print_function
 import time
 import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import json
 import unittest
 
-from aiml import Kernel
+from aiml import Kernel, readSnapshotHeader
+from aiml.script import aimlcompile, aimlloadtest, aimlreplay, aimlvalidate
 
 
 
@@ -163,6 +169,503 @@ class TestKernel( unittest.TestCase ):
         self._testTag('mixed wildcards test #4', 'test star iPhone and caret',
                  ['Test star and caret: iPhone,'])
 
+    def test21_shared_brain( self ):
+        brain = self.k.shareBrain()
+        k2 = Kernel( sharedBrain=brain )
+        k2.verbose( False )
+        k2.setBotPredicate( "name", "KIM" )
+        k2.learn( os.path.join(os.path.dirname(__file__),"overlay.aiml") )
+        # the new kernel sees both the shared and the overlay categories
+        self.assertEqual( "I am KIM and I override the shared brain", k2.respond("test bot").response )
+        self.assertEqual( "Yes?", k2.respond("call kim").response )
+        self.assertEqual( "srai test passed", k2.respond("test srai").response )
+        self.assertEqual( self.k.numCategories() + 1, k2.numCategories() )
+        # while the original one is not affected
+        self._testTag('bot', 'test bot', ["My name is Nameless"])
+        self._testTag('bot', 'call kim', [""])
+        self.assertRaises( RuntimeError, brain.add, ("X","*","*"), ['template', {}] )
+
+    def test22_reload( self ):
+        self.k.verbose( False )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join( tmpdir, "reload.aiml" )
+            category = """<aiml version="1.0.1"><category><pattern>TEST RELOAD</pattern>
+                          <template>%s</template></category></aiml>"""
+            with open( filename, "w" ) as f:
+                f.write( category % "version 1" )
+            self.k.learn( filename )
+            numCategories = self.k.numCategories()
+            self._testTag('reload', 'test reload', ["version 1"])
+            with open( filename, "w" ) as f:
+                f.write( category % "version 2" )
+            oldBrain = self.k._brain
+            thread = self.k.reload()
+            thread.join()
+            self.assertIsNot( oldBrain, self.k._brain )
+            self._testTag('reload', 'test reload', ["version 2"])
+            self._testTag('srai', "test srai", ["srai test passed"])
+            self.assertEqual( numCategories, self.k.numCategories() )
+
+            # the fuzzy matching settings are kept
+            self.k.setFuzzyMatching( maxDistance=1 )
+            self.k.reload( background=False )
+            self.assertEqual( (1, 0.8, 0.005), self.k._brain.fuzzySettings() )
+            self._testTag('reload', 'test relaod', ["version 2"])
+            self.assertEqual( 1, self.k.stats()["fuzzy"]["hits"] )
+
+            # and so is the topic partitioning
+            self.k.setTopicPartitioning()
+            self.k.reload( background=False )
+            self.assertTrue( self.k._brain.topicPartitioning() )
+            self.k.setPredicate( "topic", "fruit" )
+            self._testTag('topic', "test topic", ["We were discussing apples and oranges"])
+            self.assertIsNotNone( self.k._brain._topics )
+        finally:
+            shutil.rmtree( tmpdir )
+
+    def test23_static( self ):
+        stats = self.k.stats()
+        self.assertEqual( self.k.numCategories(), stats['categories'] )
+        self.assertTrue( 0 < stats['staticTemplates'] < stats['categories'] )
+        # templates with <bot> are static, until the bot predicates change
+        self._testTag('bot', 'test bot', ["My name is Nameless"])
+        template = self.k._brain.match( "TEST BOT", "", "" ).template
+        self.assertEqual( "My name is Nameless", self.k._staticResponse(template) )
+        self.k.setBotPredicate( "name", "Kim" )
+        self._testTag('bot', 'test bot', ["My name is Kim"])
+        self.k.setPredicate('gender', 'male')
+        self._testTag('condition', 'test condition name value', ['You are handsome'])
+        template = self.k._brain.match( "TEST CONDITION NAME VALUE", "", "" ).template
+        self.assertIsNone( self.k._staticResponse(template) )
+
+    def test24_system( self ):
+        self.k.configureSystem( allowed=["echo"], timeout=5 )
+        self._testTag('system', "test system", ["The system says hello!"])
+        self.assertEqual( 1, self.k.stats()['system']['commands'] )
+        self.k.verbose( False )
+        self.k.configureSystem( allowed=["ls"] )
+        self._testTag('system', "test system",
+                      ["The system says There was an error while computing my response.  Please inform my botmaster.!"])
+        self.assertEqual( 1, self.k.stats()['system']['rejected'] )
+        # a slow command holds up only its own session
+        if os.name == "posix":
+            import threading
+            self.k.configureSystem()
+            self.k._brain.add( ("TEST SLOW", "*", "*"),
+                               ['template', {}, ['system', {}, ['text', {'xml:space': 'default'}, "sleep 1; echo done"]]] )
+            results = []
+            slow = threading.Thread( target=lambda: results.append(self.k.respond("test slow", "a").response) )
+            slow.start()
+            while "a" not in self.k._busySessions and slow.is_alive():
+                time.sleep( 0.01 )
+            start = time.time()
+            self.assertEqual( "My name is Nameless", self.k.respond("test bot", "b").response )
+            self.assertLess( time.time() - start, 0.5 )
+            self.assertEqual( "My name is Nameless", self.k.respond("test bot", "a").response )
+            slow.join()
+            self.assertEqual( ["done"], results )
+            self.assertEqual( ["test slow", "test bot"], self.k.getPredicate("_inputHistory", "a") )
+        # an executor shared by several Kernels
+        from aiml.SystemExecutor import SystemExecutor
+        executor = SystemExecutor( workers=1, allowed=["echo"] )
+        k2 = Kernel( self.k.shareBrain() )
+        k2.verbose( False )
+        for k in (self.k, k2):
+            k.configureSystem( executor )
+            self.assertEqual( "The system says hello!", k.respond( "test system" ).response )
+        self.assertEqual( 2, executor.metrics()['commands'] )
+        self.assertRaises( TypeError, self.k.configureSystem, executor, timeout=1 )
+
+    def test25_shared_subbers( self ):
+        k2 = Kernel()
+        self.assertIs( self.k._subbers['person'], k2._subbers['person'] )
+        self.assertRaises( RuntimeError, k2._subbers['person'].__setitem__, "a", "b" )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join( tmpdir, "subs.ini" )
+            with open( filename, "w" ) as f:
+                f.write( "[person]\nhe = she\n" )
+            k2.loadSubs( filename )
+        finally:
+            shutil.rmtree( tmpdir )
+        # the customized section is only replaced for that kernel
+        self.assertEqual( "She was", k2._subbers['person'].sub("He was") )
+        self.assertEqual( "I was", self.k._subbers['person'].sub("He was") )
+        self.assertIs( self.k._subbers['gender'], k2._subbers['gender'] )
+        self.assertEqual( self.k._subbers['person'].cacheSize(),
+                          k2._subbers['person'].cacheSize() )
+
+    def test26_lazy_imports( self ):
+        self.k.verbose( False )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            brain = os.path.join( tmpdir, "test.brn" )
+            self.k.saveBrain( brain )
+            script = ( "import sys, aiml; k = aiml.Kernel(); k.verbose(False); "
+                       "k.loadBrain(sys.argv[1]); print(k.respond('test bot').response); "
+                       "print(' '.join(m for m in ('xml.sax', 'aiml.AimlParser', 'glob', "
+                       "'aiml.SystemExecutor', 'aiml.Diagnostics') if m in sys.modules))" )
+            root = os.path.dirname( os.path.dirname(os.path.abspath(__file__)) )
+            out = subprocess.check_output( [sys.executable, "-c", script, brain],
+                                           cwd=root, universal_newlines=True )
+        finally:
+            shutil.rmtree( tmpdir )
+        # a kernel working from a brain file does not need the parser
+        self.assertEqual( ["My name is Nameless", ""], out.split("\n")[:2] )
+
+    def test27_snapshot( self ):
+        self.k.verbose( False )
+        self.k.setBotPredicate( "name", "Kim" )
+        self.k.setPredicate( "gender", "female", "alice" )
+        self._testTag('bot', 'test bot', ["My name is Kim"])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            subs = os.path.join( tmpdir, "subs.ini" )
+            with open( subs, "w" ) as f:
+                f.write( "[person]\nhe = she\n" )
+            self.k.loadSubs( subs )
+            snapshot = os.path.join( tmpdir, "test.snap" )
+            self.k.saveSnapshot( snapshot, sessions=True, meta={"build": 7} )
+            header = readSnapshotHeader( snapshot )
+            self.assertEqual( self.k.numCategories(), header["categories"] )
+            self.assertEqual( {"build": 7}, header["meta"] )
+            self.assertRaises( ValueError, readSnapshotHeader, subs )
+
+            k2 = Kernel()
+            k2.verbose( False )
+            self.assertEqual( {"build": 7}, k2.loadSnapshot(snapshot) )
+        finally:
+            shutil.rmtree( tmpdir )
+        self.assertEqual( self.k.numCategories(), k2.numCategories() )
+        self.assertEqual( "My name is Kim", k2.respond("test bot").response )
+        self.assertEqual( "She was", k2._subbers['person'].sub("He was") )
+        # untouched substitutions go back to the shared ones
+        self.assertIs( self.k._subbers['gender'], k2._subbers['gender'] )
+        self.assertEqual( "female", k2.getPredicate("gender", "alice") )
+        self.assertEqual( self.k.getSessionData("alice")["_inputHistory"],
+                          k2.getSessionData("alice")["_inputHistory"] )
+        # the matcher index is saved too, rather than built again on load
+        self.assertIn( "index", self.k._brain.getState() )
+        exact, nodeInfo = dict(k2._brain._exact), dict(k2._brain._nodeInfo)
+        k2._brain.compile()
+        self.assertEqual( exact, k2._brain._exact )
+        self.assertEqual( nodeInfo, k2._brain._nodeInfo )
+
+    def test28_prebuilt( self ):
+        self.k.verbose( False )
+        categories = self.k.numCategories()
+        self.assertEqual( 0, self.k.stats()["replaced"] )
+        self.k.learn( self.k.learnedFiles()[0] )
+        self.assertEqual( categories, self.k.numCategories() )
+        self.assertEqual( categories, self.k.stats()["replaced"] )
+
+        spec = aimlcompile.BUNDLED["standard"]
+        fingerprint = aimlcompile.source_fingerprint(
+            aimlcompile.bundled_sources("standard"), spec["commands"] )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join( tmpdir, "standard.snapshot" )
+            k2 = Kernel()
+            k2.verbose( False )
+            self.assertFalse( aimlcompile.load_prebuilt(k2, "standard", snapshot) )
+            self.k.saveSnapshot( snapshot, meta={"fingerprint": "stale"} )
+            self.assertFalse( aimlcompile.load_prebuilt(k2, "standard", snapshot) )
+            self.assertEqual( 0, k2.numCategories() )
+            self.k.saveSnapshot( snapshot, meta={"fingerprint": fingerprint} )
+            self.assertTrue( aimlcompile.load_prebuilt(k2, "standard", snapshot) )
+            self.assertEqual( categories, k2.numCategories() )
+        finally:
+            shutil.rmtree( tmpdir )
+
+    def test29_validate( self ):
+        good = b"<aiml><category><pattern>A</pattern><template>a</template></category></aiml>"
+        result = aimlvalidate.validate( "good.aiml", good )
+        self.assertTrue( result['valid'] )
+        self.assertEqual( [], result['errors'] )
+        result = aimlvalidate.validate( "bad.aiml", good.replace(b"a</template>",
+                                        b"<random>a</random></template>") )
+        self.assertFalse( result['valid'] )
+        self.assertEqual( 1, len(result['errors']) )
+        self.assertEqual( 1, result['errors'][0]['line'] )
+        self.assertIn( "<random>", result['errors'][0]['message'] )
+        result = aimlvalidate.validate( "broken.aiml", good.replace(b"</template>", b"") )
+        self.assertFalse( result['valid'] )
+        self.assertTrue( result['errors'][-1]['fatal'] )
+
+        # validating some of the files keeps the cache entries of the others
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = [os.path.join( tmpdir, name ) for name in ("a.aiml", "b.aiml")]
+            for name in files:
+                with open( name, "wb" ) as f:
+                    f.write( good )
+            cache = os.path.join( tmpdir, "cache.json" )
+            root = os.path.dirname( os.path.dirname(os.path.abspath(__file__)) )
+            validate = lambda *files : subprocess.call(
+                [sys.executable, "-m", "aiml.script.aimlvalidate", "--json",
+                 "--cache", cache] + list(files), cwd=root, stdout=subprocess.PIPE )
+            self.assertEqual( 0, validate(*files) )
+            self.assertEqual( 2, len(aimlvalidate.load_cache( cache )) )
+            with open( files[0], "wb" ) as f:
+                f.write( good.replace(b"</template>", b"") )
+            self.assertEqual( 1, validate(files[0]) )
+            self.assertEqual( [files[1]], list(aimlvalidate.load_cache( cache )) )
+        finally:
+            shutil.rmtree( tmpdir )
+
+    def test30_analyze( self ):
+        self.k.verbose( False )
+        self.k.setProvenance()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for name, categories in ( ("a.aiml", ("HI THERE", "HI _")),
+                                      ("b.aiml", ("HI THERE", "HELLO THERE")) ):
+                with open( os.path.join(tmpdir, name), "w" ) as f:
+                    f.write( "<aiml>" )
+                    for pattern in categories:
+                        f.write( "<category><pattern>%s</pattern>"
+                                 "<template>Hi!</template></category>" % pattern )
+                    f.write( "</aiml>" )
+                self.k.learn( os.path.join(tmpdir, name) )
+            report = self.k.analyze()
+        finally:
+            shutil.rmtree( tmpdir )
+        fileA, fileB = [os.path.join(tmpdir, f) for f in ("a.aiml", "b.aiml")]
+        self.assertEqual( [(("HI THERE", "*", "*"), fileA, fileB)], report["replaced"] )
+        self.assertEqual( [(("HI THERE", "*", "*"), fileB)], report["unreachable"] )
+        self.assertIn( [("HELLO THERE", "*", "*"), ("HI THERE", "*", "*"), ("HI _", "*", "*")],
+                       report["duplicateTemplates"] )
+
+        categories = self.k.numCategories()
+        removed, shared = self.k.prune()
+        self.assertEqual( 1, removed )
+        self.assertGreaterEqual( shared, 1 )
+        self.assertEqual( categories - 1, self.k.numCategories() )
+        self.assertEqual( "Hi!", self.k.respond("hi there").response )
+
+    def test31_recorder( self ):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            log = os.path.join( tmpdir, "traffic.log" )
+            self.k.setRecorder( log )
+            self.k.respond( "test bot", "alice" )
+            self.k.respond( "test srai", "bob" )
+            self.k.setRecorder( None )
+            self.k.respond( "test bot", "alice" )
+            with open( log ) as f:
+                entries = [ json.loads(line) for line in f ]
+
+            self.assertEqual( 2, len(entries) )
+            self.assertEqual( ["alice", "bob"], [e["session"] for e in entries] )
+            self.assertEqual( "test bot", entries[0]["input"] )
+            self.assertEqual( self.k._cod.dec(self.k.respond("test bot").response),
+                              entries[0]["response"] )
+            self.assertEqual( 2, len(entries[1]["patterns"]) )
+            self.assertGreaterEqual( entries[0]["latency"], 0 )
+
+            # Replaying the log against the same AIML gives the same responses
+            testfile = os.path.join( os.path.dirname(__file__), "self-test.aiml" )
+            sessions = aimlreplay.read_log( log )
+            results = aimlreplay.replay( (["aiml:" + testfile], None, sessions) )
+            for n, entry in enumerate( entries ):
+                self.assertEqual( entry["response"], results[n][0][0] )
+                self.assertEqual( entry["patterns"], results[n][0][1] )
+        finally:
+            shutil.rmtree( tmpdir )
+
+        self.assertEqual( 3, aimlreplay.percentile([1, 2, 3, 4, 5], 50) )
+        self.assertEqual( 5, aimlreplay.percentile([1, 2, 3, 4, 5], 99) )
+
+    def test32_random_seed( self ):
+        self.k.setRandomSeed( 42 )
+        first = [ self.k.respond("test random", "s1").response for _ in range(10) ]
+        other = [ self.k.respond("test random", "s2").response for _ in range(10) ]
+        self.k.setRandomSeed( 42 )
+        # The choices in a session do not depend on the other sessions
+        self.assertEqual( other, [self.k.respond("test random", "s2").response
+                                  for _ in range(10)] )
+        self.assertEqual( first, [self.k.respond("test random", "s1").response
+                                  for _ in range(10)] )
+
+    def test33_respond_metrics( self ):
+        self.k.respond( "test bot" )
+        self.k.respond( "test srai" )
+        metrics = self.k.respondMetrics()
+        self.assertEqual( 2, metrics["calls"] )
+        self.assertGreater( metrics["respondTime"], 0 )
+        self.assertGreaterEqual( metrics["maxRespondTime"] * 2, metrics["respondTime"] )
+        self.assertGreaterEqual( metrics["lockWait"], metrics["maxLockWait"] )
+
+        # A short load test with inputs made up from the patterns
+        testfile = os.path.join( os.path.dirname(__file__), "self-test.aiml" )
+        inputs = aimlloadtest.synthesize( self.k, 20, seed=1 )
+        self.assertEqual( 20, len(inputs) )
+        result = aimlloadtest.run_worker( ("aiml:" + testfile, 1, 2, 3, 0, None,
+                                           None, 30, 1.0) )
+        self.assertEqual( [], result["errors"] )
+        self.assertEqual( 30, len(result["latencies"]) )
+        self.assertEqual( 30, sum(m["calls"] for m in result["metrics"]) )
+        self.assertGreaterEqual( len(result["memory"]), 2 )
+
+    def test34_memory_report( self ):
+        testfile = os.path.join( os.path.dirname(__file__), "self-test.aiml" )
+        self.k.setProvenance()
+        try:
+            self.k.setMemoryTracing()
+        except ImportError:
+            pass
+        self.k.learn( testfile )
+        self.k.respond( "test bot", "alice" )
+        report = self.k.memoryReport( top=2 )
+        components = report["components"]
+        self.assertEqual( sum(components.values()), report["total"] )
+        for name in ("nodes", "templates", "subbers", "sessions", "provenance"):
+            self.assertGreater( components[name], 0, msg=name )
+        self.assertEqual( 0, components["sharedBrain"] )
+        self.assertEqual( 2, len(report["branches"]) )
+        self.assertEqual( [os.path.abspath(testfile)], list(report["files"]) )
+        self.assertGreater( report["files"][os.path.abspath(testfile)], 0 )
+        if "allocated" in report:
+            self.assertEqual( [os.path.abspath(testfile)], list(report["allocated"]) )
+            self.k.setMemoryTracing( False )
+            self.assertNotIn( "allocated", self.k.memoryReport() )
+
+        # A Kernel over a shared brain
+        k2 = Kernel( sharedBrain=self.k.shareBrain() )
+        self.assertGreater( k2.memoryReport()["components"]["sharedBrain"], 0 )
+
+    def test35_respond_iter( self ):
+        input_ = "test bot. test input"
+        expected = self.k.respond( input_, "s1" )
+        results = list( self.k.respondIter(input_, "s2") )
+        self.assertEqual( 2, len(results) )
+        self.assertEqual( expected.response, "  ".join(r.response for r in results) )
+        self.assertEqual( expected.patterns, sum((r.patterns for r in results), []) )
+        for key in (self.k._inputHistory, self.k._outputHistory):
+            self.assertEqual( self.k.getPredicate(key, "s1"),
+                              self.k.getPredicate(key, "s2") )
+        self.assertEqual( [], list(self.k.respondIter("")) )
+
+        # the history is updated as each response is produced
+        responses = self.k.respondIter( "test bot. test bot", "s3" )
+        next( responses )
+        self.assertEqual( 1, len(self.k.getPredicate(self.k._outputHistory, "s3")) )
+
+    @unittest.skipIf( sys.version_info < (3, 5), "requires asyncio async iterators" )
+    def test36_respond_async( self ):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop( loop )
+        try:
+            responses = self.k.respondAsync( "test bot. test input" ).__aiter__()
+            results = []
+            while True:
+                try:
+                    results.append( loop.run_until_complete(responses.__anext__()) )
+                except StopAsyncIteration:
+                    break
+        finally:
+            asyncio.set_event_loop( None )
+            loop.close()
+        self.assertEqual( list(self.k.respondIter("test bot. test input")), results )
+
+    def test37_deadline( self ):
+        self.k.verbose( False )
+        self.k.setDeadline( 1e-5, "Too slow" )
+        self.assertEqual( "Too slow", self.k.respond("test srai infinite").response )
+        # the rest of the input is dropped
+        self.assertEqual( "Too slow", self.k.respond("test srai infinite. test bot").response )
+        self.assertEqual( ["test srai infinite"] * 2,
+                          self.k.getPredicate(self.k._inputHistory)[-2:] )
+        self.assertEqual( 1, len(list(self.k.respondIter("test srai infinite. test bot"))) )
+        self.assertEqual( 3, self.k.respondMetrics()["timeouts"] )
+        # a deadline given to respond() overrides the default
+        self.assertEqual( "My name is Nameless",
+                          self.k.respond("test bot", deadline=10).response )
+        self.k.setDeadline( None )
+        self.assertEqual( "", self.k.respond("test srai infinite").response )
+        self.assertEqual( 3, self.k.respondMetrics()["timeouts"] )
+
+        # <system> commands get only the remaining time
+        if os.name == "posix":
+            self.k.setDeadline( None, "Too slow" )
+            self.k.configureSystem( timeout=10 )
+            self.k._brain.add( ("TEST SLOW", "*", "*"),
+                               ['template', {}, ['system', {}, ['text', {'xml:space': 'default'}, "sleep 10"]]] )
+            start = time.time()
+            self.assertEqual( "Too slow", self.k.respond("test slow", deadline=0.3).response )
+            self.assertLess( time.time() - start, 5 )
+
+    def test38_sets( self ):
+        self.k.loadSet( os.path.join(os.path.dirname(__file__), "color.set") )
+        self._testTag( 'set', "test set red", ["A color"] )
+        self._testTag( 'set', "test set light blue", ["A color"] )
+        self._testTag( 'set', "test set light blue sky", ["A color then sky"] )
+        self.assertNotEqual( "A color", self.k.respond("test set pink").response )
+        # JSON set files, and sets kept by snapshots
+        tmpdir = tempfile.mkdtemp()
+        try:
+            setFile = os.path.join( tmpdir, "colour.json" )
+            with open( setFile, "w" ) as f:
+                json.dump( ["pink", ["dark", "red"]], f )
+            self.k.loadSet( setFile, name="color" )
+            self._testTag( 'set', "test set dark red", ["A color"] )
+            snapshot = os.path.join( tmpdir, "brain.snapshot" )
+            self.k.saveSnapshot( snapshot )
+            k2 = Kernel()
+            k2.verbose( False )
+            k2.loadSnapshot( snapshot )
+            self.assertEqual( "A color", k2.respond("test set pink").response )
+        finally:
+            shutil.rmtree( tmpdir )
+
+    def test39_diagnostics( self ):
+        import logging
+        from aiml import Diagnostics
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        Diagnostics.startQueue( handler )
+        try:
+            self.k.setDiagnostics( logging.INFO, burst=2 )
+            for _ in range(5):
+                self.k.respond( "no such input" )
+            self.k.respond( "test input" )
+            self.k.setDiagnostics( logging.WARNING, burst=2 )
+            self.k.respond( "no such input" )
+            self.assertEqual( {"emitted": 2, "suppressed": 3, "dropped": 0},
+                              self.k.stats()["diagnostics"] )
+        finally:
+            Diagnostics.stopQueue()
+        self.assertEqual( ["No match found for input: no such input"] * 2,
+                          [r.getMessage() for r in records] )
+        self.assertEqual( [logging.INFO] * 2, [r.levelno for r in records] )
+
+    def test40_diagnostics_verbose( self ):
+        import logging
+        from aiml import Diagnostics
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        Diagnostics.startQueue( handler )
+        try:
+            # verbose() decides until setDiagnostics() is called...
+            self.k.verbose( True )
+            self.k.respond( "no such input" )
+            self.k.verbose( False )
+            self.k.respond( "no such input" )
+            # ...which then takes precedence, either way
+            self.k.setDiagnostics( logging.INFO )
+            self.k.respond( "no such input" )
+            self.k.setDiagnostics( None )
+            self.k.verbose( True )
+            self.k.respond( "no such input" )
+        finally:
+            Diagnostics.stopQueue()
+        self.assertEqual( ["No match found for input: no such input"] * 2,
+                          [r.getMessage() for r in records] )
+
         # Run an interactive interpreter
         #print( "\nEntering interactive mode (ctrl-c to exit)" )
         #while True: print( self.k.respond(raw_input("> ")) )
@@ -0,0 +1,350 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import io
+import json
+import unittest
+
+from aiml.constants import PY3
+from aiml.PatternMgr import PatternMgr
+
+
+class TestPatternMgr( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.p = PatternMgr()
+        for pattern, that, topic in ( ("HELLO", "*", "*"),
+                                      ("HELLO *", "*", "*"),
+                                      ("* IS MY NAME", "*", "*"),
+                                      ("I LIKE * VERY MUCH", "*", "*"),
+                                      ("_ BYE", "*", "*"),
+                                      ("^ COLOR", "*", "*"),
+                                      ("*", "*", "*"),
+                                      ("YES", "DO YOU LIKE *", "*"),
+                                      ("TOPIC TEST", "*", "FRUIT") ):
+            self.p.add( (pattern, that, topic), ['template', {}, pattern] )
+
+    def tearDown(self):
+        del self.p
+
+    def _check(self, input_, expected, that="", topic=""):
+        """Match with and without the compiled metadata, and verify that
+        both find the template for the 'expected' pattern"""
+        # an empty metadata table (and index) disables all pruning; the
+        # <set> children found by compile() are still needed
+        self.p.compile()
+        self.p._nodeInfo = {}
+        self.p._exact = {}
+        self.p._topics = self.p._wildTopics = None
+        plain = self.p.match( input_, that, topic )
+        self.p._invalidate()
+        result = self.p.match( input_, that, topic )
+        self.assertTrue( self.p._compiled )
+        self.assertEqual( expected, result.template[2], msg="input=%s"%input_ )
+        self.assertEqual( plain, result, msg="input=%s"%input_ )
+
+    def test01_compile( self ):
+        self.p.compile()
+        info = self.p._nodeInfo[ id(self.p._root['I']['LIKE'][PatternMgr._STAR]) ]
+        self.assertFalse( info.wild )
+        self.assertEqual( (2, 2), (info.minLen, info.maxLen) )
+        # fully wildcard nodes give no information, and are left out
+        self.assertNotIn( id(self.p._root[PatternMgr._STAR][PatternMgr._THAT]), self.p._nodeInfo )
+
+    def test02_invalidate( self ):
+        self.p.compile()
+        self.p.add( ("HELLO THERE", "*", "*"), ['template', {}, 'new'] )
+        self.assertFalse( self.p._compiled )
+        self._check( "hello there", "new" )
+
+    def test03_match( self ):
+        self._check( "hello", "HELLO" )
+        self._check( "hello you", "HELLO *" )
+        self._check( "Bond James Bond is my name", "* IS MY NAME" )
+        self._check( "I like cream cheese and jam very much", "I LIKE * VERY MUCH" )
+        self._check( "I like cream very much indeed", "*" )
+        self._check( "ok then bye", "_ BYE" )
+        self._check( "color", "^ COLOR" )
+        self._check( "my favorite color", "^ COLOR" )
+        self._check( "yes", "YES", that="Do you like cheese?" )
+        self._check( "yes", "*", that="How are you?" )
+        self._check( "topic test", "TOPIC TEST", topic="fruit" )
+        self._check( "topic test", "*", topic="cars" )
+
+    def test04_overlay( self ):
+        self.p.freeze()
+        self.assertRaises( RuntimeError, self.p.add, ("X","*","*"), ['template', {}] )
+        overlay = PatternMgr( self.p )
+        overlay.add( ("HELLO THERE", "*", "*"), ['template', {}, 'overlay'] )
+        overlay.add( ("OK BYE", "*", "*"), ['template', {}, 'overlay'] )
+        overlay.add( ("HELLO", "*", "*"), ['template', {}, 'overlay'] )
+        overlay.add( ("CALL BOT_NAME", "*", "*"), ['template', {}, 'overlay'] )
+        overlay.setBotName( "KIM" )
+        # only the really new categories count
+        self.assertEqual( self.p.numTemplates() + 3, overlay.numTemplates() )
+        m = lambda p : overlay.match( p, "", "" ).template[2]
+        self.assertEqual( "overlay", m("hello there") )
+        self.assertEqual( "overlay", m("hello") )
+        self.assertEqual( "HELLO *", m("hello you") )
+        self.assertEqual( "overlay", m("call kim") )
+        # the base brain keeps its own templates and bot name
+        self.assertEqual( "HELLO", self.p.match( "hello", "", "" ).template[2] )
+        self.assertEqual( "*", self.p.match( "call kim", "", "" ).template[2] )
+        # a _ in the base still takes precedence over overlay words
+        self.assertEqual( "_ BYE", m("ok bye") )
+
+    def test05_remove( self ):
+        count = self.p.numTemplates()
+        self.assertEqual( ['template', {}, "I LIKE * VERY MUCH"],
+                          self.p.remove( ("I LIKE * VERY MUCH", "*", "*") ) )
+        self.assertEqual( count-1, self.p.numTemplates() )
+        self.assertIsNone( self.p.remove( ("I LIKE * VERY MUCH", "*", "*") ) )
+        self.assertIsNone( self.p.remove( ("HELLO THERE", "*", "*") ) )
+        # the whole branch is gone
+        self.assertNotIn( "I", self.p._root )
+        self._check( "I like it very much", "*" )
+        # but not the nodes still in use by other categories
+        self.p.remove( ("HELLO", "*", "*") )
+        self._check( "hello", "*" )
+        self._check( "hello you", "HELLO *" )
+        self.assertEqual( count-2, self.p.numTemplates() )
+
+    def test06_diff( self ):
+        other = PatternMgr()
+        for data, template in self.p.categories():
+            other.add( data, template )
+        self.assertEqual( [], list(self.p.diff(other)) )
+        self.assertIn( (("YES", "DO YOU LIKE *", "*"), ['template', {}, "YES"]),
+                       list(other.categories()) )
+        other.remove( ("_ BYE", "*", "*") )
+        other.add( ("HELLO", "*", "*"), ['template', {}, "HI!"] )
+        other.add( ("HELLO BOT_NAME", "*", "*"), ['template', {}, "HI ME!"] )
+        changes = sorted( self.p.diff(other) )
+        self.assertEqual( [ ('added', ("HELLO BOT_NAME", "*", "*"), ['template', {}, "HI ME!"]),
+                            ('changed', ("HELLO", "*", "*"), ['template', {}, "HI!"]),
+                            ('removed', ("_ BYE", "*", "*"), ['template', {}, "_ BYE"]) ],
+                          changes )
+        self.p.patch( changes )
+        self.assertEqual( [], list(self.p.diff(other)) )
+        self.assertEqual( other.numTemplates(), self.p.numTemplates() )
+
+    def test07_exact( self ):
+        self.p.add( ("GOOD BYE", "*", "*"), ['template', {}, "GOOD BYE"] )
+        self.p.add( ("_ BOT_NAME", "*", "*"), ['template', {}, "_ BOT_NAME"] )
+        self.p.add( ("HI KIM", "*", "*"), ['template', {}, "HI KIM"] )
+        self.p.compile()
+        self.assertIn( ("HELLO",), self.p._exact )
+        self.assertIsNotNone( self.p._exactMatch( ["HELLO"], ["X"], ["Y"] ) )
+        self._check( "hello", "HELLO" )
+        # the literal category has to go after the one with _
+        self.assertNotIn( ("GOOD", "BYE"), self.p._exact )
+        self._check( "good bye", "_ BYE" )
+        # indexed inputs still have their that/topic matched
+        self._check( "yes", "YES", that="Do you like cheese?" )
+        self._check( "yes", "*", that="How are you?" )
+        # or on the bot name
+        self.assertEqual( frozenset(["KIM"]), self.p._exact[("HI", "KIM")][3] )
+        self._check( "hi kim", "HI KIM" )
+        self.p.setBotName( "KIM" )
+        self._check( "hi kim", "_ BOT_NAME" )
+
+    def test08_unreachable( self ):
+        self.assertEqual( [], list(self.p.unreachable()) )
+        self.p.add( ("GOOD BYE", "*", "*"), ['template', {}, "GOOD BYE"] )
+        self.p.add( ("I LIKE _", "*", "*"), ['template', {}, "I LIKE _"] )
+        self.p.add( ("COLOR", "*", "*"), ['template', {}, "COLOR"] )
+        self.p.add( ("COLOR ^", "*", "*"), ['template', {}, "COLOR ^"] )
+        self.p.add( ("_", "YES", "*"), ['template', {}, "_ YES"] )
+        found = sorted( data for data, template in self.p.unreachable() )
+        # shadowed by "COLOR ^", "_ BYE" and "I LIKE _"
+        self.assertEqual( [ ("COLOR", "*", "*"), ("GOOD BYE", "*", "*"),
+                            ("I LIKE * VERY MUCH", "*", "*") ], found )
+        for data in found:
+            pattern = data[0].replace( "*", "very" )
+            self.assertNotEqual( data[0], self.p.match(pattern, "", "").template[2] )
+
+    def test09_share_templates( self ):
+        self.p.add( ("HI", "*", "*"), ['template', {}, "HELLO"] )
+        self.assertEqual( 1, self.p.shareTemplates() )
+        self.assertIs( self.p.match("hi", "", "").template,
+                       self.p.match("hello", "", "").template )
+        self.assertEqual( 0, self.p.shareTemplates() )
+
+    def test10_stats( self ):
+        # the word "2" is also the template key
+        self.p.add( ("I AM 2", "*", "*"), ['template', {}, "I AM 2"] )
+        self.p.add( ("I AM 2 YEARS OLD TODAY", "*", "*"), ['template', {}, "2 YEARS"] )
+        stats = self.p.stats( top=2 )
+        self.assertEqual( self.p.numTemplates(), stats["templates"] )
+        self.assertEqual( self.p.numNodes(), stats["nodes"] )
+        self.assertEqual( {4: 1}, stats["fanOut"][0] )   # 7 children
+        self.assertEqual( {"_": 1, "*": 3, "^": 1, "BOT_NAME": 0},
+                          stats["wildcards"]["pattern"] )
+        self.assertEqual( 11, stats["thatTries"] )
+        self.assertEqual( ("I AM 2 YEARS OLD TODAY", "*", "*"), stats["longest"][0][1] )
+        self.assertEqual( 2, len(stats["branches"]) )
+        self.assertEqual( "I", stats["branches"][0][0] )
+        self.assertGreater( stats["memory"]["templates"], 0 )
+
+        out = io.StringIO() if PY3 else io.BytesIO()
+        self.p.dump( out )
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual( self.p.numTemplates(), len(lines) )
+        self.assertIn( {"pattern": "I AM 2", "that": "*", "topic": "*",
+                        "template": ['template', {}, "I AM 2"]}, lines )
+
+    def test11_memory( self ):
+        usage = self.p.memoryUsage( top=3 )
+        self.assertEqual( 3, len(usage["branches"]) )
+        self.assertGreater( usage["templates"], 0 )
+        branches = [ size for word, size in usage["branches"] ]
+        self.assertEqual( sorted(branches, reverse=True), branches )
+        self.assertLess( sum(branches), usage["nodes"] + usage["keys"] + usage["templates"] )
+        # Objects already counted are left out
+        seen = set()
+        self.p.memoryUsage( seen=seen )
+        self.assertEqual( 0, self.p.memoryUsage(seen=seen)["templates"] )
+
+    def test12_topic_partitioning( self ):
+        self.p.add( ("TOPIC TEST", "*", "VEGETABLE"), ['template', {}, "VEGETABLE"] )
+        self.p.add( ("TOPIC *", "*", "*"), ['template', {}, "TOPIC *"] )
+        self.p.add( ("TOPIC *", "*", "SOYLENT *"), ['template', {}, "SOYLENT"] )
+        self.p.setTopicPartitioning()
+        self.p.compile()
+        self.assertEqual( set([("FRUIT",), ("VEGETABLE",)]), set(self.p._topics) )
+        # branches without categories in a literal topic are shared
+        self.assertIs( self.p._root["HELLO"], self.p._wildTopics["HELLO"] )
+        self.assertNotIn( "FRUIT", str(self.p._wildTopics["TOPIC"]) )
+        m = lambda input_, topic : self.p.match( input_, "", topic ).template[2]
+        self.assertEqual( "TOPIC TEST", m("topic test", "fruit") )
+        self.assertEqual( "VEGETABLE", m("topic test", "vegetable") )
+        self.assertEqual( "SOYLENT", m("topic test", "soylent green") )
+        self.assertEqual( "TOPIC *", m("topic test", "cars") )
+        self.assertEqual( "green", self.p.wildcard( "topicstar", "topic test", "",
+                                                    "soylent green", 1 ) )
+        self._check( "hello you", "HELLO *", topic="fruit" )
+
+        # also for an overlay over a partitioned brain
+        self.p.freeze()
+        overlay = PatternMgr( self.p )
+        overlay.add( ("TOPIC TEST", "*", "CARS"), ['template', {}, "CARS"] )
+        overlay.setTopicPartitioning()
+        m = lambda input_, topic : overlay.match( input_, "", topic ).template[2]
+        self.assertEqual( "CARS", m("topic test", "cars") )
+        self.assertEqual( "TOPIC TEST", m("topic test", "fruit") )
+        self.assertEqual( "TOPIC *", m("topic test", "boats") )
+
+    def test13_fuzzy_matching( self ):
+        self.p.add( ("WHAT IS YOUR NAME", "*", "*"), ['template', {}, "NAME"] )
+        m = lambda input_ : self.p.match( input_, "", "" ).template[2]
+        self.assertEqual( "*", m("what is your naem") )
+        self.assertIsNone( self.p.fuzzyMetrics() )
+        self.p.setFuzzyMatching()
+        self.assertEqual( "NAME", m("what is your naem") )
+        self.assertEqual( "NAME", m("waht is yur name") )
+        # too many edits, or too many for a short input
+        self.assertEqual( "*", m("wat iz yor naem") )
+        self.assertEqual( "*", m("helo") )
+        # other matches are left alone
+        self.assertEqual( "HELLO *", m("hello naem") )
+        self.assertEqual( "*", m("banana split") )
+        self.assertEqual( {"attempts": 5, "hits": 2, "misses": 3, "timeouts": 0},
+                          self.p.fuzzyMetrics() )
+        # repeated inputs come from the cache
+        self.assertEqual( "NAME", m("what is your naem") )
+        self.assertEqual( 5, self.p.fuzzyMetrics()["attempts"] )
+        # the least recently used results are dropped first
+        self.p._FUZZY_CACHE_SIZE = 2
+        self.assertEqual( "*", m("banana splits") )
+        self.assertEqual( "NAME", m("what is your naem") )
+        self.assertEqual( "*", m("apple pie") )
+        self.assertEqual( "NAME", m("what is your naem") )
+        self.assertEqual( 7, self.p.fuzzyMetrics()["attempts"] )
+        self.assertEqual( "*", m("banana splits") )
+        self.assertEqual( 8, self.p.fuzzyMetrics()["attempts"] )
+        # concurrent matches keep the counters right
+        import threading
+        threads = [threading.Thread( target=lambda n=n: [m("banana %d %d" % (n, i))
+                                                         for i in range(50)] )
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual( 208, self.p.fuzzyMetrics()["attempts"] )
+        self.assertEqual( 2, len(self.p._fuzzyCache) )
+        self.p.setFuzzyMatching( threshold=0.95 )
+        self.assertEqual( "*", m("what is your naem") )
+        self.p.setFuzzyMatching( False )
+        self.assertEqual( "*", m("waht is yur name") )
+
+        # an overlay also finds the words of its base
+        self.p.setFuzzyMatching()
+        self.p.freeze()
+        overlay = PatternMgr( self.p )
+        overlay.add( ("HOW OLD ARE YOU", "*", "*"), ['template', {}, "AGE"] )
+        overlay.setFuzzyMatching()
+        m = lambda input_ : overlay.match( input_, "", "" ).template[2]
+        self.assertEqual( "AGE", m("how old are yuo") )
+        self.assertEqual( "NAME", m("what is your naem") )
+
+    def test14_sets( self ):
+        self.p.add( ("I LIKE <set>color</set>", "*", "*"), ['template', {}, "COLOR"] )
+        self.p.add( ("I LIKE <set>color</set> *", "*", "*"), ['template', {}, "COLOR *"] )
+        self.p.add( ("* <set>COLOR</set> PLEASE", "*", "*"), ['template', {}, "* COLOR PLEASE"] )
+        self.p.add( ("YES", "DO YOU LIKE <set>color</set>", "*"), ['template', {}, "YES COLOR"] )
+        # an undefined set matches nothing
+        self._check( "I like red", "*" )
+        self.p.addSet( "Color", ["red", "Dark red!", "green"] )
+        self.assertEqual( {"COLOR": ["DARK RED", "GREEN", "RED"]}, self.p.sets() )
+        self._check( "I like red", "COLOR" )
+        self._check( "I like dark red", "COLOR" )
+        self._check( "I like dark red wine", "COLOR *" )
+        self._check( "I like dark", "*" )
+        self._check( "I like cream cheese and jam very much", "I LIKE * VERY MUCH" )
+        self._check( "well I like green please", "* COLOR PLEASE" )
+        self._check( "yes", "YES COLOR", that="Do you like dark red?" )
+        self.assertEqual( ["I", "LIKE", "DARK", "RED", PatternMgr._THAT],
+                          self.p.match( "I like dark red", "", "" ).pattern[:5] )
+        self.assertEqual( "wine", self.p.wildcard( "star", "I like dark red wine", "", "", 1 ) )
+        self.assertEqual( ("I LIKE <set>COLOR</set> *", "*", "*"),
+                          self.p.canonical( ("I LIKE <set>color</set> *", "*", "*") ) )
+
+        # sets are saved with the patterns
+        restored = PatternMgr()
+        restored.setState( self.p.getState() )
+        self.assertEqual( "COLOR", restored.match( "I like green", "", "" ).template[2] )
+
+        # an overlay can match the sets of its base, and add its own
+        self.p.freeze()
+        overlay = PatternMgr( self.p )
+        self.assertRaises( ValueError, overlay.addSet, "color", ["blue"] )
+        overlay.addSet( "fruit", ["apple"] )
+        overlay.add( ("I LIKE <set>FRUIT</set>", "*", "*"), ['template', {}, "FRUIT"] )
+        m = lambda input_ : overlay.match( input_, "", "" ).template[2]
+        self.assertEqual( "FRUIT", m("I like apple") )
+        self.assertEqual( "COLOR", m("I like red") )
+        self.assertEqual( "I LIKE * VERY MUCH", m("I like apple very much") )
+
+    def test15_topic_partitioning_caret( self ):
+        # a ^ ending a pattern keeps the that/topic of the identical
+        # pattern from being tried, even in another topic
+        results = []
+        for partition in (False, True):
+            p = PatternMgr()
+            for pattern, that, topic in ( ("X ^", "*", "FRUIT"),
+                                          ("X", "*", "*"),
+                                          ("X", "*", "CARS"),
+                                          ("Y", "*", "FRUIT"),
+                                          ("*", "*", "*") ):
+                p.add( (pattern, that, topic), ['template', {}, pattern + "/" + topic] )
+            p.setTopicPartitioning( partition )
+            p.compile()
+            results.append( [p.match( "x", that, topic ).template[2]
+                             for that in ("", "hi") for topic in ("", "cars", "fruit")] )
+        self.assertEqual( results[0], results[1] )
+        self.assertEqual( ["*/*", "*/*", "X ^/FRUIT"] * 2, results[1] )
+        # (the node tree is left whole)
+        self.assertIsNone( p._topics )
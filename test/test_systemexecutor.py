@@ -0,0 +1,70 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import os
+import threading
+import time
+import unittest
+
+from aiml.SystemExecutor import SystemExecutor
+
+
+@unittest.skipUnless( os.name == "posix", "uses POSIX shell commands" )
+class TestSystemExecutor( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_run( self ):
+        executor = SystemExecutor()
+        self.assertEqual( "hello\n", executor.run("echo hello") )
+        self.assertEqual( 1, executor.metrics()['commands'] )
+
+    def test02_timeout( self ):
+        executor = SystemExecutor( timeout=0.5 )
+        start = time.time()
+        self.assertRaises( RuntimeError, executor.run, "sleep 10; echo late" )
+        self.assertLess( time.time() - start, 5 )
+        self.assertEqual( 1, executor.metrics()['timeouts'] )
+        # the default can be overridden
+        self.assertEqual( "ok\n", executor.run("sleep 0.6; echo ok", timeout=5) )
+        # and shortened by a deadline
+        start = time.time()
+        self.assertRaises( RuntimeError, executor.run, "sleep 10; echo late",
+                           timeout=5, deadline=start + 0.2 )
+        self.assertLess( time.time() - start, 4 )
+        self.assertRaises( RuntimeError, executor.run, "echo late",
+                           deadline=start - 1 )
+        self.assertEqual( 3, executor.metrics()['timeouts'] )
+
+    def test03_output( self ):
+        executor = SystemExecutor( maxOutput=1000 )
+        self.assertEqual( 1000, len(executor.run("yes")) )
+        self.assertEqual( 1, executor.metrics()['truncated'] )
+
+    def test04_allowed( self ):
+        executor = SystemExecutor( allowed=["echo"] )
+        self.assertRaises( RuntimeError, executor.run, "ls /" )
+        # allowed commands do not go through the shell
+        self.assertEqual( "a; ls /\n", executor.run("echo 'a;' ls /") )
+        self.assertEqual( 1, executor.metrics()['rejected'] )
+
+    def test05_cache( self ):
+        executor = SystemExecutor( idempotent=["date"], cacheTTL=60 )
+        first = executor.run("date +%N")
+        self.assertEqual( first, executor.run("date +%N") )
+        self.assertNotEqual( executor.run("echo $$"), executor.run("echo $$") )
+        metrics = executor.metrics()
+        self.assertEqual( 1, metrics['cacheHits'] )
+        self.assertEqual( 3, metrics['commands'] )
+        executor.clearCache()
+        executor.run("date +%N")
+        self.assertEqual( 4, executor.metrics()['commands'] )
+
+    def test06_workers( self ):
+        executor = SystemExecutor( workers=1, timeout=0.5 )
+        thread = threading.Thread( target=executor.run, args=("sleep 0.3",) )
+        thread.start()
+        time.sleep(0.1)
+        executor.run("true")
+        thread.join()
+        self.assertGreater( executor.metrics()['maxQueueWait'], 0.1 )
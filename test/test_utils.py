@@ -22,3 +22,11 @@ class TestUtils( unittest.TestCase ):
         sents = Utils.sentences("First.  Second, still?  Third and Final!  Well, not really")
         self.assertEqual( 4, len(sents) )
 
+
+    def test_editDistance( self ):
+        self.assertEqual( 0, Utils.editDistance("NAME", "NAME") )
+        self.assertEqual( 1, Utils.editDistance("NAEM", "NAME") )
+        self.assertEqual( 1, Utils.editDistance("NAM", "NAME") )
+        self.assertEqual( 2, Utils.editDistance("YUR", "YOUR!") )
+        self.assertEqual( 3, Utils.editDistance("KITTEN", "SITTING") )
+        self.assertEqual( 4, Utils.editDistance("", "NAME") )
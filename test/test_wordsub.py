@@ -33,3 +33,16 @@ class TestWordSub( unittest.TestCase ):
         outStr = "I Would like one banana, one Pear and one APPLE."
         self.assertEqual( outStr, self.subber.sub(inStr) )
 
+    def test03_cache( self ):
+        '''test the result cache'''
+        self.assertEqual( 0, self.subber.cacheSize() )
+        self.subber.setCacheSize( 2 )
+        for inStr in ("apple", "orange", "apple", "banana", "orange"):
+            self.subber.sub( inStr )
+        info = self.subber.cacheInfo()
+        self.assertEqual( (1, 4, 2, 2),
+                          (info["hits"], info["misses"], info["size"], info["maxSize"]) )
+        # changing the substitutions invalidates it
+        self.subber["apple"] = "cherry"
+        self.assertEqual( 0, self.subber.cacheInfo()["size"] )
+        self.assertEqual( "cherry", self.subber.sub("apple") )